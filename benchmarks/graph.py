@@ -0,0 +1,105 @@
+"""Compare building graph responses via arguebuf objects against writing the
+protobuf directly, for graphs of increasing size.
+
+Run with `poetry run python -m benchmarks.graph`.
+Each ADU except the first supports its predecessor, so a graph of n ADUs has
+n atom nodes, n - 1 scheme nodes and 2 (n - 1) edges. Both paths are checked to
+produce the same graph (apart from ids and timestamps) before they are timed.
+"""
+
+import argparse
+import statistics
+import time
+
+import arguebuf
+from arg_services.graph.v1 import graph_pb2
+
+from mining.graphconstruction.model import GraphConstructor
+
+
+def _relations(adus: int) -> tuple[dict[str, str], list[dict[str, str]]]:
+    texts = {str(idx): f"ADU number {idx}" for idx in range(adus)}
+    relations = [
+        {
+            "source": str(idx),
+            "target": str(idx - 1),
+            "type": "attack" if idx % 3 == 0 else "support",
+        }
+        for idx in range(1, adus)
+    ]
+
+    return texts, relations
+
+
+def _arguebuf(texts, relations) -> graph_pb2.Graph:
+    return arguebuf.dump.protobuf(
+        GraphConstructor.graph_from_relations(texts, relations)
+    )
+
+
+def _direct(texts, relations) -> graph_pb2.Graph:
+    return GraphConstructor.protobuf_from_relations(texts, relations)
+
+
+_paths = {"arguebuf": _arguebuf, "direct": _direct}
+
+
+def _shape(graph: graph_pb2.Graph) -> tuple:
+    # ids are random, so edges are compared by the content of their endpoints
+    def content(node_id: str) -> str:
+        node = graph.nodes[node_id]
+        if node.WhichOneof("type") == "atom":
+            return node.atom.text
+        return node.scheme.WhichOneof("type")
+
+    return (
+        sorted(content(node_id) for node_id in graph.nodes),
+        sorted(
+            (content(edge.source), content(edge.target))
+            for edge in graph.edges.values()
+        ),
+        graph.schema_version,
+        graph.library_version,
+    )
+
+
+def measure(adus: int, repeat: int) -> dict[str, float]:
+    texts, relations = _relations(adus)
+
+    if _shape(_arguebuf(texts, relations)) != _shape(_direct(texts, relations)):
+        raise AssertionError(f"Graphs with {adus} ADUs differ")
+
+    results = {}
+
+    for name, path in _paths.items():
+        latencies = []
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+            path(texts, relations).SerializeToString()
+            latencies.append(time.perf_counter() - start)
+
+        results[name] = statistics.median(latencies) * 1000
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--adus", type=int, nargs="+", default=[10, 100, 500, 1000, 5000]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for adus in args.adus:
+        stats = measure(adus, args.repeat)
+        print(
+            f"{adus:>6} ADUs: arguebuf {stats['arguebuf']:9.2f} ms, "
+            f"direct {stats['direct']:9.2f} ms, "
+            f"speedup {stats['arguebuf'] / stats['direct']:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
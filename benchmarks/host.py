@@ -0,0 +1,98 @@
+"""Compare the memory of the three separate servers against the combined host.
+
+Run with `poetry run python -m benchmarks.host`.
+Both deployments are started as subprocesses on the default ports, one after
+the other. Once all ports accept connections and a segmentation request has
+loaded the spaCy pipeline, the resident (RSS) and proportional (PSS) set sizes
+of all server processes are summed up. No upstream calls are made.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import grpc
+from arg_services.mining.v1beta import adu_pb2, adu_pb2_grpc
+
+from host import SERVICES
+from mining.extraction import nlp
+
+_SEPARATE = [[f"{name}.server"] for name in SERVICES]
+_COMBINED = [["host"]]
+
+
+def _memory_mb(pid: int) -> tuple[float, float]:
+    """RSS and PSS of a process."""
+
+    values = {}
+
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+
+            if key in ("Rss", "Pss"):
+                values[key] = int(rest.split()[0]) / 1024
+
+    return values["Rss"], values["Pss"]
+
+
+def _wait_ready(timeout: float) -> None:
+    for port in SERVICES.values():
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            grpc.channel_ready_future(channel).result(timeout=timeout)
+
+    with grpc.insecure_channel(f"localhost:{SERVICES['mining']}") as channel:
+        adu_pb2_grpc.AduServiceStub(channel).Segmentation(
+            adu_pb2.SegmentationRequest(text="Load the pipeline. Then measure.")
+        )
+
+
+def measure(modules: list[list[str]], timeout: float) -> tuple[float, float]:
+    env = {**os.environ, "GRPC_PROCESSES": "1"}
+    env.setdefault("OPENAI_API_KEY", "unused")
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", *module],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        for module in modules
+    ]
+
+    try:
+        _wait_ready(timeout)
+        # let the servers settle after the first request
+        time.sleep(1)
+        usage = [_memory_mb(process.pid) for process in processes]
+    finally:
+        for process in processes:
+            process.terminate()
+
+        for process in processes:
+            process.wait()
+
+    return sum(rss for rss, _ in usage), sum(pss for _, pss in usage)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--spacy-model", default=nlp.DEFAULT_PIPELINE)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    os.environ["SPACY_MODEL"] = args.spacy_model
+    os.environ.pop("HOST_SERVICES", None)
+    os.environ.pop("HOST_PORTS", None)
+
+    for name, modules in (("separate", _SEPARATE), ("combined", _COMBINED)):
+        rss, pss = measure(modules, args.timeout)
+        print(
+            f"{name:>8}: {len(modules)} processes, "
+            f"rss {rss:7.1f} MB, pss {pss:7.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
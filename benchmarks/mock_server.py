@@ -0,0 +1,260 @@
+"""OpenAI-compatible stand-in server that answers chat completions of all services
+with canned payloads after a configurable delay.
+
+Run it standalone with `poetry run python -m benchmarks.mock_server` and point the
+services to it with `OPENAI_BASE_URL=http://localhost:8000/v1`.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+
+def _user_payload(body: dict[str, Any]) -> dict[str, Any]:
+    try:
+        return json.loads(body["messages"][-1]["content"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return {}
+
+
+def _function_arguments(name: str, body: dict[str, Any]) -> dict[str, Any]:
+    payload = _user_payload(body)
+    ids = list(payload.get("adus", {}))
+
+    if name == "extract_adus":
+        text = body["messages"][-1]["content"]
+        return {
+            "adus": [{"text": sentence} for sentence in text.split(". ") if sentence]
+        }
+
+    if name == "major_claim_rating":
+        return {
+            "major_claim_probabilities": [
+                {"id": id, "probability": 1 / (idx + 1)} for idx, id in enumerate(ids)
+            ]
+        }
+
+    if name == "predict_relations":
+        # graph construction attaches everything to the major claim,
+        # entailment prediction builds a chain of supports
+        root = payload.get("major_claim_id")
+
+        if root is not None:
+            pairs = [(id, root) for id in ids if id != root]
+        else:
+            pairs = list(zip(ids[1:], ids))
+
+        return {
+            "relations": [
+                {"source": source, "target": target, "type": "support"}
+                for source, target in pairs
+            ]
+        }
+
+    if name == "mine_argument":
+        return {
+            "relations": [
+                {"source": source, "target": target, "type": "support"}
+                for source, target in zip(ids[2:], ids[1:])
+            ],
+            "major_claim_probabilities": [
+                {"id": id, "probability": 1 / (idx + 1)} for idx, id in enumerate(ids)
+            ],
+            "root_relations": [
+                {"source": id, "target": ids[0], "type": "support"} for id in ids[1:2]
+            ],
+        }
+
+    if name == "compare_premises":
+        return {
+            "comparisons": [
+                {
+                    "pair": pair["pair"],
+                    "premise1_score": round(random.random(), 2),
+                    "premise2_score": round(random.random(), 2),
+                }
+                for pair in payload.get("pairs", [])
+            ]
+        }
+
+    return {}
+
+
+def _content(body: dict[str, Any]) -> str:
+    """JSON content for the quality and ranking services, which do not force a function."""
+
+    payload = _user_payload(body)
+
+    if "premise1" in payload:
+        return json.dumps(
+            {
+                "premise1_score": str(round(random.random(), 2)),
+                "premise2_score": str(round(random.random(), 2)),
+                "explanation": "Canned explanation of the mock server",
+            }
+        )
+
+    return json.dumps(
+        {
+            "adus": [
+                {
+                    "text": adu,
+                    "stance": random.uniform(-1, 1),
+                    "frame": random.random(),
+                    "meaning": random.random(),
+                    "hierarchic": random.random(),
+                }
+                for adu in payload.get("adus", [])
+            ]
+        }
+    )
+
+
+def completion(body: dict[str, Any]) -> dict[str, Any]:
+    function_call = body.get("function_call")
+    message: dict[str, Any] = {"role": "assistant", "content": None}
+
+    if isinstance(function_call, dict):
+        name = function_call["name"]
+        message["function_call"] = {
+            "name": name,
+            "arguments": json.dumps(_function_arguments(name, body)),
+        }
+    else:
+        message["content"] = _content(body)
+
+    prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+    completion_tokens = len(json.dumps(message)) // 4
+
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+class MockOpenAI:
+    """Threaded mock server, usable as a context manager."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.5,
+        jitter: float = 0.1,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.requests = 0
+        self._requests_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, payload: Any, headers=()) -> None:
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+
+                for key, value in headers:
+                    self.send_header(key, value)
+
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with mock._requests_lock:
+                    mock.requests += 1
+
+                time.sleep(max(0.0, mock.latency + random.uniform(-1, 1) * mock.jitter))
+                roll = random.random()
+
+                if roll < mock.throttle_rate:
+                    self._send(
+                        429,
+                        {"error": {"message": "Rate limited", "type": "requests"}},
+                        [("retry-after-ms", "100")],
+                    )
+                elif roll < mock.throttle_rate + mock.error_rate:
+                    self._send(
+                        500, {"error": {"message": "Mock failure", "type": "server"}}
+                    )
+                else:
+                    self._send(200, completion(body))
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        return Handler
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def start(self) -> "MockOpenAI":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockOpenAI":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    mock = MockOpenAI(
+        args.host,
+        args.port,
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.throttle_rate,
+    )
+    print(f"Mock server listening on {mock.url}")
+    mock.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Measure how candidate-pair pruning of entailment prediction trades recall for
+upstream cost.
+
+Run with `poetry run python -m benchmarks.pruning [FILE...]`.
+The sentences of each text (by default the example of `mining.client`) are
+classified once without pruning, which serves as reference, and once for every
+number of candidates given with `--candidates`. For each, it reports:
+
+- candidate recall: share of reference relations whose pair is a candidate,
+  i.e., the best recall pruning can reach
+- relation recall: share of reference relations that the pruned run predicted
+- the number of candidate pairs, completions and prompt tokens
+
+It uses the upstream configured in the environment, pass `--mock` to use
+`benchmarks.mock_server` instead (which only makes the cost figures meaningful).
+"""
+
+import argparse
+import os
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from common.gateway import LLMGateway
+from common.metrics import RpcStats, current_rpc
+from common.similarity import candidate_pairs
+from mining.client import text as example_text
+from mining.entailment.model import EntailmentClassifier, Relation
+from mining.extraction import nlp
+
+from .mock_server import MockOpenAI
+
+
+def _predict(
+    classifier: EntailmentClassifier, adus: dict[str, str]
+) -> tuple[list[Relation], RpcStats, float]:
+    stats = RpcStats("pruning")
+    token = current_rpc.set(stats)
+    start = time.perf_counter()
+
+    try:
+        return classifier.predict(adus), stats, time.perf_counter() - start
+    finally:
+        current_rpc.reset(token)
+
+
+def _recall(relations: list[Relation], reference: set[tuple[str, str]]) -> float:
+    if not reference:
+        return 1.0
+
+    predicted = {(relation.source, relation.target) for relation in relations}
+
+    return len(predicted & reference) / len(reference)
+
+
+def _report(name: str, pairs: int, stats: RpcStats, seconds: float, **recall) -> None:
+    print(
+        f"{name:>10}: {pairs:6} pairs, {stats.llm_calls:4} completions, "
+        f"{stats.prompt_tokens:8} prompt tokens, {seconds:7.2f} s",
+        *(f"{key.replace('_', ' ')} {value:5.1%}" for key, value in recall.items()),
+        sep=", " if recall else "",
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="*", type=Path)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--model", default="gpt-4-turbo-preview")
+    parser.add_argument("--spacy-model", default=nlp.DEFAULT_PIPELINE)
+    parser.add_argument("--mock", action="store_true")
+    args = parser.parse_args()
+
+    texts = [path.read_text() for path in args.files] or [example_text]
+
+    with ExitStack() as stack:
+        if args.mock:
+            mock = stack.enter_context(MockOpenAI(latency=0.01, jitter=0))
+            os.environ["OPENAI_BASE_URL"] = mock.url
+            os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+        gateway = LLMGateway.from_env()
+        # every run has to reach the upstream
+        gateway.cache = None
+
+        for text, doc in zip(texts, nlp.parse(texts, args.spacy_model)):
+            sentences = [sent.text for sent in doc.sents if sent.text.strip()]
+            adus = {str(idx): sentence for idx, sentence in enumerate(sentences)}
+            size = len(adus)
+            print(f"{size} ADUs, {size * (size - 1) // 2} pairs")
+
+            unpruned = EntailmentClassifier(args.model, gateway)
+            relations, stats, seconds = _predict(unpruned, adus)
+            reference = {(relation.source, relation.target) for relation in relations}
+            _report("unpruned", size * (size - 1) // 2, stats, seconds)
+
+            for k in args.candidates:
+                pairs = {
+                    (str(first), str(second))
+                    for first, second in candidate_pairs(sentences, k)
+                }
+                candidate_recall = (
+                    sum(
+                        (source, target) in pairs or (target, source) in pairs
+                        for source, target in reference
+                    )
+                    / len(reference)
+                    if reference
+                    else 1.0
+                )
+                pruned = EntailmentClassifier(
+                    args.model,
+                    gateway,
+                    candidates=k,
+                    candidate_batch_size=args.batch_size,
+                )
+                relations, stats, seconds = _predict(pruned, adus)
+                _report(
+                    f"k={k}",
+                    len(pairs),
+                    stats,
+                    seconds,
+                    candidate_recall=candidate_recall,
+                    relation_recall=_recall(relations, reference),
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""Measure latency and throughput of all RPCs against a local mock of the OpenAI API.
+
+Run with `poetry run python -m benchmarks.run`.
+All servers run in-process on ephemeral ports and talk to `benchmarks.mock_server`,
+so no API key or network access is needed. The completion cache is disabled and
+every request is unique, so neither the cache nor single-flight hide upstream calls.
+Results are appended to `benchmarks/results.jsonl` and compared to the previous run
+with the same configuration.
+"""
+
+import argparse
+import asyncio
+import datetime
+import importlib.metadata
+import json
+import os
+import resource
+import statistics
+import subprocess
+import threading
+import time
+from concurrent import futures
+from pathlib import Path
+from typing import Any, Callable
+
+import grpc
+from arg_services.mining.v1beta import (
+    adu_pb2,
+    adu_pb2_grpc,
+    entailment_pb2,
+    entailment_pb2_grpc,
+    graph_construction_pb2,
+    graph_construction_pb2_grpc,
+    major_claim_pb2,
+    major_claim_pb2_grpc,
+    mining_pb2,
+    mining_pb2_grpc,
+)
+from arg_services.quality.v1beta import explanation_pb2, explanation_pb2_grpc
+from arg_services.ranking.v1beta import granularity_pb2, granularity_pb2_grpc
+
+import mining.server
+import quality.server
+import ranking.server
+from benchmarks.mock_server import MockOpenAI
+from common.gateway import LLMGateway, set_gateway
+from common.metrics import AsyncMetricsInterceptor, MetricsInterceptor
+from mining.client import text
+from mining.extraction import nlp
+
+ROOT = Path(__file__).parent.parent
+SENTENCES = [sentence for sentence in text.split(". ") if sentence]
+
+_SETTINGS = ("EXTRACTION_", "ENTAILMENT_", "PIPELINE_", "LLM_")
+
+# RPCs that need a spaCy pipeline on the server side
+SPACY_RPCS = {"Segmentation", "Classification", "RunPipeline"}
+
+
+def _segments(idx: int, count: int) -> list[str]:
+    # a per-request marker keeps requests distinct for single-flight
+    return [
+        f"[{idx}] {SENTENCES[(idx + offset) % len(SENTENCES)]}"
+        for offset in range(count)
+    ]
+
+
+def _adus(idx: int, count: int) -> dict[str, adu_pb2.Segment]:
+    return {
+        str(key): adu_pb2.Segment(text=segment)
+        for key, segment in enumerate(_segments(idx, count))
+    }
+
+
+def _rpcs(channel: grpc.Channel, adus: int) -> dict[str, Callable[[int], Any]]:
+    extraction = adu_pb2_grpc.AduServiceStub(channel)
+    entailment = entailment_pb2_grpc.EntailmentServiceStub(channel)
+    majorclaim = major_claim_pb2_grpc.MajorClaimServiceStub(channel)
+    graphconstruction = graph_construction_pb2_grpc.GraphConstructionServiceStub(
+        channel
+    )
+    mining_stub = mining_pb2_grpc.MiningServiceStub(channel)
+    explanation = explanation_pb2_grpc.QualityExplanationServiceStub(channel)
+    granularity = granularity_pb2_grpc.GranularityServiceStub(channel)
+
+    def chain(idx: int) -> list[entailment_pb2.Entailment]:
+        return [
+            entailment_pb2.Entailment(
+                premise_id=str(key),
+                claim_id=str(key - 1),
+                type=entailment_pb2.ENTAILMENT_TYPE_ENTAILMENT,
+            )
+            for key in range(1, adus)
+        ]
+
+    return {
+        "Segmentation": lambda idx: extraction.Segmentation(
+            adu_pb2.SegmentationRequest(text=". ".join(_segments(idx, adus)))
+        ),
+        "Classification": lambda idx: extraction.Classification(
+            adu_pb2.ClassificationRequest(
+                segments={
+                    str(key): segment
+                    for key, segment in enumerate(_segments(idx, adus))
+                }
+            )
+        ),
+        "Entailments": lambda idx: entailment.Entailments(
+            entailment_pb2.EntailmentsRequest(language="en", adus=_adus(idx, adus))
+        ),
+        "MajorClaim": lambda idx: majorclaim.MajorClaim(
+            major_claim_pb2.MajorClaimRequest(
+                language="en", segments=_adus(idx, adus), limit=3
+            )
+        ),
+        "GraphConstruction": lambda idx: graphconstruction.GraphConstruction(
+            graph_construction_pb2.GraphConstructionRequest(
+                language="en",
+                adus=_adus(idx, adus),
+                major_claim_id="0",
+                entailments=chain(idx),
+            )
+        ),
+        "Explain": lambda idx: explanation.Explain(
+            explanation_pb2.ExplainRequest(
+                claim=_segments(idx, 1)[0],
+                premise1=_segments(idx + 1, 1)[0],
+                premise2=_segments(idx + 2, 1)[0],
+            )
+        ),
+        "FineGranularClustering": lambda idx: granularity.FineGranularClustering(
+            granularity_pb2.FineGranularClusteringRequest(
+                query=_segments(idx, 1)[0], adus=_segments(idx + 1, adus)
+            )
+        ),
+        "RunPipeline": lambda idx: mining_stub.RunPipeline(
+            mining_pb2.RunPipelineRequest(texts=[". ".join(_segments(idx, adus))])
+        ),
+    }
+
+
+class _Server:
+    """All services on one ephemeral port, either sync or on a `grpc.aio` loop."""
+
+    def __init__(self, mode: str, workers: int):
+        self.mode = mode
+
+        if mode == "async":
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            self._server, self.port = self._run(self._start_async())
+        else:
+            self._server = grpc.server(
+                futures.ThreadPoolExecutor(workers),
+                interceptors=[MetricsInterceptor()],
+            )
+            self._add_servicers(self._server, False)
+            self.port = self._server.add_insecure_port("127.0.0.1:0")
+            self._server.start()
+
+    @staticmethod
+    def _add_servicers(server, asynchronous: bool) -> None:
+        mining.server.add_servicers(server, asynchronous)
+        quality.server.add_servicers(server, asynchronous)
+        ranking.server.add_servicers(server, asynchronous)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _start_async(self) -> tuple[grpc.aio.Server, int]:
+        server = grpc.aio.server(interceptors=[AsyncMetricsInterceptor()])
+        self._add_servicers(server, True)
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+
+        return server, port
+
+    def stop(self) -> None:
+        if self.mode == "async":
+            self._run(self._server.stop(None))
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        else:
+            self._server.stop(None)
+
+
+def _percentile(latencies: list[float], percent: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else float("nan")
+
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+def measure(
+    call: Callable[[int], Any], requests: int, concurrency: int, offset: int = 0
+) -> dict[str, float]:
+    def timed(idx: int) -> float | None:
+        start = time.perf_counter()
+
+        try:
+            call(offset + idx)
+        except grpc.RpcError:
+            return None
+
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+
+    with futures.ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(timed, range(requests)))
+
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency in results if latency is not None]
+
+    return {
+        "requests": requests,
+        "errors": requests - len(latencies),
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "rps": len(latencies) / elapsed,
+    }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _version() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        try:
+            return importlib.metadata.version("arg-services-llm")
+        except importlib.metadata.PackageNotFoundError:
+            return "unknown"
+
+
+def _previous(path: Path, config: dict[str, Any]) -> dict[str, Any] | None:
+    if not path.exists():
+        return None
+
+    previous = None
+
+    with path.open() as f:
+        for line in f:
+            entry = json.loads(line)
+
+            if entry["config"] == config:
+                previous = entry
+
+    return previous
+
+
+def _delta(current: float, previous: float | None) -> str:
+    if not previous:
+        return ""
+
+    return f" ({(current - previous) / previous:+.0%})"
+
+
+def report(results: dict[str, Any], previous: dict[str, Any] | None) -> None:
+    if previous is not None:
+        print(f"Compared to {previous['version']} ({previous['timestamp']})")
+
+    for rpc, stats in results["rpcs"].items():
+        before = (previous or {}).get("rpcs", {}).get(rpc, {})
+        print(
+            f"{rpc:>22}: "
+            f"p50 {stats['p50_ms']:8.1f} ms{_delta(stats['p50_ms'], before.get('p50_ms'))}, "
+            f"p95 {stats['p95_ms']:8.1f} ms{_delta(stats['p95_ms'], before.get('p95_ms'))}, "
+            f"p99 {stats['p99_ms']:8.1f} ms{_delta(stats['p99_ms'], before.get('p99_ms'))}, "
+            f"{stats['rps']:7.1f} req/s{_delta(stats['rps'], before.get('rps'))}, "
+            f"{stats['errors']} errors"
+        )
+
+    print(
+        f"Peak RSS {results['peak_rss_mb']:.1f} MB"
+        f"{_delta(results['peak_rss_mb'], (previous or {}).get('peak_rss_mb'))}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--rpcs", nargs="+", default=None)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--adus", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--spacy-model", default=nlp.DEFAULT_PIPELINE)
+    parser.add_argument(
+        "--results", type=Path, default=Path(__file__).parent / "results.jsonl"
+    )
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    config = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in {"results", "no_save"}
+    }
+    # server settings from the environment, e.g. PIPELINE_FUSED=1
+    config["env"] = {
+        key: value
+        for key, value in sorted(os.environ.items())
+        if key.startswith(_SETTINGS)
+    }
+
+    with MockOpenAI(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+    ) as mock:
+        os.environ["OPENAI_BASE_URL"] = mock.url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        os.environ["SPACY_MODEL"] = args.spacy_model
+        gateway = LLMGateway.from_env()
+        gateway.cache = None
+        set_gateway(gateway)
+
+        server = _Server(args.mode, args.workers)
+        skipped = set()
+
+        try:
+            nlp.load_pipeline(args.spacy_model)
+        except OSError:
+            print(f"spaCy pipeline {args.spacy_model} not found, skipping {SPACY_RPCS}")
+            skipped = SPACY_RPCS
+
+        results: dict[str, Any] = {
+            "version": _version(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "config": config,
+            "rpcs": {},
+        }
+
+        try:
+            with grpc.insecure_channel(f"127.0.0.1:{server.port}") as channel:
+                rpcs = _rpcs(channel, args.adus)
+
+                for rpc in args.rpcs or rpcs:
+                    if rpc in skipped:
+                        continue
+
+                    # warm up connections and lazily loaded models
+                    measure(rpcs[rpc], 1, 1, offset=-1)
+                    upstream_calls = mock.requests
+                    stats = measure(rpcs[rpc], args.requests, args.concurrency)
+                    stats["upstream_calls"] = mock.requests - upstream_calls
+                    results["rpcs"][rpc] = stats
+        finally:
+            server.stop()
+
+    results["peak_rss_mb"] = _peak_rss_mb()
+    results["limiter"] = gateway.limiter.stats()
+    report(results, _previous(args.results, config))
+
+    if not args.no_save:
+        with args.results.open("a") as f:
+            f.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Compare per-request segmentation latency and memory of the legacy
+`spacy.load` per call against the shared pipeline registry.
+
+Run with `poetry run python -m benchmarks.segmentation`.
+Each mode is measured in a fresh interpreter so that RSS numbers are not skewed
+by pipelines loaded by the other mode.
+
+With `--processes N...`, it instead compares segmentation on the calling thread
+against `SegmentationPool`s of N processes: the latency of one long document
+(the example text repeated `--paragraphs` times) and the throughput of
+`--requests` such documents segmented by concurrent threads, as a gRPC server
+would.
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent import futures
+
+import spacy
+
+from mining.client import text
+from mining.extraction import nlp
+from mining.extraction.model import Extractor
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+
+    return pages * resource.getpagesize() / 1024**2
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _legacy(texts: list[str], pipeline: str) -> None:
+    for t in texts:
+        list(spacy.load(pipeline)(t).sents)
+
+
+def _registry(texts: list[str], pipeline: str) -> None:
+    for t in texts:
+        list(next(nlp.parse([t], pipeline)).sents)
+
+
+def _batched(texts: list[str], pipeline: str) -> None:
+    for doc in nlp.parse(texts, pipeline):
+        list(doc.sents)
+
+
+_modes = {"legacy": _legacy, "registry": _registry, "batched": _batched}
+
+
+def measure(mode: str, requests: int, pipeline: str) -> dict[str, float | str]:
+    func = _modes[mode]
+    rss_before = _rss_mb()
+    latencies = []
+    load_start = time.perf_counter()
+
+    if mode != "legacy":
+        # the registry pays the load once per process, not once per request
+        nlp.load_pipeline(pipeline)
+
+    load_ms = (time.perf_counter() - load_start) * 1000
+
+    if mode == "batched":
+        start = time.perf_counter()
+        func([text] * requests, pipeline)
+        latencies.append((time.perf_counter() - start) / requests)
+    else:
+        for _ in range(requests):
+            start = time.perf_counter()
+            func([text], pipeline)
+            latencies.append(time.perf_counter() - start)
+
+    return {
+        "mode": mode,
+        "requests": requests,
+        "load_ms": load_ms,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "median_ms": statistics.median(latencies) * 1000,
+        "rss_before_mb": rss_before,
+        "rss_after_mb": _rss_mb(),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def scaling(
+    processes: list[int], requests: int, paragraphs: int, pipeline: str
+) -> None:
+    document = "\n\n".join([text.strip()] * paragraphs)
+    print(f"document of {len(document)} characters, {requests} concurrent requests")
+    # segmentation does not call the upstream, but the extractor creates a client
+    os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+    for count in [0, *processes]:
+        extractor = Extractor(spacy_model=pipeline, segmentation_processes=count)
+        # warm up the pipeline, in every worker process of the pool
+        extractor.divide_segments_batch([document] * max(count, 1))
+
+        start = time.perf_counter()
+        segments = extractor.divide_segments(document)
+        latency = time.perf_counter() - start
+
+        with futures.ThreadPoolExecutor(max_workers=requests) as executor:
+            start = time.perf_counter()
+            list(executor.map(extractor.divide_segments, [document] * requests))
+            throughput = requests / (time.perf_counter() - start)
+
+        if extractor.segmentation_pool is not None:
+            extractor.segmentation_pool.shutdown()
+
+        name = f"{count} procs" if count else "thread"
+        print(
+            f"{name:>8}: {len(segments)} segments, latency {latency * 1000:8.2f} ms, "
+            f"throughput {throughput:7.2f} documents/s"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mode", choices=_modes.keys())
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--pipeline", default=nlp.DEFAULT_PIPELINE)
+    parser.add_argument("--processes", type=int, nargs="+")
+    parser.add_argument("--paragraphs", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.processes:
+        scaling(args.processes, args.requests, args.paragraphs, args.pipeline)
+        return
+
+    if args.mode is not None:
+        print(json.dumps(measure(args.mode, args.requests, args.pipeline)))
+        return
+
+    for mode in _modes:
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.segmentation",
+                "--mode",
+                mode,
+                "--requests",
+                str(args.requests),
+                "--pipeline",
+                args.pipeline,
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        stats = json.loads(result.stdout)
+        print(
+            f"{mode:>8}: load {stats['load_ms']:8.2f} ms, "
+            f"mean {stats['mean_ms']:8.2f} ms, "
+            f"median {stats['median_ms']:8.2f} ms, "
+            f"rss {stats['rss_before_mb']:7.1f} -> {stats['rss_after_mb']:7.1f} MB, "
+            f"peak {stats['peak_rss_mb']:7.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
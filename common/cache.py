@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+class CompletionCache:
+    """Two-tier cache for chat completions keyed on a hash of the full request.
+
+    The first tier is a bounded in-memory LRU, the optional second tier a SQLite
+    database that survives restarts. Both tiers expire entries after `ttl` seconds.
+
+    The database is opened on first use in every process, so that workers forked
+    from a process that created the cache do not share its SQLite connection.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float | None = 7 * 24 * 60 * 60,
+        path: str | None = None,
+        max_disk_entries: int = 100_000,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._path = path
+        self._db: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._inherited: sqlite3.Connection | None = None
+
+    def _connection(self) -> sqlite3.Connection | None:
+        """The SQLite connection of this process, must be called with the lock."""
+
+        if self._path is None:
+            return None
+
+        if self._db is None or self._pid != os.getpid():
+            # a connection inherited through fork must neither be used nor closed,
+            # so it is kept referenced
+            self._inherited = self._db
+            self._db = sqlite3.connect(self._path, check_same_thread=False)
+            self._pid = os.getpid()
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions"
+                " (key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS completions_accessed"
+                " ON completions (accessed)"
+            )
+            self._db.commit()
+
+        return self._db
+
+    @staticmethod
+    def key(request: dict[str, Any]) -> str:
+        payload = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+
+            if entry is not None and not self._expired(entry[0], now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self._memory.pop(key, None)
+
+            if (db := self._connection()) is not None:
+                row = db.execute(
+                    "SELECT value, created FROM completions WHERE key = ?", (key,)
+                ).fetchone()
+
+                if row is not None and not self._expired(row[1], now):
+                    db.execute(
+                        "UPDATE completions SET accessed = ? WHERE key = ?",
+                        (now, key),
+                    )
+                    db.commit()
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, now, value)
+
+            if (db := self._connection()) is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                self._evict_disk(db, now)
+                db.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+
+            if (db := self._connection()) is not None:
+                db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                db.commit()
+
+    def _remember(self, key: str, created: float, value: str) -> None:
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, db: sqlite3.Connection, now: float) -> None:
+        if self.ttl is not None:
+            db.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl,))
+
+        db.execute(
+            "DELETE FROM completions WHERE key IN (SELECT key FROM completions"
+            " ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._memory),
+        }
+
+
+def _from_env() -> CompletionCache | None:
+    if os.getenv("LLM_CACHE", "1") == "0":
+        return None
+
+    ttl = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 60 * 60))
+
+    return CompletionCache(
+        max_entries=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+        ttl=ttl if ttl > 0 else None,
+        path=os.getenv("LLM_CACHE_PATH") or None,
+        max_disk_entries=int(os.getenv("LLM_CACHE_DISK_SIZE", "100000")),
+    )
+
+
+default_cache = _from_env()
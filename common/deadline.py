@@ -0,0 +1,137 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from typing import Callable
+
+import grpc
+
+# longer remaining times are not actual deadlines
+_MAX_TIMEOUT = 24 * 60 * 60
+
+
+class RequestAborted(Exception):
+    code = grpc.StatusCode.UNKNOWN
+
+
+class DeadlineExceeded(RequestAborted):
+    code = grpc.StatusCode.DEADLINE_EXCEEDED
+
+
+class RequestCancelled(RequestAborted):
+    code = grpc.StatusCode.CANCELLED
+
+
+class Deadline:
+    """Time budget and cancellation state of a single RPC."""
+
+    def __init__(self, timeout: float | None = None, cancellable: bool = False):
+        self.expires = None if timeout is None else time.monotonic() + timeout
+        self.cancellable = cancellable
+        self.cancelled = False
+        self._callbacks: list[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_context(cls, context) -> "Deadline":
+        # only sync contexts support callbacks, aio handlers are cancelled as tasks
+        cancellable = hasattr(context, "add_callback")
+        remaining = context.time_remaining()
+
+        # sync servers report a huge value instead of `None` without a deadline
+        if remaining is not None and remaining > _MAX_TIMEOUT:
+            remaining = None
+
+        deadline = cls(remaining, cancellable)
+
+        if cancellable:
+            # also invoked after regular completion, when nothing is left to cancel
+            context.add_callback(deadline.cancel)
+
+        return deadline
+
+    def remaining(self) -> float | None:
+        if self.expires is None:
+            return None
+
+        return self.expires - time.monotonic()
+
+    def check(self, minimum: float = 0.0) -> None:
+        """Raise if the RPC is gone or has less than `minimum` seconds left."""
+
+        if self.cancelled:
+            raise RequestCancelled("The request has been cancelled by the client")
+
+        remaining = self.remaining()
+
+        if remaining is not None and remaining < minimum:
+            raise DeadlineExceeded(
+                f"Only {max(remaining, 0):.2f}s left, at least {minimum:.2f}s needed"
+            )
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Call `callback` on cancellation and return a function that unregisters it."""
+
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+
+                def remove() -> None:
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+
+                return remove
+
+        callback()
+        return lambda: None
+
+
+current_deadline: contextvars.ContextVar[Deadline | None] = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+def propagate_deadline(func):
+    """Expose the deadline of the gRPC `context` to all LLM calls of an RPC.
+
+    Works for both sync and async servicer methods and turns `RequestAborted`
+    errors into the matching gRPC status.
+    """
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(self, request, context):
+            token = current_deadline.set(Deadline.from_context(context))
+
+            try:
+                return await func(self, request, context)
+            except RequestAborted as e:
+                await context.abort(e.code, str(e))
+            finally:
+                current_deadline.reset(token)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, request, context):
+        token = current_deadline.set(Deadline.from_context(context))
+
+        try:
+            return func(self, request, context)
+        except RequestAborted as e:
+            context.abort(e.code, str(e))
+        finally:
+            current_deadline.reset(token)
+
+    return wrapper
@@ -0,0 +1,396 @@
+import asyncio
+import concurrent.futures
+import importlib.util
+import os
+import threading
+import time
+from typing import Any, Callable, TypeVar, cast
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletion
+
+from . import metrics
+from .cache import CompletionCache, default_cache
+from .deadline import Deadline, RequestCancelled, current_deadline
+from .ratelimit import AdaptiveConcurrency, RateLimiter, estimate_tokens, retry_after
+
+T = TypeVar("T")
+
+_retryable_errors = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def _unparsed(completion: ChatCompletion) -> Any:
+    return completion
+
+
+class LLMGateway:
+    """Single entry point for all chat completions of a process.
+
+    The gateway owns one pooled HTTP client per flavor (sync and async), so all
+    servicers share keep-alive connections and the same endpoint configuration.
+    Requests are served from `cache` if possible and otherwise pass through
+    `limiter`, which also decides when failed requests are retried. Completions
+    are only cached once the `parse` function of the caller accepted them.
+
+    If the calling RPC has a deadline (see `common.deadline`), calls that cannot
+    get at least `min_time_budget` seconds are rejected and the remaining time is
+    used as upstream timeout. Cancelled RPCs make no further upstream calls. With
+    `cancel_in_flight`, sync calls of cancellable RPCs run on a background event loop
+    owned by the gateway instead of the pooled sync client, so that a cancellation
+    also aborts the request in flight (async calls are always aborted).
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        base_url: str | None = None,
+        model: str | None = None,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool | None = None,
+        timeout: float = 600.0,
+        cache: CompletionCache | None = default_cache,
+        limiter: RateLimiter | None = None,
+        max_retries: int = 3,
+        min_time_budget: float = 1.0,
+        cancel_in_flight: bool = False,
+    ):
+        if http2 is None:
+            # httpx only speaks HTTP/2 if the optional h2 package is installed
+            http2 = importlib.util.find_spec("h2") is not None
+
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+
+        self.model = model
+        self.cache = cache
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.min_time_budget = min_time_budget
+        self.timeout = timeout
+        self.cancel_in_flight = cancel_in_flight
+        self._async_client_options = dict(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=0,
+            limits=limits,
+            http2=http2,
+        )
+        self._background_loop: asyncio.AbstractEventLoop | None = None
+        self._background_client: openai.AsyncOpenAI | None = None
+        self._background_lock = threading.Lock()
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            # retries are handled by the gateway so that the limiter sees them
+            max_retries=0,
+            http_client=httpx.Client(limits=limits, http2=http2, timeout=timeout),
+        )
+        self.async_client = self._create_async_client()
+
+    def _create_async_client(self) -> openai.AsyncOpenAI:
+        options = dict(self._async_client_options)
+        limits = options.pop("limits")
+        http2 = options.pop("http2")
+
+        return openai.AsyncOpenAI(
+            **options,
+            http_client=httpx.AsyncClient(
+                limits=limits, http2=http2, timeout=options["timeout"]
+            ),
+        )
+
+    @classmethod
+    def from_env(cls) -> "LLMGateway":
+        http2 = os.getenv("LLM_HTTP2", "auto")
+
+        return cls(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            # point this to a local OpenAI-compatible server for testing
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            model=os.getenv("LLM_MODEL") or None,
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30")),
+            http2=None if http2 == "auto" else http2 == "1",
+            timeout=float(os.getenv("LLM_TIMEOUT", "600")),
+            limiter=RateLimiter(
+                requests_per_minute=float(os.getenv("LLM_RPM", "0")) or None,
+                tokens_per_minute=float(os.getenv("LLM_TPM", "0")) or None,
+                concurrency=AdaptiveConcurrency(
+                    initial=int(os.getenv("LLM_CONCURRENCY", "16")),
+                    minimum=int(os.getenv("LLM_MIN_CONCURRENCY", "1")),
+                    maximum=int(os.getenv("LLM_MAX_CONCURRENCY", "256")),
+                    target_latency=float(os.getenv("LLM_TARGET_LATENCY", "0")) or None,
+                ),
+            ),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            min_time_budget=float(os.getenv("LLM_MIN_TIME_BUDGET", "1")),
+            cancel_in_flight=os.getenv("LLM_CANCEL_IN_FLIGHT", "0") == "1",
+        )
+
+    def resolve_model(self, model: str) -> str:
+        """Return the configured model override, falling back to `model`."""
+
+        return self.model or model
+
+    def _cached(self, request: dict[str, Any]) -> tuple[str | None, Any]:
+        if self.cache is None:
+            return None, None
+
+        key = self.cache.key(request)
+        cached = self.cache.get(key)
+        metrics.record_cache(request["model"], hit=cached is not None)
+
+        if cached is None:
+            return key, None
+
+        return key, ChatCompletion.model_validate_json(cached)
+
+    def _store(self, key: str | None, completion: ChatCompletion) -> None:
+        if self.cache is not None and key is not None:
+            self.cache.set(key, completion.model_dump_json())
+
+    def _parse_cached(
+        self, key: str | None, completion: ChatCompletion, parse: Callable[..., T]
+    ) -> tuple[bool, T | None]:
+        """Parse a cached completion, evicting it if it cannot be parsed (e.g., if
+        it was stored by an older version of the caller)."""
+
+        try:
+            return True, parse(completion)
+        except Exception:
+            if self.cache is not None and key is not None:
+                self.cache.delete(key)
+
+            return False, None
+
+    def _succeeded(
+        self,
+        request: dict[str, Any],
+        completion: ChatCompletion,
+        start: float,
+        tokens: int,
+    ) -> ChatCompletion:
+        latency = time.monotonic() - start
+        used_tokens = completion.usage.total_tokens if completion.usage else None
+        self.limiter.release(latency, tokens, used_tokens)
+        metrics.record_completion(request["model"], completion, latency)
+
+        return completion
+
+    def _failed(
+        self, error: Exception, start: float, tokens: int, attempt: int
+    ) -> float:
+        """Release the limiter after a failed call and return the retry delay."""
+
+        latency = time.monotonic() - start
+
+        if not isinstance(error, _retryable_errors):
+            self.limiter.release(latency, tokens, failed=True)
+            raise error
+
+        if isinstance(error, openai.RateLimitError):
+            # the limiter pauses all callers, so no extra delay is needed
+            self.limiter.throttle(latency, retry_after(error))
+            delay = 0.0
+        else:
+            self.limiter.release(latency, tokens, failed=True)
+            delay = min(8.0, 0.5 * 2**attempt)
+
+        if attempt >= self.max_retries:
+            raise error
+
+        return delay
+
+    def _options(self, deadline: Deadline | None) -> dict[str, Any]:
+        """Check the deadline and derive the per-request options from it."""
+
+        if deadline is None:
+            return {}
+
+        deadline.check(self.min_time_budget)
+        remaining = deadline.remaining()
+
+        return {} if remaining is None else {"timeout": min(remaining, self.timeout)}
+
+    def _create(
+        self, request: dict[str, Any], deadline: Deadline | None
+    ) -> ChatCompletion:
+        tokens = estimate_tokens(request)
+        attempt = 0
+
+        while True:
+            if deadline is not None:
+                # reject early, before waiting for the limiter
+                deadline.check(self.min_time_budget)
+
+            self.limiter.acquire(tokens, deadline)
+            start = time.monotonic()
+
+            try:
+                completion = self.client.chat.completions.create(
+                    **request, **self._options(deadline)
+                )
+            except Exception as e:
+                time.sleep(self._failed(e, start, tokens, attempt))
+                attempt += 1
+            except BaseException:
+                self.limiter.release(time.monotonic() - start, tokens, failed=True)
+                raise
+            else:
+                return self._succeeded(request, completion, start, tokens)
+
+    async def _acreate(
+        self,
+        client: openai.AsyncOpenAI,
+        request: dict[str, Any],
+        deadline: Deadline | None,
+    ) -> ChatCompletion:
+        tokens = estimate_tokens(request)
+        attempt = 0
+
+        while True:
+            if deadline is not None:
+                deadline.check(self.min_time_budget)
+
+            await self.limiter.aacquire(tokens, deadline)
+            start = time.monotonic()
+
+            try:
+                completion = await client.chat.completions.create(
+                    **request, **self._options(deadline)
+                )
+            except Exception as e:
+                await asyncio.sleep(self._failed(e, start, tokens, attempt))
+                attempt += 1
+            except BaseException:
+                self.limiter.release(time.monotonic() - start, tokens, failed=True)
+                raise
+            else:
+                return self._succeeded(request, completion, start, tokens)
+
+    def _background(self) -> tuple[asyncio.AbstractEventLoop, openai.AsyncOpenAI]:
+        with self._background_lock:
+            if self._background_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever, name="llm-gateway", daemon=True
+                ).start()
+                self._background_loop = loop
+                self._background_client = self._create_async_client()
+
+        assert self._background_client is not None
+
+        return self._background_loop, self._background_client
+
+    def _create_cancellable(
+        self, request: dict[str, Any], deadline: Deadline
+    ) -> ChatCompletion:
+        loop, client = self._background()
+        rpc = metrics.current_rpc.get()
+
+        async def create() -> ChatCompletion:
+            # tasks of the background loop do not inherit the caller's context
+            metrics.current_rpc.set(rpc)
+            return await self._acreate(client, request, deadline)
+
+        future = asyncio.run_coroutine_threadsafe(create(), loop)
+        # cancelling the future cancels the task and thus the HTTP request
+        remove_callback = deadline.add_callback(future.cancel)
+
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            raise RequestCancelled("The request has been cancelled by the client")
+        finally:
+            remove_callback()
+
+    def complete(
+        self,
+        deadline: Deadline | None = None,
+        parse: Callable[[ChatCompletion], T] = _unparsed,
+        **request: Any,
+    ) -> T:
+        """Return `parse(completion)` for the completion of `request`.
+
+        The completion is only cached if `parse` does not raise, so malformed
+        completions are requested again instead of being served from the cache.
+        """
+
+        deadline = deadline or current_deadline.get()
+        key, completion = self._cached(request)
+
+        if completion is not None:
+            parsed, result = self._parse_cached(key, completion, parse)
+
+            if parsed:
+                return cast(T, result)
+
+        if self.cancel_in_flight and deadline is not None and deadline.cancellable:
+            completion = self._create_cancellable(request, deadline)
+        else:
+            completion = self._create(request, deadline)
+
+        result = parse(completion)
+        self._store(key, completion)
+
+        return result
+
+    async def acomplete(
+        self,
+        deadline: Deadline | None = None,
+        parse: Callable[[ChatCompletion], T] = _unparsed,
+        **request: Any,
+    ) -> T:
+        """Async variant of `complete`."""
+
+        deadline = deadline or current_deadline.get()
+        key, completion = self._cached(request)
+
+        if completion is not None:
+            parsed, result = self._parse_cached(key, completion, parse)
+
+            if parsed:
+                return cast(T, result)
+
+        completion = await self._acreate(self.async_client, request, deadline)
+        result = parse(completion)
+        self._store(key, completion)
+
+        return result
+
+
+_gateway: LLMGateway | None = None
+_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """Return the process-wide gateway, creating it from the environment on first use."""
+
+    global _gateway
+
+    if _gateway is None:
+        with _lock:
+            if _gateway is None:
+                _gateway = LLMGateway.from_env()
+
+    return _gateway
+
+
+def set_gateway(gateway: LLMGateway) -> None:
+    """Replace the process-wide gateway, e.g. to point all services to a stand-in server."""
+
+    global _gateway
+    _gateway = gateway
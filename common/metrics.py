@@ -0,0 +1,401 @@
+"""Process-wide RPC and LLM metrics in the Prometheus text format.
+
+`MetricsInterceptor` (or `AsyncMetricsInterceptor` for `grpc.aio`) times every
+RPC and exposes its method to the gateway and the response parsers, which record
+upstream latency, token usage, cache hits and parse time for it.
+"""
+
+import bisect
+import contextvars
+import dataclasses
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterable
+
+import grpc
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _labels(names: Iterable[str], values: Iterable[str], **extra: str) -> str:
+    pairs = [*zip(names, values), *extra.items()]
+
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+            *(
+                f"{self.name}{_labels(self.labelnames, key)} {value}"
+                for key, value in sorted(values.items())
+            ),
+        ]
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...],
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # per label set: counts per bucket (plus +Inf), sum
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = {
+                key: (list(counts), total)
+                for key, (counts, total) in self._values.items()
+            }
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _labels(self.labelnames, key, le=str(bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = _labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Counter | Histogram] = []
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        metric = Counter(name, documentation, tuple(labelnames))
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames=()) -> Histogram:
+        metric = Histogram(name, documentation, tuple(labelnames))
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return (
+            "\n".join(line for metric in self.metrics for line in metric.render())
+            + "\n"
+        )
+
+
+registry = Registry()
+
+rpc_seconds = registry.histogram(
+    "grpc_server_handling_seconds", "Latency of handled RPCs", ("method", "code")
+)
+llm_seconds = registry.histogram(
+    "llm_request_seconds", "Latency of successful upstream calls", ("method", "model")
+)
+llm_tokens = registry.counter(
+    "llm_tokens_total", "Tokens used by upstream calls", ("method", "model", "kind")
+)
+llm_cache = registry.counter(
+    "llm_cache_requests_total",
+    "Completion requests by cache result",
+    ("method", "model", "result"),
+)
+parse_seconds = registry.histogram(
+    "llm_parse_seconds", "Time spent parsing completions", ("method", "parser")
+)
+
+
+@dataclasses.dataclass
+class RpcStats:
+    """Totals of a single RPC, shared by all threads and tasks working on it."""
+
+    method: str
+    llm_calls: int = 0
+    cache_hits: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    llm_seconds: float = 0.0
+    parse_seconds: float = 0.0
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, repr=False
+    )
+
+    def add(self, **values: float) -> None:
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def asdict(self) -> dict[str, Any]:
+        return {
+            field.name: getattr(self, field.name)
+            for field in dataclasses.fields(self)
+            if not field.name.startswith("_")
+        }
+
+
+current_rpc: contextvars.ContextVar[RpcStats | None] = contextvars.ContextVar(
+    "current_rpc", default=None
+)
+
+
+def _method() -> str:
+    stats = current_rpc.get()
+    return "" if stats is None else stats.method
+
+
+def record_cache(model: str, hit: bool) -> None:
+    llm_cache.inc(method=_method(), model=model, result="hit" if hit else "miss")
+
+    if hit and (stats := current_rpc.get()) is not None:
+        stats.add(cache_hits=1)
+
+
+def record_completion(model: str, completion: Any, latency: float) -> None:
+    """Record a successful upstream call and the tokens reported in its usage."""
+
+    method = _method()
+    usage = completion.usage
+    prompt_tokens = usage.prompt_tokens if usage else 0
+    completion_tokens = usage.completion_tokens if usage else 0
+
+    llm_seconds.observe(latency, method=method, model=model)
+    llm_tokens.inc(prompt_tokens, method=method, model=model, kind="prompt")
+    llm_tokens.inc(completion_tokens, method=method, model=model, kind="completion")
+
+    if (stats := current_rpc.get()) is not None:
+        stats.add(
+            llm_calls=1,
+            llm_seconds=latency,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+        )
+
+
+def timed_parse(func):
+    """Record the time a method needs to turn a completion into a result."""
+
+    parser = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            parse_seconds.observe(elapsed, method=_method(), parser=parser)
+
+            if (stats := current_rpc.get()) is not None:
+                stats.add(parse_seconds=elapsed)
+
+    return wrapper
+
+
+def _code_name(context, default: grpc.StatusCode) -> str:
+    code = context.code()
+
+    if code is None:
+        return default.name
+
+    # aio contexts may report the raw integer status
+    if not isinstance(code, grpc.StatusCode):
+        code = next((c for c in grpc.StatusCode if c.value[0] == code), default)
+
+    return code.name
+
+
+def _finish(stats: RpcStats, code: str, start: float) -> None:
+    elapsed = time.perf_counter() - start
+    rpc_seconds.observe(elapsed, method=stats.method, code=code)
+    logger.info(
+        "%s finished with %s in %.3fs",
+        stats.method,
+        code,
+        elapsed,
+        extra={"fields": {**stats.asdict(), "code": code, "seconds": elapsed}},
+    )
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """Time unary RPCs and collect the LLM usage of each one."""
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+
+        if handler is None or handler.unary_unary is None:
+            return handler
+
+        method = handler_call_details.method
+        behavior = handler.unary_unary
+
+        def wrapper(request, context):
+            stats = RpcStats(method)
+            token = current_rpc.set(stats)
+            start = time.perf_counter()
+            code = grpc.StatusCode.UNKNOWN
+
+            try:
+                response = behavior(request, context)
+                code = grpc.StatusCode.OK
+                return response
+            finally:
+                current_rpc.reset(token)
+                _finish(stats, _code_name(context, code), start)
+
+        return grpc.unary_unary_rpc_method_handler(
+            wrapper,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """`MetricsInterceptor` for `grpc.aio` servers."""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+
+        if handler is None or handler.unary_unary is None:
+            return handler
+
+        method = handler_call_details.method
+        behavior = handler.unary_unary
+
+        async def wrapper(request, context):
+            stats = RpcStats(method)
+            token = current_rpc.set(stats)
+            start = time.perf_counter()
+            code = grpc.StatusCode.UNKNOWN
+
+            try:
+                response = await behavior(request, context)
+                code = grpc.StatusCode.OK
+                return response
+            finally:
+                current_rpc.reset(token)
+                _finish(stats, _code_name(context, code), start)
+
+        return grpc.unary_unary_rpc_method_handler(
+            wrapper,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
+
+
+def start_http_server(port: int, host: str = "") -> ThreadingHTTPServer:
+    """Serve `registry` for Prometheus scrapes on a background thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            data = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+
+    return server
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including the `fields` passed as `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+def setup_logging() -> None:
+    """Configure logging as set in the environment."""
+
+    handler = logging.StreamHandler()
+
+    if os.getenv("LOG_FORMAT", "text") == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"), handlers=[handler])
+
+
+def setup_from_env() -> None:
+    """Configure logging and start the scrape endpoint as set in the environment."""
+
+    setup_logging()
+
+    if port := int(os.getenv("METRICS_PORT", "0")):
+        start_http_server(port)
+        print(f"Metrics available on port {port}")
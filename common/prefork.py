@@ -0,0 +1,290 @@
+"""Pre-fork launcher running a gRPC server in several worker processes.
+
+A single process parses, decodes JSON and builds protobufs under one GIL.
+`serve` instead forks `processes` workers that bind the same address with
+`SO_REUSEPORT`, so that the kernel distributes incoming connections among them.
+Expensive resources (e.g., spaCy pipelines) are loaded by `preload` before
+forking and shared copy-on-write. Everything that starts threads or opens
+connections (gRPC servers, LLM clients, metrics endpoint) is created in the
+workers only.
+
+The parent supervises the workers: a worker that exits is replaced, and SIGTERM
+or SIGINT stop all workers gracefully, killing those that exceed the grace period.
+Workers failing right after their start are restarted with an exponentially
+growing delay. If one keeps failing, all workers are stopped and the launcher
+exits with status 1.
+"""
+
+import asyncio
+import gc
+import logging
+import os
+import signal
+import sys
+import time
+from concurrent import futures
+from typing import Callable, Sequence
+
+import grpc
+
+from common.metrics import (
+    AsyncMetricsInterceptor,
+    MetricsInterceptor,
+    setup_from_env,
+    setup_logging,
+)
+
+logger = logging.getLogger(__name__)
+
+AddServicers = Callable[..., None]
+
+# workers exiting sooner after their start are restarted with a delay that
+# doubles with every consecutive early exit, up to `_MAX_RESTARTS` times
+_MIN_UPTIME = 5.0
+_RESTART_DELAY = 1.0
+_MAX_RESTART_DELAY = 30.0
+_MAX_RESTARTS = 5
+
+
+def _server_options() -> list[tuple[str, int]]:
+    return [("grpc.so_reuseport", 1)]
+
+
+def _serve_sync(
+    add_servicers: AddServicers,
+    addresses: Sequence[str],
+    max_workers: int,
+    grace: float,
+) -> None:
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=max_workers),
+        interceptors=[MetricsInterceptor()],
+        options=_server_options(),
+    )
+    add_servicers(server)
+
+    for address in addresses:
+        server.add_insecure_port(address)
+
+    server.start()
+
+    def stop(signum, frame) -> None:
+        server.stop(grace)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.wait_for_termination()
+
+
+async def _serve_async(
+    add_servicers: AddServicers, addresses: Sequence[str], grace: float
+) -> None:
+    server = grpc.aio.server(
+        interceptors=[AsyncMetricsInterceptor()], options=_server_options()
+    )
+    add_servicers(server, asynchronous=True)
+
+    for address in addresses:
+        server.add_insecure_port(address)
+
+    await server.start()
+    loop = asyncio.get_running_loop()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(
+            signum, lambda: asyncio.ensure_future(server.stop(grace))
+        )
+
+    await server.wait_for_termination()
+
+
+def _run_worker(
+    idx: int,
+    add_servicers: AddServicers,
+    addresses: Sequence[str],
+    max_workers: int,
+    grace: float,
+) -> None:
+    # every worker needs its own scrape endpoint
+    if metrics_port := int(os.getenv("METRICS_PORT", "0")):
+        os.environ["METRICS_PORT"] = str(metrics_port + idx)
+
+    setup_from_env()
+    print(
+        f"Worker {idx} (pid {os.getpid()}) started, "
+        f"listening on {', '.join(addresses)}"
+    )
+
+    if os.getenv("GRPC_MODE", "sync") == "async":
+        asyncio.run(_serve_async(add_servicers, addresses, grace))
+    else:
+        _serve_sync(add_servicers, addresses, max_workers, grace)
+
+
+class _Supervisor:
+    def __init__(
+        self,
+        add_servicers: AddServicers,
+        addresses: Sequence[str],
+        processes: int,
+        max_workers: int,
+        grace: float,
+    ):
+        self.add_servicers = add_servicers
+        self.addresses = addresses
+        self.processes = processes
+        self.max_workers = max_workers
+        self.grace = grace
+        self.workers: dict[int, tuple[int, float]] = {}
+        # consecutive early exits and time of the pending restart per worker index
+        self.failures: dict[int, int] = {}
+        self.restarts: dict[int, float] = {}
+        self.deadline: float | None = None
+        self.failed = False
+
+    def _spawn(self, idx: int) -> None:
+        pid = os.fork()
+
+        if pid == 0:
+            code = 0
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+            try:
+                _run_worker(
+                    idx,
+                    self.add_servicers,
+                    self.addresses,
+                    self.max_workers,
+                    self.grace,
+                )
+            except BaseException:
+                logger.exception("Worker %d failed", idx)
+                code = 1
+            finally:
+                os._exit(code)
+
+        self.workers[pid] = (idx, time.monotonic())
+
+    def _stop(self, signum, frame) -> None:
+        if self.deadline is not None:
+            return
+
+        logger.info("Stopping %d workers", len(self.workers))
+        # leave the workers time to stop their servers before killing them
+        self.deadline = time.monotonic() + self.grace + _RESTART_DELAY
+
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+
+    def _restart(self, idx: int, started: float) -> None:
+        """Schedule the restart of the worker `idx` that exited, or stop all
+        workers if it exited early too often."""
+
+        now = time.monotonic()
+
+        if now - started >= _MIN_UPTIME:
+            self.failures[idx] = 0
+            self.restarts[idx] = now
+            return
+
+        failures = self.failures[idx] = self.failures.get(idx, 0) + 1
+
+        if failures > _MAX_RESTARTS:
+            logger.error(
+                "Worker %d exited %d times in a row after less than %.0f seconds,"
+                " giving up",
+                idx,
+                failures,
+                _MIN_UPTIME,
+            )
+            self.failed = True
+            self._stop(signal.SIGTERM, None)
+            return
+
+        delay = min(_RESTART_DELAY * 2 ** (failures - 1), _MAX_RESTART_DELAY)
+        logger.warning("Restarting worker %d in %.1f seconds", idx, delay)
+        self.restarts[idx] = now + delay
+
+    def run(self) -> int:
+        """Supervise the workers until they are stopped, returns the exit status
+        of the launcher."""
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for idx in range(self.processes):
+            self._spawn(idx)
+
+        while self.workers or self.restarts:
+            if self.deadline is not None:
+                self.restarts.clear()
+
+                if time.monotonic() > self.deadline:
+                    for pid in self.workers:
+                        logger.warning(
+                            "Killing worker %d (pid %d)", self.workers[pid][0], pid
+                        )
+                        os.kill(pid, signal.SIGKILL)
+
+                    self.deadline = float("inf")
+
+            for idx, at in list(self.restarts.items()):
+                if at <= time.monotonic():
+                    del self.restarts[idx]
+                    self._spawn(idx)
+
+            # poll, a blocking wait would resume after a signal and never get to
+            # the grace deadline while no worker exits
+            pid, status = os.waitpid(-1, os.WNOHANG) if self.workers else (0, 0)
+
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+
+            idx, started = self.workers.pop(pid)
+
+            if self.deadline is not None:
+                continue
+
+            logger.warning(
+                "Worker %d (pid %d) exited with status %d",
+                idx,
+                pid,
+                os.waitstatus_to_exitcode(status),
+            )
+            self._restart(idx, started)
+
+        return 1 if self.failed else 0
+
+
+def serve(
+    add_servicers: AddServicers,
+    address: str | Sequence[str],
+    processes: int,
+    preload: Callable[[], None] | None = None,
+    grace: float = 10.0,
+    max_workers: int = 10,
+) -> None:
+    """Serve the servicers registered by `add_servicers(server, asynchronous)` on
+    one or more addresses in `processes` worker processes (sync or async as per
+    `GRPC_MODE`, sync servers with `max_workers` threads).
+
+    If `METRICS_PORT` is set, worker `i` exposes its metrics on `METRICS_PORT + i`.
+    Exits with status 1 if a worker keeps failing right after its start.
+    """
+
+    addresses = [address] if isinstance(address, str) else list(address)
+    setup_logging()
+
+    if preload is not None:
+        preload()
+
+    # keep the garbage collector from touching (and thereby copying) the pages of
+    # objects created so far
+    gc.freeze()
+    print(f"Starting {processes} workers, listening on {', '.join(addresses)}")
+    status = _Supervisor(add_servicers, addresses, processes, max_workers, grace).run()
+
+    if status:
+        sys.exit(status)
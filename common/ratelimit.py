@@ -0,0 +1,288 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+import openai
+
+from .deadline import Deadline, DeadlineExceeded
+from .tokens import estimate_text_tokens
+
+
+def estimate_tokens(request: dict[str, Any], completion_tokens: int = 512) -> int:
+    """Rough token estimate of a chat request.
+
+    Providers budget `max_tokens` against the limit up front, so the expected
+    completion is included as well.
+    """
+
+    prompt = json.dumps(request.get("messages", [])) + json.dumps(
+        request.get("functions", [])
+    )
+
+    return estimate_text_tokens(prompt) + request.get("max_tokens", completion_tokens)
+
+
+def retry_after(error: openai.APIStatusError) -> float | None:
+    """Extract the server-provided delay in seconds from a throttling response."""
+
+    headers = error.response.headers
+
+    if (value := headers.get("retry-after-ms")) is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    if (value := headers.get("retry-after")) is not None:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+
+    return None
+
+
+class TokenBucket:
+    """Budget of `per_minute` units that refills continuously.
+
+    Reservations may overdraw the bucket; the caller then has to wait until the
+    debt has been refilled, which keeps the order of callers fair.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` units and return the seconds to wait before using them."""
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount: float) -> None:
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit adjusted with additive increase, multiplicative decrease.
+
+    Every successful call below `target_latency` raises the limit by `1 / limit`
+    (i.e., by one per round of calls), while throttled or slow calls multiply it
+    by `backoff`. Failed calls (errors, cancellations) leave it unchanged.
+    Both threads and coroutines can wait for a slot.
+    """
+
+    def __init__(
+        self,
+        initial: int = 16,
+        minimum: int = 1,
+        maximum: int = 256,
+        target_latency: float | None = None,
+        backoff: float = 0.5,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.in_flight = 0
+        self._decreased = 0.0
+        self._waiters: deque[Callable[[], None]] = deque()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> bool:
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+
+        return False
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        """Wait for a slot, at most `timeout` seconds. Return whether one was taken."""
+
+        with self._lock:
+            if self._try_acquire():
+                return True
+
+            event = threading.Event()
+            self._waiters.append(event.set)
+
+        # the releasing caller hands its slot over before setting the event
+        if event.wait(timeout):
+            return True
+
+        with self._lock:
+            if event.set in self._waiters:
+                self._waiters.remove(event.set)
+                return False
+
+        # the slot was handed over right after the timeout
+        return True
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            if self._try_acquire():
+                return
+
+            future = loop.create_future()
+
+            def wake() -> None:
+                loop.call_soon_threadsafe(self._wake_future, future)
+
+            self._waiters.append(wake)
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if wake in self._waiters:
+                    self._waiters.remove(wake)
+                elif future.done() and not future.cancelled():
+                    # the slot was handed over, but we will not use it
+                    self._release_slot()
+            raise
+
+    def _wake_future(self, future: asyncio.Future) -> None:
+        if future.cancelled():
+            with self._lock:
+                self._release_slot()
+        else:
+            future.set_result(None)
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+
+        while self._waiters and self._try_acquire():
+            self._waiters.popleft()()
+
+    def release(
+        self, latency: float, throttled: bool = False, failed: bool = False
+    ) -> None:
+        with self._lock:
+            now = time.monotonic()
+
+            if failed:
+                # neither a signal of spare capacity nor of overload
+                pass
+            elif throttled or (
+                self.target_latency is not None and latency > self.target_latency
+            ):
+                # calls started before the last decrease do not decrease again
+                if now - self._decreased > latency:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._decreased = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+            self._release_slot()
+
+
+def _timeout(deadline: Deadline | None) -> float | None:
+    if deadline is None or (remaining := deadline.remaining()) is None:
+        return None
+
+    return max(0.0, remaining)
+
+
+class RateLimiter:
+    """Process-wide budget for upstream LLM calls.
+
+    Combines request and token buckets (per minute, `None` disables a bucket),
+    a global pause after throttling responses, and adaptive concurrency.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        concurrency: AdaptiveConcurrency | None = None,
+        default_retry_after: float = 1.0,
+    ):
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.default_retry_after = default_retry_after
+        self.throttled = 0
+        self._paused_until = 0.0
+
+    def _delay(self, tokens: int) -> float:
+        delays = [self._paused_until - time.monotonic()]
+
+        if self.requests is not None:
+            delays.append(self.requests.reserve(1))
+
+        if self.tokens is not None:
+            delays.append(self.tokens.reserve(tokens))
+
+        return max(0.0, *delays)
+
+    def acquire(self, tokens: int, deadline: Deadline | None = None) -> None:
+        """Wait for the budgets and a concurrency slot, at most until `deadline`."""
+
+        if (delay := self._delay(tokens)) > 0:
+            time.sleep(delay)
+
+        if not self.concurrency.acquire(_timeout(deadline)):
+            raise DeadlineExceeded("Deadline expired while waiting for the upstream")
+
+    async def aacquire(self, tokens: int, deadline: Deadline | None = None) -> None:
+        if (delay := self._delay(tokens)) > 0:
+            await asyncio.sleep(delay)
+
+        if (timeout := _timeout(deadline)) is None:
+            await self.concurrency.aacquire()
+            return
+
+        try:
+            await asyncio.wait_for(self.concurrency.aacquire(), timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Deadline expired while waiting for the upstream")
+
+    def release(
+        self,
+        latency: float,
+        estimated_tokens: int,
+        used_tokens: int | None = None,
+        failed: bool = False,
+    ) -> None:
+        if self.tokens is not None and used_tokens is not None:
+            self.tokens.refund(estimated_tokens - used_tokens)
+
+        self.concurrency.release(latency, failed=failed)
+
+    def throttle(self, latency: float, delay: float | None) -> float:
+        """Record a throttling response, pause all callers and return the pause."""
+
+        delay = self.default_retry_after if delay is None else delay
+        self.throttled += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        self.concurrency.release(latency, throttled=True)
+
+        return delay
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "concurrency_limit": self.concurrency.limit,
+            "in_flight": self.concurrency.in_flight,
+            "throttled": self.throttled,
+        }
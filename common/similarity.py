@@ -0,0 +1,68 @@
+"""Vectorized lexical similarity of short texts, computed offline with NumPy.
+
+Texts are embedded as TF-IDF vectors of their words and word bigrams, hashed
+into a fixed number of dimensions, so that no vocabulary has to be fitted.
+"""
+
+import re
+import zlib
+from typing import Sequence
+
+import numpy as np
+
+_token_pattern = re.compile(r"\w+")
+
+
+def _features(text: str) -> list[str]:
+    words = _token_pattern.findall(text.lower())
+    return [*words, *(f"{first} {second}" for first, second in zip(words, words[1:]))]
+
+
+def hashed_tfidf(texts: Sequence[str], dimensions: int = 2**10) -> np.ndarray:
+    """L2-normalized TF-IDF vectors of `texts` with features hashed into `dimensions`."""
+
+    rows = []
+    columns = []
+
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            rows.append(row)
+            # crc32 is stable across processes, unlike `hash`
+            columns.append(zlib.crc32(feature.encode()) % dimensions)
+
+    counts = np.zeros((len(texts), dimensions), dtype=np.float32)
+    np.add.at(counts, (rows, columns), 1)
+
+    document_frequency = np.count_nonzero(counts, axis=0)
+    idf = np.log((1 + len(texts)) / (1 + document_frequency)) + 1
+    vectors = counts * idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def candidate_pairs(
+    texts: Sequence[str], k: int, distance: int = 1
+) -> list[tuple[int, int]]:
+    """Pairs (i, j) with i < j of texts among the `k` most similar of each other,
+    plus all texts at most `distance` positions apart.
+    """
+
+    size = len(texts)
+    pairs = {
+        (idx, other)
+        for idx in range(size)
+        for other in range(idx + 1, min(size, idx + distance + 1))
+    }
+    k = min(k, size - 1)
+
+    if k > 0:
+        vectors = hashed_tfidf(texts)
+        similarities = vectors @ vectors.T
+        np.fill_diagonal(similarities, -np.inf)
+        nearest = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+
+        for idx, others in enumerate(nearest.tolist()):
+            pairs.update((min(idx, other), max(idx, other)) for other in others)
+
+    return sorted(pairs)
@@ -0,0 +1,168 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import threading
+from collections import defaultdict
+from concurrent import futures
+from typing import Any, Awaitable, Callable, TypeVar
+
+from google.protobuf.message import Message
+
+from .deadline import DeadlineExceeded, RequestAborted, current_deadline
+
+T = TypeVar("T")
+
+_EXPIRED = "Deadline expired while waiting for an identical request"
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one computation.
+
+    The first caller (leader) runs the computation, all others wait for its result.
+    If the leader's RPC is aborted, waiting callers run the computation themselves
+    instead of failing with it. Waiting callers give up once their own RPC is
+    cancelled or its deadline (see `common.deadline`) expires.
+    """
+
+    def __init__(self):
+        self.calls: defaultdict[str, int] = defaultdict(int)
+        self.saved: defaultdict[str, int] = defaultdict(int)
+        self._pending: dict[str, futures.Future] = {}
+        self._async_pending: dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def do(self, name: str, key: str, fn: Callable[[], T]) -> T:
+        with self._lock:
+            self.calls[name] += 1
+            future = self._pending.get(key)
+
+            if future is None:
+                future = self._pending[key] = futures.Future()
+                leader = True
+            else:
+                self.saved[name] += 1
+                leader = False
+
+        if not leader:
+            self._wait(future)
+
+            try:
+                return future.result()
+            except RequestAborted:
+                return fn()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+    async def ado(self, name: str, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        with self._lock:
+            self.calls[name] += 1
+            task = self._async_pending.get(key)
+
+            if task is None:
+                task = self._async_pending[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda _: self._async_pending.pop(key, None))
+                leader = True
+            else:
+                self.saved[name] += 1
+                leader = False
+
+        if leader:
+            # a cancelled caller must not cancel the computation of the others
+            return await asyncio.shield(task)
+
+        deadline = current_deadline.get()
+        remaining = None if deadline is None else deadline.remaining()
+        # unlike `wait_for`, `wait` neither cancels the task nor raises its error
+        await asyncio.wait(
+            {task}, timeout=None if remaining is None else max(0.0, remaining)
+        )
+
+        if not task.done():
+            raise DeadlineExceeded(_EXPIRED)
+
+        try:
+            return task.result()
+        except RequestAborted:
+            return await fn()
+
+    @staticmethod
+    def _wait(future: futures.Future) -> None:
+        """Wait for the leader unless the RPC of the caller is aborted first."""
+
+        if (deadline := current_deadline.get()) is None:
+            futures.wait([future])
+            return
+
+        done = threading.Event()
+        future.add_done_callback(lambda _: done.set())
+        remove = deadline.add_callback(done.set)
+
+        try:
+            remaining = deadline.remaining()
+            done.wait(None if remaining is None else max(0.0, remaining))
+        finally:
+            remove()
+
+        if not future.done():
+            if deadline.cancelled:
+                deadline.check()
+
+            raise DeadlineExceeded(_EXPIRED)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            name: {"calls": self.calls[name], "saved": self.saved[name]}
+            for name in self.calls
+        }
+
+
+default_flights = SingleFlight()
+
+
+def _request_key(instance: Any, name: str, request: Message) -> str:
+    # deterministic serialization orders map entries, which normalizes the request
+    digest = hashlib.sha256(request.SerializeToString(deterministic=True))
+    return f"{id(instance)}:{name}:{digest.hexdigest()}"
+
+
+def single_flight(func):
+    """Coalesce concurrent calls of a servicer method with identical requests.
+
+    The method must have the signature `(self, request, *args)` and may not
+    depend on anything but the request, i.e., it must not touch the gRPC context.
+    """
+
+    name = func.__qualname__
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(self, request, *args):
+            return await default_flights.ado(
+                name,
+                _request_key(self, name, request),
+                lambda: func(self, request, *args),
+            )
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, request, *args):
+        return default_flights.do(
+            name,
+            _request_key(self, name, request),
+            lambda: func(self, request, *args),
+        )
+
+    return wrapper
@@ -0,0 +1,43 @@
+from typing import Callable, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Rough token count of `text` (about four characters per token)."""
+
+    return len(text) // 4 + 1
+
+
+def token_windows(
+    items: Sequence[T], cost: Callable[[T], int], budget: int, overlap: int = 0
+) -> list[list[T]]:
+    """Split `items` into consecutive windows of at most `budget` tokens.
+
+    Each window repeats the last `overlap` items of its predecessor.
+    A window always contains at least one new item, even if that exceeds the budget.
+    """
+
+    windows: list[list[T]] = []
+    start = 0
+
+    while start < len(items):
+        window_start = max(0, start - overlap) if windows else start
+        end = start
+        tokens = sum(cost(item) for item in items[window_start:start])
+
+        # shrink the overlap if it leaves no room for the next item
+        while window_start < start and tokens + cost(items[start]) > budget:
+            tokens -= cost(items[window_start])
+            window_start += 1
+
+        while end < len(items) and (
+            end == start or tokens + cost(items[end]) <= budget
+        ):
+            tokens += cost(items[end])
+            end += 1
+
+        windows.append(list(items[window_start:end]))
+        start = end
+
+    return windows
@@ -0,0 +1,118 @@
+"""Host any subset of the mining, quality and ranking servicers in one process.
+
+Run with `poetry run python -m host`. `HOST_SERVICES` selects the services
+(comma-separated, all by default) and `HOST_PORTS` the ports on which all of them
+are served, by default the ports of the separate servers so that clients do not
+have to be reconfigured. Only the selected services are imported.
+
+All servicers share the request executor of the gRPC server and, through
+`common.gateway.get_gateway`, one LLM client, rate limiter and completion cache.
+"""
+
+import asyncio
+import importlib
+import os
+from concurrent import futures
+from types import ModuleType
+
+import grpc
+
+from common import prefork
+from common.metrics import AsyncMetricsInterceptor, MetricsInterceptor, setup_from_env
+
+SERVICES = {"mining": 50500, "quality": 50901, "ranking": 50902}
+
+
+def _services() -> dict[str, ModuleType]:
+    names = [
+        name.strip()
+        for name in os.getenv("HOST_SERVICES", ",".join(SERVICES)).split(",")
+        if name.strip()
+    ]
+
+    for name in names:
+        if name not in SERVICES:
+            raise ValueError(
+                f"Unknown service '{name}', expected one of {', '.join(SERVICES)}"
+            )
+
+    return {name: importlib.import_module(f"{name}.server") for name in names}
+
+
+def _addresses(services: dict[str, ModuleType]) -> list[str]:
+    ports = os.getenv("HOST_PORTS") or ",".join(
+        str(SERVICES[name]) for name in services
+    )
+
+    return [f"[::]:{port.strip()}" for port in ports.split(",") if port.strip()]
+
+
+def _max_workers(services: dict[str, ModuleType]) -> int:
+    return int(os.getenv("HOST_MAX_WORKERS", "0")) or 10 * len(services)
+
+
+def add_servicers(server, asynchronous: bool = False) -> None:
+    """Register the servicers of all selected services on `server`."""
+
+    for module in _services().values():
+        module.add_servicers(server, asynchronous=asynchronous)
+
+
+def preload() -> None:
+    for module in _services().values():
+        if hasattr(module, "preload"):
+            module.preload()
+
+
+def serve():
+    setup_from_env()
+    services = _services()
+    addresses = _addresses(services)
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=_max_workers(services)),
+        interceptors=[MetricsInterceptor()],
+    )
+    add_servicers(server)
+
+    for address in addresses:
+        server.add_insecure_port(address)
+
+    server.start()
+    print(
+        f"Server started ({', '.join(services)}), listening on {', '.join(addresses)}"
+    )
+    server.wait_for_termination()
+
+
+async def serve_async():
+    setup_from_env()
+    services = _services()
+    addresses = _addresses(services)
+    server = grpc.aio.server(interceptors=[AsyncMetricsInterceptor()])
+    add_servicers(server, asynchronous=True)
+
+    for address in addresses:
+        server.add_insecure_port(address)
+
+    await server.start()
+    print(
+        f"Server started (asyncio, {', '.join(services)}), "
+        f"listening on {', '.join(addresses)}"
+    )
+    await server.wait_for_termination()
+
+
+if __name__ == "__main__":
+    if (processes := int(os.getenv("GRPC_PROCESSES", "1"))) > 1:
+        services = _services()
+        prefork.serve(
+            add_servicers,
+            _addresses(services),
+            processes,
+            preload=preload,
+            max_workers=_max_workers(services),
+        )
+    elif os.getenv("GRPC_MODE", "sync") == "async":
+        asyncio.run(serve_async())
+    else:
+        serve()
@@ -2,7 +2,10 @@ from typing import Mapping
 
 from arg_services.mining.v1beta import adu_pb2, entailment_pb2, entailment_pb2_grpc
 
-from .model import EntailmentClassifier
+from common.deadline import propagate_deadline
+from common.singleflight import single_flight
+
+from .model import EntailmentClassifier, Relation
 
 
 class EntailmentServicer(entailment_pb2_grpc.EntailmentServiceServicer):
@@ -16,12 +19,10 @@ class EntailmentServicer(entailment_pb2_grpc.EntailmentServiceServicer):
         super().__init__()
         self.entailment_classifier = EntailmentClassifier(*args, **kwargs)
 
-    def _get_entailments(
-        self, adus: Mapping[str, adu_pb2.Segment]
+    def _convert_entailments(
+        self, entailments: list[Relation]
     ) -> list[entailment_pb2.Entailment]:
-        adu_texts = {id: adu.text for id, adu in adus.items()}
-        entailments = self.entailment_classifier.predict(adu_texts)
-        entailments = [
+        return [
             entailment_pb2.Entailment(
                 premise_id=entailment.source,
                 claim_id=entailment.target,
@@ -29,9 +30,35 @@ class EntailmentServicer(entailment_pb2_grpc.EntailmentServiceServicer):
             )
             for entailment in entailments
         ]
-        return entailments
 
+    def _get_entailments(
+        self, adus: Mapping[str, adu_pb2.Segment]
+    ) -> list[entailment_pb2.Entailment]:
+        adu_texts = {id: adu.text for id, adu in adus.items()}
+        entailments = self.entailment_classifier.predict(adu_texts)
+        return self._convert_entailments(entailments)
+
+    @propagate_deadline
+    @single_flight
     def Entailments(self, request: entailment_pb2.EntailmentsRequest, context):
         return entailment_pb2.EntailmentsResponse(
             entailments=self._get_entailments(request.adus)
         )
+
+
+class AsyncEntailmentServicer(EntailmentServicer):
+    """`EntailmentServicer` for `grpc.aio` servers."""
+
+    async def _aget_entailments(
+        self, adus: Mapping[str, adu_pb2.Segment]
+    ) -> list[entailment_pb2.Entailment]:
+        adu_texts = {id: adu.text for id, adu in adus.items()}
+        entailments = await self.entailment_classifier.apredict(adu_texts)
+        return self._convert_entailments(entailments)
+
+    @propagate_deadline
+    @single_flight
+    async def Entailments(self, request: entailment_pb2.EntailmentsRequest, context):
+        return entailment_pb2.EntailmentsResponse(
+            entailments=await self._aget_entailments(request.adus)
+        )
@@ -1,10 +1,18 @@
+import asyncio
+import contextvars
 import json
-import os
-from typing import Mapping
+from collections import defaultdict
+from concurrent import futures
+from typing import Any, Mapping
 
-import openai
+from openai.types.chat import ChatCompletion
 from pydantic import BaseModel
 
+from common.gateway import LLMGateway, get_gateway
+from common.metrics import timed_parse
+from common.similarity import candidate_pairs
+from common.tokens import estimate_text_tokens, token_windows
+
 
 class Relation(BaseModel):
     source: str
@@ -20,6 +28,13 @@ class EntailmentClassifier:
     There should be no cycles.
     """
 
+    _pairs_system_prompt: str = """
+    The user will provide a list of argumentative discourse units (ADUs) and candidate pairs of their IDs.
+    Your task is to decide for each pair whether one of its ADUs supports or attacks the other one.
+    Only predict relations between the ADUs of a candidate pair, pairs without a sensible relation shall be omitted.
+    There should be no cycles.
+    """
+
     _predicted_relation_schema: dict = {
         "type": "object",
         "required": ["source", "target", "type"],
@@ -40,16 +55,50 @@ class EntailmentClassifier:
         },
     }
 
-    def __init__(self, model="gpt-4-turbo-preview"):
-        self.model = model
-        self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(
+        self,
+        model: str = "gpt-4-turbo-preview",
+        gateway: LLMGateway | None = None,
+        window_tokens: int | None = None,
+        window_overlap: int = 2,
+        max_concurrency: int = 4,
+        candidates: int | None = None,
+        candidate_batch_size: int = 32,
+    ):
+        """If `window_tokens` is set, ADU sets exceeding it are split into windows
+        of at most that many tokens that share `window_overlap` ADUs with their
+        predecessor and are classified concurrently.
 
-    def predict(self, adus: Mapping[str, str]) -> list[Relation]:
-        completion = self.openai_client.chat.completions.create(
+        If `candidates` is set instead, only pairs of each ADU with its neighbours
+        and its `candidates` lexically most similar ADUs are classified, in batches
+        of `candidate_batch_size` pairs (see `common.similarity.candidate_pairs`).
+        """
+
+        self.gateway = gateway or get_gateway()
+        self.model = self.gateway.resolve_model(model)
+        self.window_tokens = window_tokens
+        self.window_overlap = window_overlap
+        self.candidates = candidates
+        self.candidate_batch_size = candidate_batch_size
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="entailment"
+        )
+
+    def _request(
+        self, adus: Mapping[str, str], pairs: list[tuple[str, str]] | None = None
+    ) -> dict[str, Any]:
+        if pairs is None:
+            system_prompt = self._system_prompt
+            prompt: dict[str, Any] = {"adus": adus}
+        else:
+            system_prompt = self._pairs_system_prompt
+            prompt = {"adus": adus, "pairs": pairs}
+
+        return dict(
             model=self.model,
             messages=[
-                {"role": "system", "content": self._system_prompt},
-                {"role": "user", "content": json.dumps({"adus": adus})},
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": json.dumps(prompt)},
             ],
             functions=[
                 {
@@ -71,6 +120,9 @@ class EntailmentClassifier:
             ],
             function_call={"name": "predict_relations"},
         )
+
+    @timed_parse
+    def _parse(self, completion: ChatCompletion) -> list[Relation]:
         message = completion.choices[0].message.function_call
         if message is None:
             return []
@@ -85,3 +137,173 @@ class EntailmentClassifier:
             for relation in relations
         ]
         return relations
+
+    def _windows(self, adus: Mapping[str, str]) -> list[dict[str, str]]:
+        if self.window_tokens is None:
+            return [dict(adus)]
+
+        windows = token_windows(
+            list(adus.items()),
+            lambda adu: estimate_text_tokens(adu[0]) + estimate_text_tokens(adu[1]),
+            self.window_tokens,
+            self.window_overlap,
+        )
+
+        return [dict(window) for window in windows] or [{}]
+
+    @staticmethod
+    def _reachable(graph: Mapping[str, set[str]], source: str, target: str) -> bool:
+        stack = [source]
+        visited = {source}
+
+        while stack:
+            node = stack.pop()
+
+            if node == target:
+                return True
+
+            for neighbor in graph.get(node, ()):
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    stack.append(neighbor)
+
+        return False
+
+    def _merge(
+        self, adus: Mapping[str, str], window_relations: list[list[Relation]]
+    ) -> list[Relation]:
+        """Combine the relations of all windows into one acyclic set.
+
+        Relations predicted by multiple (overlapping) windows are kept once,
+        and relations closing a cycle with earlier ones are dropped.
+        """
+
+        graph: defaultdict[str, set[str]] = defaultdict(set)
+        merged = []
+
+        for relations in window_relations:
+            for relation in relations:
+                source, target = relation.source, relation.target
+
+                if (
+                    source not in adus
+                    or target not in adus
+                    or source == target
+                    or target in graph[source]
+                    or self._reachable(graph, target, source)
+                ):
+                    continue
+
+                graph[source].add(target)
+                merged.append(relation)
+
+        return merged
+
+    def _candidate_batches(
+        self, adus: Mapping[str, str]
+    ) -> list[tuple[dict[str, str], list[tuple[str, str]]]]:
+        """ADUs and candidate pairs of every batch of pairs."""
+
+        ids = list(adus)
+        pairs = [
+            (ids[first], ids[second])
+            for first, second in candidate_pairs(
+                list(adus.values()), self.candidates or 0
+            )
+        ]
+        batches = []
+
+        for start in range(0, len(pairs), self.candidate_batch_size):
+            batch = pairs[start : start + self.candidate_batch_size]
+            involved = {adu_id for pair in batch for adu_id in pair}
+            batches.append(
+                ({adu_id: adus[adu_id] for adu_id in ids if adu_id in involved}, batch)
+            )
+
+        return batches
+
+    def _pruned(self, adus: Mapping[str, str]) -> bool:
+        # with few ADUs, all pairs are candidates anyway
+        return self.candidates is not None and len(adus) > self.candidates + 2
+
+    @staticmethod
+    def _filter_pairs(
+        relations: list[Relation], pairs: list[tuple[str, str]]
+    ) -> list[Relation]:
+        allowed = {*pairs, *((target, source) for source, target in pairs)}
+        return [
+            relation
+            for relation in relations
+            if (relation.source, relation.target) in allowed
+        ]
+
+    def _predict_pairs(
+        self, adus: Mapping[str, str], pairs: list[tuple[str, str]]
+    ) -> list[Relation]:
+        relations = self.gateway.complete(
+            parse=self._parse, **self._request(adus, pairs)
+        )
+        return self._filter_pairs(relations, pairs)
+
+    async def _apredict_pairs(
+        self, adus: Mapping[str, str], pairs: list[tuple[str, str]]
+    ) -> list[Relation]:
+        relations = await self.gateway.acomplete(
+            parse=self._parse, **self._request(adus, pairs)
+        )
+        return self._filter_pairs(relations, pairs)
+
+    def _predict_window(self, adus: Mapping[str, str]) -> list[Relation]:
+        return self.gateway.complete(parse=self._parse, **self._request(adus))
+
+    async def _apredict_window(self, adus: Mapping[str, str]) -> list[Relation]:
+        return await self.gateway.acomplete(parse=self._parse, **self._request(adus))
+
+    def predict(self, adus: Mapping[str, str]) -> list[Relation]:
+        if self._pruned(adus):
+            # copy the context so that the workers see the deadline of the RPC
+            pending = [
+                self.executor.submit(
+                    contextvars.copy_context().run, self._predict_pairs, *batch
+                )
+                for batch in self._candidate_batches(adus)
+            ]
+
+            return self._merge(adus, [future.result() for future in pending])
+
+        windows = self._windows(adus)
+
+        if len(windows) == 1:
+            return self._predict_window(adus)
+
+        # copy the context so that the workers see the deadline of the RPC
+        pending = [
+            self.executor.submit(
+                contextvars.copy_context().run, self._predict_window, window
+            )
+            for window in windows
+        ]
+
+        return self._merge(adus, [future.result() for future in pending])
+
+    async def apredict(self, adus: Mapping[str, str]) -> list[Relation]:
+        if self._pruned(adus):
+            batch_relations = await asyncio.gather(
+                *(
+                    self._apredict_pairs(*batch)
+                    for batch in self._candidate_batches(adus)
+                )
+            )
+
+            return self._merge(adus, list(batch_relations))
+
+        windows = self._windows(adus)
+
+        if len(windows) == 1:
+            return await self._apredict_window(adus)
+
+        window_relations = await asyncio.gather(
+            *(self._apredict_window(window) for window in windows)
+        )
+
+        return self._merge(adus, list(window_relations))
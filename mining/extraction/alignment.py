@@ -0,0 +1,81 @@
+import bisect
+from typing import Sequence
+
+
+class _NormalizedText:
+    """Lowercased copy of a text with whitespace runs collapsed to single spaces,
+    mapping every character back to its position in the original text."""
+
+    def __init__(self, text: str):
+        chars: list[str] = []
+        self.positions: list[int] = []
+        previous_space = True
+
+        for position, char in enumerate(text):
+            if char.isspace():
+                if previous_space:
+                    continue
+
+                char = " "
+                previous_space = True
+            else:
+                char = char.lower()
+                previous_space = False
+
+            chars.append(char)
+            self.positions.append(position)
+
+        self.text = "".join(chars)
+
+    def find(self, fragment: str, start: int) -> tuple[int, int] | None:
+        """Span of `fragment` in the original text, preferably after `start`."""
+
+        fragment = " ".join(fragment.lower().split())
+
+        if not fragment:
+            return None
+
+        idx = self.text.find(fragment, bisect.bisect_left(self.positions, start))
+
+        if idx < 0:
+            idx = self.text.find(fragment)
+
+        if idx < 0:
+            return None
+
+        return self.positions[idx], self.positions[idx + len(fragment) - 1] + 1
+
+
+def find_spans(text: str, fragments: Sequence[str]) -> list[tuple[int, int] | None]:
+    """Character spans of `fragments` (e.g., ADUs returned by the model) in `text`.
+
+    Fragments are expected in text order, so each one is searched after the end of
+    its predecessor first and anywhere else second. Fragments not contained
+    verbatim are matched ignoring case and whitespace, `None` if that fails too.
+    """
+
+    spans: list[tuple[int, int] | None] = []
+    normalized: _NormalizedText | None = None
+    cursor = 0
+
+    for fragment in fragments:
+        stripped = fragment.strip()
+        idx = text.find(stripped, cursor) if stripped else -1
+
+        if stripped and idx < 0:
+            idx = text.find(stripped)
+
+        if idx >= 0:
+            spans.append((idx, idx + len(stripped)))
+            cursor = idx + len(stripped)
+            continue
+
+        # built on demand, most fragments are found verbatim
+        normalized = normalized or _NormalizedText(text)
+        span = normalized.find(fragment, cursor)
+        spans.append(span)
+
+        if span is not None:
+            cursor = span[1]
+
+    return spans
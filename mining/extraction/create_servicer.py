@@ -1,15 +1,28 @@
-from typing import Mapping
+import asyncio
+import contextvars
+import logging
+from concurrent import futures
+from typing import Any, Mapping
 
 from arg_services.mining.v1beta import adu_pb2, adu_pb2_grpc
-from nltk.tokenize import word_tokenize
+from google.protobuf import struct_pb2
 
-from .model import Extractor
+from common.deadline import RequestAborted, propagate_deadline
+from common.singleflight import single_flight
+
+from .model import ADU, Extractor
+
+logger = logging.getLogger(__name__)
 
 
 class ExtractionServicer(adu_pb2_grpc.AduServiceServicer):
-    def __init__(self, *args, **kwargs) -> None:
+    def __init__(self, *args, max_concurrency: int = 8, **kwargs) -> None:
         super().__init__()
         self.extractor = Extractor(*args, **kwargs)
+        # shared by all requests so that the limit applies to the whole server
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="extraction"
+        )
 
     def _divide_segments(self, text: str) -> list[adu_pb2.Segment]:
         return [
@@ -17,21 +30,144 @@ class ExtractionServicer(adu_pb2_grpc.AduServiceServicer):
             for segment in self.extractor.divide_segments(text)
         ]
 
-    def _classify_segments(self, segments: Mapping[str, str]) -> list[adu_pb2.Adu]:
-        adus = []
-        for key, text in segments.items():
-            evaluation_response = self.extractor.evaluation(text)
-            for idx, adu in enumerate(evaluation_response):
-                tokens = [
-                    adu_pb2.Token(text=token) for token in word_tokenize(adu.text)
-                ]
-                adus.append(adu_pb2.Adu(segment_id=f"{key}-{idx}", tokens=tokens))
-        return adus
+    def _convert_adus(self, key: str, adus: list[ADU]) -> list[adu_pb2.Adu]:
+        return [
+            adu_pb2.Adu(
+                segment_id=f"{key}-{idx}",
+                tokens=[
+                    adu_pb2.Token(text=adu.text[start:end]) for start, end in adu.tokens
+                ],
+            )
+            for idx, adu in enumerate(adus)
+        ]
+
+    def _convert_offsets(self, key: str, adus: list[ADU]) -> dict[str, Any]:
+        # tokens have no offset fields, so the spans are passed as extras
+        return {
+            f"{key}-{idx}": {
+                "start": adu.start,
+                "end": adu.end,
+                "tokens": [
+                    [adu.start + start, adu.start + end] for start, end in adu.tokens
+                ],
+            }
+            for idx, adu in enumerate(adus)
+            if adu.start is not None
+        }
+
+    def _classify_segments(
+        self, segments: Mapping[str, str]
+    ) -> tuple[dict[str, list[ADU]], dict[str, str]]:
+        # copy the context so that the workers see the deadline of this RPC
+        pending = {
+            key: self.executor.submit(
+                contextvars.copy_context().run, self.extractor.evaluation, text
+            )
+            for key, text in segments.items()
+        }
+        adus = {}
+        errors = {}
 
+        # iterate in request order so that the response is deterministic
+        for key, future in pending.items():
+            try:
+                adus[key] = future.result()
+            except RequestAborted:
+                for other in pending.values():
+                    other.cancel()
+                raise
+            except Exception as e:
+                logger.exception("Classification of segment %s failed", key)
+                errors[key] = str(e)
+
+        return adus, errors
+
+    @propagate_deadline
+    @single_flight
     def Segmentation(self, request, context):
         segments = self._divide_segments(request.text)
         return adu_pb2.SegmentationResponse(segments=segments)
 
+    def _classification_response(
+        self, adus: Mapping[str, list[ADU]], errors: dict[str, str]
+    ) -> adu_pb2.ClassificationResponse:
+        extras = struct_pb2.Struct()
+        offsets = {
+            segment_id: offset
+            for key, segment_adus in adus.items()
+            for segment_id, offset in self._convert_offsets(key, segment_adus).items()
+        }
+
+        if errors:
+            extras.update({"errors": errors})
+
+        if offsets:
+            extras.update({"offsets": offsets})
+
+        return adu_pb2.ClassificationResponse(
+            adus=[
+                adu
+                for key, segment_adus in adus.items()
+                for adu in self._convert_adus(key, segment_adus)
+            ],
+            extras=extras,
+        )
+
+    @propagate_deadline
+    @single_flight
     def Classification(self, request, context):
-        adus = self._classify_segments(request.segments)
-        return adu_pb2.ClassificationResponse(adus=adus)
+        adus, errors = self._classify_segments(request.segments)
+        return self._classification_response(adus, errors)
+
+
+class AsyncExtractionServicer(ExtractionServicer):
+    """`ExtractionServicer` for `grpc.aio` servers.
+
+    Segment classification runs as coroutines bounded by a semaphore,
+    while spaCy parsing is offloaded to the executor to keep the event loop free.
+    """
+
+    def __init__(self, *args, max_concurrency: int = 8, **kwargs) -> None:
+        super().__init__(*args, max_concurrency=max_concurrency, **kwargs)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _aevaluation(self, text: str) -> list[ADU]:
+        async with self.semaphore:
+            return await self.extractor.aevaluation(text)
+
+    async def _aclassify_segments(
+        self, segments: Mapping[str, str]
+    ) -> tuple[dict[str, list[ADU]], dict[str, str]]:
+        results = await asyncio.gather(
+            *(self._aevaluation(text) for text in segments.values()),
+            return_exceptions=True,
+        )
+        adus = {}
+        errors = {}
+
+        for key, result in zip(segments.keys(), results):
+            if isinstance(result, RequestAborted):
+                raise result
+            elif isinstance(result, Exception):
+                logger.error("Classification of segment %s failed: %s", key, result)
+                errors[key] = str(result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                adus[key] = result
+
+        return adus, errors
+
+    @propagate_deadline
+    @single_flight
+    async def Segmentation(self, request, context):
+        segments = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._divide_segments, request.text
+        )
+        return adu_pb2.SegmentationResponse(segments=segments)
+
+    @propagate_deadline
+    @single_flight
+    async def Classification(self, request, context):
+        adus, errors = await self._aclassify_segments(request.segments)
+        return self._classification_response(adus, errors)
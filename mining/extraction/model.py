@@ -1,10 +1,26 @@
+import asyncio
+import contextvars
 import json
-import os
+import re
+from concurrent import futures
+from typing import Any, Iterable, Sequence, cast
 
-import openai
-import spacy
+from openai.types.chat import ChatCompletion
 from pydantic import BaseModel
 
+from common.gateway import LLMGateway, get_gateway
+from common.metrics import timed_parse
+from common.tokens import estimate_text_tokens, token_windows
+
+from . import nlp
+from .alignment import find_spans
+from .parallel import SegmentationPool
+
+# sentence-like pieces of text, windows are cut between them
+_WINDOW_UNIT = re.compile(r"[^.!?\n]*(?:[.!?]+|\n|$)\s*")
+
+Span = tuple[int, int]
+
 # model source code is adjusted from "Fine-Grained Argument Unit Recognition and Classification" by Trautmann et al. (DOI: https://doi.org/10.1609/aaai.v34i05.6438)
 
 
@@ -16,6 +32,11 @@ class Segment(BaseModel):
 
 class ADU(BaseModel):
     text: str
+    # character span in the classified text, unset if it could not be found
+    start: int | None = None
+    end: int | None = None
+    # character spans of the tokens in `text`
+    tokens: list[tuple[int, int]] = []
 
 
 class Extractor:
@@ -38,20 +59,69 @@ class Extractor:
         },
     }
 
-    def __init__(self, model="gpt-4-turbo-preview"):
-        self.model = model
-        self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(
+        self,
+        model: str = "gpt-4-turbo-preview",
+        spacy_model: str = nlp.DEFAULT_PIPELINE,
+        gateway: LLMGateway | None = None,
+        segmentation_processes: int = 0,
+        segmentation_chunk_chars: int = 10_000,
+        window_tokens: int | None = None,
+        window_overlap: int = 2,
+        window_concurrency: int = 4,
+    ):
+        """If `segmentation_processes` is set, texts are segmented on a pool of
+        that many processes in chunks of about `segmentation_chunk_chars`
+        characters (see `parallel.SegmentationPool`) instead of the calling thread.
+
+        If `window_tokens` is set, ADUs are extracted from texts exceeding it in
+        windows of at most that many tokens that share `window_overlap` sentences
+        with their predecessor and are processed concurrently (see `_merge`).
+        """
+
+        self.gateway = gateway or get_gateway()
+        self.model = self.gateway.resolve_model(model)
+        self.spacy_model = spacy_model
+        self.segmentation_pool = (
+            SegmentationPool(
+                spacy_model, segmentation_processes, segmentation_chunk_chars
+            )
+            if segmentation_processes > 0
+            else None
+        )
+        self.window_tokens = window_tokens
+        self.window_overlap = window_overlap
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=window_concurrency, thread_name_prefix="extraction-window"
+        )
 
     def divide_segments(self, text: str) -> list[Segment]:
-        nlp = spacy.load("en_core_web_sm")
-        doc = nlp(text)
+        return self.divide_segments_batch([text])[0]
+
+    def divide_segments_batch(self, texts: Iterable[str]) -> list[list[Segment]]:
+        if self.segmentation_pool is not None:
+            texts = list(texts)
+
+            return [
+                [
+                    Segment(text=text[start_char:end_char], start=start, end=end)
+                    for start, end, start_char, end_char in sentences
+                ]
+                for text, sentences in zip(
+                    texts, self.segmentation_pool.segment_batch(texts)
+                )
+            ]
+
         return [
-            Segment(text=sent.text, start=sent.start, end=sent.end)
-            for sent in doc.sents
+            [
+                Segment(text=sent.text, start=sent.start, end=sent.end)
+                for sent in doc.sents
+            ]
+            for doc in nlp.parse(texts, self.spacy_model)
         ]
 
-    def evaluation(self, text) -> list[ADU]:
-        completion = self.openai_client.chat.completions.create(
+    def _request(self, text: str) -> dict[str, Any]:
+        return dict(
             model=self.model,
             messages=[
                 {"role": "system", "content": self._system_prompt},
@@ -77,6 +147,9 @@ class Extractor:
             ],
             function_call={"name": "extract_adus"},
         )
+
+    @timed_parse
+    def _parse(self, completion: ChatCompletion) -> list[ADU]:
         message = completion.choices[0].message.function_call
         if message is None:
             return []
@@ -85,3 +158,147 @@ class Extractor:
         # convert adus list of dicts to list of ADU objects
         adus = [ADU(**adu) for adu in adus]
         return adus
+
+    def _windows(self, text: str) -> list[Span]:
+        """Character spans of the windows of `text`, cut between sentences."""
+
+        if self.window_tokens is None or (
+            estimate_text_tokens(text) <= self.window_tokens
+        ):
+            return [(0, len(text))]
+
+        units = [match.span() for match in _WINDOW_UNIT.finditer(text) if match.group()]
+        windows = token_windows(
+            units,
+            lambda unit: estimate_text_tokens(text[unit[0] : unit[1]]),
+            self.window_tokens,
+            self.window_overlap,
+        )
+
+        return [(window[0][0], window[-1][1]) for window in windows] or [(0, 0)]
+
+    @staticmethod
+    def _merge(
+        windows: Sequence[Span], window_adus: list[list[ADU]], text: str
+    ) -> tuple[list[ADU], list[Span | None]]:
+        """Combine the ADUs of all windows in the order of their offsets in `text`.
+
+        ADUs extracted by two overlapping windows are kept once: an ADU is dropped
+        if at least half of it overlaps the preceding ADU. ADUs that could not be
+        located are appended, once per distinct text.
+        """
+
+        located: dict[Span, ADU] = {}
+        unlocated: dict[str, ADU] = {}
+
+        for (offset, end), adus in zip(windows, window_adus):
+            spans = find_spans(text[offset:end], [adu.text for adu in adus])
+
+            for adu, span in zip(adus, spans):
+                if span is None:
+                    unlocated.setdefault(" ".join(adu.text.lower().split()), adu)
+                else:
+                    located.setdefault((span[0] + offset, span[1] + offset), adu)
+
+        merged: list[tuple[ADU, Span | None]] = []
+
+        for (start, end), adu in sorted(located.items()):
+            if merged:
+                previous_start, previous_end = cast(Span, merged[-1][1])
+                overlap = min(end, previous_end) - max(start, previous_start)
+
+                if overlap * 2 >= min(end - start, previous_end - previous_start):
+                    continue
+
+            merged.append((adu, (start, end)))
+
+        merged.extend((adu, None) for adu in unlocated.values())
+
+        return [adu for adu, _ in merged], [span for _, span in merged]
+
+    def _align(
+        self, text: str, adus: list[ADU], spans: Sequence[Span | None] | None = None
+    ) -> list[ADU]:
+        """Locate the ADUs in `text` (unless their `spans` are known) and split them
+        into the tokens of `text`."""
+
+        if spans is None:
+            spans = find_spans(text, [adu.text for adu in adus])
+
+        doc = nlp.tokenize(text, self.spacy_model)
+        aligned = []
+
+        for adu, span in zip(adus, spans):
+            if span is None:
+                tokens = nlp.tokenize(adu.text, self.spacy_model)
+                aligned.append(
+                    ADU(
+                        text=adu.text,
+                        tokens=[
+                            (token.idx, token.idx + len(token))
+                            for token in tokens
+                            if not token.is_space
+                        ],
+                    )
+                )
+                continue
+
+            start, end = span
+            tokens = doc.char_span(start, end, alignment_mode="expand") or []
+            aligned.append(
+                ADU(
+                    text=text[start:end],
+                    start=start,
+                    end=end,
+                    tokens=[
+                        (
+                            max(token.idx, start) - start,
+                            min(token.idx + len(token), end) - start,
+                        )
+                        for token in tokens
+                        if not token.is_space
+                    ],
+                )
+            )
+
+        return aligned
+
+    def _evaluate_window(self, text: str) -> list[ADU]:
+        return self.gateway.complete(parse=self._parse, **self._request(text))
+
+    async def _aevaluate_window(self, text: str) -> list[ADU]:
+        return await self.gateway.acomplete(parse=self._parse, **self._request(text))
+
+    def evaluation(self, text: str) -> list[ADU]:
+        windows = self._windows(text)
+
+        if len(windows) == 1:
+            return self._align(text, self._evaluate_window(text))
+
+        # copy the context so that the workers see the deadline of the RPC
+        pending = [
+            self.executor.submit(
+                contextvars.copy_context().run,
+                self._evaluate_window,
+                text[start:end],
+            )
+            for start, end in windows
+        ]
+        adus, spans = self._merge(
+            windows, [future.result() for future in pending], text
+        )
+
+        return self._align(text, adus, spans)
+
+    async def aevaluation(self, text: str) -> list[ADU]:
+        windows = self._windows(text)
+
+        if len(windows) == 1:
+            return self._align(text, await self._aevaluate_window(text))
+
+        window_adus = await asyncio.gather(
+            *(self._aevaluate_window(text[start:end]) for start, end in windows)
+        )
+        adus, spans = self._merge(windows, list(window_adus), text)
+
+        return self._align(text, adus, spans)
@@ -0,0 +1,45 @@
+import threading
+from typing import Iterable, Iterator
+
+import spacy
+from spacy.language import Language
+from spacy.tokens import Doc
+
+DEFAULT_PIPELINE = "en_core_web_sm"
+
+# Sentence boundaries come from the dependency parser (which listens to tok2vec),
+# so everything else can be excluded when loading the pipeline.
+_SEGMENTATION_EXCLUDE = ["tagger", "attribute_ruler", "lemmatizer", "ner"]
+
+_pipelines: dict[str, Language] = {}
+_lock = threading.Lock()
+
+
+def load_pipeline(name: str = DEFAULT_PIPELINE) -> Language:
+    """Return the process-wide pipeline for `name`, loading it on first use."""
+
+    nlp = _pipelines.get(name)
+
+    if nlp is None:
+        with _lock:
+            nlp = _pipelines.get(name)
+
+            if nlp is None:
+                nlp = spacy.load(name, exclude=_SEGMENTATION_EXCLUDE)
+                _pipelines[name] = nlp
+
+    return nlp
+
+
+def parse(
+    texts: Iterable[str], name: str = DEFAULT_PIPELINE, batch_size: int = 32
+) -> Iterator[Doc]:
+    """Parse many texts in a single `nlp.pipe` pass."""
+
+    return load_pipeline(name).pipe(texts, batch_size=batch_size)
+
+
+def tokenize(text: str, name: str = DEFAULT_PIPELINE) -> Doc:
+    """Run only the tokenizer of the pipeline on `text`."""
+
+    return load_pipeline(name).make_doc(text)
@@ -0,0 +1,137 @@
+"""Segmentation of long texts on a pool of worker processes.
+
+spaCy holds the GIL while parsing, so a book-length text parsed on a gRPC worker
+thread stalls every other request of the server. Instead, texts are split at
+paragraph boundaries into chunks of about `chunk_chars` characters, which are
+parsed by worker processes that each load the pipeline once. The sentences of all
+chunks are shifted back by the characters and tokens of the preceding chunks, so
+their offsets refer to the whole text.
+
+A paragraph boundary is a line break followed by a blank line. The whitespace of
+the boundary stays with the preceding chunk, which is also where the tokenizer
+puts it when parsing the whole text, so token indices agree with a single parse.
+Sentences never cross a paragraph boundary, but paragraphs longer than
+`chunk_chars` are not split any further.
+"""
+
+import multiprocessing
+import re
+from concurrent import futures
+from typing import Sequence
+
+from . import nlp
+
+_PARAGRAPH_BOUNDARY = re.compile(r"\n[^\S\n]*\n\s*")
+
+# token start/end and character start/end of a sentence
+Sentence = tuple[int, int, int, int]
+
+
+def split_paragraphs(text: str, chunk_chars: int) -> list[int]:
+    """Start offsets of chunks of `text` that are cut at paragraph boundaries and
+    have at most `chunk_chars` characters unless a single paragraph is longer."""
+
+    starts = [0]
+    previous = 0
+
+    for boundary in [match.end() for match in _PARAGRAPH_BOUNDARY.finditer(text)] + [
+        len(text)
+    ]:
+        if boundary - starts[-1] > chunk_chars and previous > starts[-1]:
+            starts.append(previous)
+
+        previous = boundary
+
+    return starts
+
+
+def _segment_chunks(name: str, chunks: list[str]) -> list[tuple[int, list[Sentence]]]:
+    """Number of tokens and sentences of each chunk, runs in the worker processes."""
+
+    return [
+        (
+            len(doc),
+            [
+                (sent.start, sent.end, sent.start_char, sent.end_char)
+                for sent in doc.sents
+            ],
+        )
+        for doc in nlp.parse(chunks, name)
+    ]
+
+
+class SegmentationPool:
+    """Process pool splitting texts into sentences with the pipeline `spacy_model`."""
+
+    def __init__(
+        self,
+        spacy_model: str = nlp.DEFAULT_PIPELINE,
+        processes: int | None = None,
+        chunk_chars: int = 10_000,
+    ):
+        self.spacy_model = spacy_model
+        self.chunk_chars = chunk_chars
+        # forking a process that runs gRPC threads is unsafe, so workers are spawned
+        self.executor = futures.ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=nlp.load_pipeline,
+            initargs=(spacy_model,),
+        )
+
+    def _tasks(self, chunks: list[str]) -> list[list[str]]:
+        """Pack consecutive chunks into tasks of about `chunk_chars` characters, so
+        that short texts do not pay one round trip to a worker each."""
+
+        tasks: list[list[str]] = []
+        size = 0
+
+        for chunk in chunks:
+            if not tasks or size + len(chunk) > self.chunk_chars:
+                tasks.append([])
+                size = 0
+
+            tasks[-1].append(chunk)
+            size += len(chunk)
+
+        return tasks
+
+    def segment_batch(self, texts: Sequence[str]) -> list[list[Sentence]]:
+        """Sentences of every text with offsets relative to that text."""
+
+        starts = [split_paragraphs(text, self.chunk_chars) for text in texts]
+        chunks = [
+            text[start:end]
+            for text, offsets in zip(texts, starts)
+            for start, end in zip(offsets, offsets[1:] + [len(text)])
+        ]
+        pending = [
+            self.executor.submit(_segment_chunks, self.spacy_model, task)
+            for task in self._tasks(chunks)
+        ]
+        parsed = iter([chunk for future in pending for chunk in future.result()])
+        sentences: list[list[Sentence]] = []
+
+        for offsets in starts:
+            text_sentences: list[Sentence] = []
+            tokens = 0
+
+            for char_offset in offsets:
+                chunk_tokens, chunk_sentences = next(parsed)
+                text_sentences.extend(
+                    (
+                        start + tokens,
+                        end + tokens,
+                        start_char + char_offset,
+                        end_char + char_offset,
+                    )
+                    for start, end, start_char, end_char in chunk_sentences
+                )
+                tokens += chunk_tokens
+
+            sentences.append(text_sentences)
+
+        return sentences
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
@@ -0,0 +1,142 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Mapping
+
+from openai.types.chat import ChatCompletion
+
+from common.gateway import LLMGateway, get_gateway
+from common.metrics import timed_parse
+from mining.entailment.model import EntailmentClassifier, Relation
+
+
+@dataclass
+class FusedPrediction:
+    relations: list[Relation]
+    major_claim_probabilities: dict[str, float]
+    # relations attaching the other ADUs to the major claim
+    root_relations: list[Relation]
+
+    def graph_relations(self) -> list[dict[str, str]]:
+        """All predicted relations, to be repaired into a graph rooted at the major
+        claim by `GraphConstructor.build_relations`."""
+
+        return [
+            relation.model_dump()
+            for relation in (*self.relations, *self.root_relations)
+        ]
+
+
+class FusedMiner:
+    """Predicts entailments, major claim and graph in a single completion.
+
+    Replaces the separate calls of `EntailmentClassifier`, `MajorClaimGenerator`
+    and `GraphConstructor`, which would each send the same ADUs.
+    """
+
+    _system_prompt: str = """
+    The user will provide a list of argumentative discourse units (ADUs).
+    Your task is to analyze the argument they form in three steps:
+    1. Predict sensible relations in the form of support/attack between the ADUs.
+    2. Rate for each ADU the probability that it is the major claim / conclusion of the argument.
+    3. Attach the ADUs that are not yet connected to the ADU with the highest major claim probability.
+    Together, the relations of steps 1 and 3 shall form a valid hierarchical graph with the major claim being the root node (i.e., it should have no outgoing relations, only incoming ones).
+    Flat graphs (i.e., all ADUs directly connected to the major claim directly) are discouraged.
+    There should be no cycles in the graph and no orphaned ADUs.
+    """
+
+    _major_claim_schema: dict = {
+        "type": "object",
+        "required": ["id", "probability"],
+        "properties": {
+            "id": {
+                "type": "string",
+                "description": "The ID of the ADU",
+            },
+            "probability": {
+                "type": "number",
+                "description": "The probability that the ADU is the major claim",
+            },
+        },
+    }
+
+    def __init__(
+        self,
+        model: str = "gpt-4-turbo-preview",
+        gateway: LLMGateway | None = None,
+    ):
+        self.gateway = gateway or get_gateway()
+        self.model = self.gateway.resolve_model(model)
+
+    def _request(self, adus: Mapping[str, str]) -> dict[str, Any]:
+        relations = {
+            "type": "array",
+            "items": EntailmentClassifier._predicted_relation_schema,
+        }
+
+        return dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self._system_prompt},
+                {"role": "user", "content": json.dumps({"adus": adus})},
+            ],
+            functions=[
+                {
+                    "name": "mine_argument",
+                    "description": "Predict the relations, the major claim and the graph of an argument",
+                    "parameters": {
+                        "title": "Argument Mining",
+                        "description": "Predict the relations, the major claim and the graph of an argument",
+                        "type": "object",
+                        "required": [
+                            "relations",
+                            "major_claim_probabilities",
+                            "root_relations",
+                        ],
+                        "properties": {
+                            "relations": relations,
+                            "major_claim_probabilities": {
+                                "type": "array",
+                                "items": self._major_claim_schema,
+                            },
+                            "root_relations": relations,
+                        },
+                    },
+                }
+            ],
+            function_call={"name": "mine_argument"},
+        )
+
+    @staticmethod
+    def _relations(relations: list[dict[str, Any]]) -> list[Relation]:
+        return [
+            Relation(
+                source=relation["source"],
+                target=relation["target"],
+                type=relation["type"],
+            )
+            for relation in relations
+        ]
+
+    @timed_parse
+    def _parse(self, completion: ChatCompletion) -> FusedPrediction:
+        message = completion.choices[0].message.function_call
+
+        if message is None:
+            return FusedPrediction([], {}, [])
+
+        arguments = json.loads(message.arguments)
+
+        return FusedPrediction(
+            relations=self._relations(arguments.get("relations", [])),
+            major_claim_probabilities={
+                mc["id"]: mc["probability"]
+                for mc in arguments.get("major_claim_probabilities", [])
+            },
+            root_relations=self._relations(arguments.get("root_relations", [])),
+        )
+
+    def predict(self, adus: Mapping[str, str]) -> FusedPrediction:
+        return self.gateway.complete(parse=self._parse, **self._request(adus))
+
+    async def apredict(self, adus: Mapping[str, str]) -> FusedPrediction:
+        return await self.gateway.acomplete(parse=self._parse, **self._request(adus))
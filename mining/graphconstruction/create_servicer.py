@@ -5,8 +5,16 @@ from arg_services.mining.v1beta import (
     graph_construction_pb2_grpc,
 )
 
+from common.deadline import propagate_deadline
+from common.singleflight import single_flight
+
 from .model import GraphConstructor
 
+# shared by all responses without a graph, must not be modified
+_EMPTY_RESPONSE = graph_construction_pb2.GraphConstructionResponse(
+    graph=arguebuf.dump.protobuf(arguebuf.Graph())
+)
+
 
 class GraphConstructionServicer(
     graph_construction_pb2_grpc.GraphConstructionServiceServicer
@@ -20,30 +28,70 @@ class GraphConstructionServicer(
         entailment_pb2.EntailmentType.ENTAILMENT_TYPE_CONTRADICTION: "attack",
     }
 
-    def _construct_graph(self, adus, entailments, major_claim_id):
-        adu_texts = {id: adu.text for id, adu in adus.items()}
-        entailment_dicts = [
+    def _convert_entailments(self, entailments):
+        return [
             {
                 "source": entailment.premise_id,
                 "target": entailment.claim_id,
                 "type": self._type_mapping[entailment.type],
             }
             for entailment in entailments
+            # neutral entailments do not form a relation
+            if entailment.type in self._type_mapping
         ]
-        generated_graph = self.graph_constructor.build_graph(
-            adu_texts, entailment_dicts, major_claim_id
+
+    def _construct_graph(self, adus, entailments, major_claim_id):
+        return self._build_graph(
+            {id: adu.text for id, adu in adus.items()},
+            self._convert_entailments(entailments),
+            major_claim_id,
+        )
+
+    def _build_graph(self, adu_texts, relations, major_claim_id):
+        relations = self.graph_constructor.build_relations(
+            adu_texts, relations, major_claim_id
         )
-        return generated_graph
+        if relations is None:
+            return None
+        return self.graph_constructor.protobuf_from_relations(adu_texts, relations)
+
+    def _graph_response(self, generated_graph):
+        if generated_graph is None:
+            return _EMPTY_RESPONSE
+        return graph_construction_pb2.GraphConstructionResponse(graph=generated_graph)
 
+    @propagate_deadline
+    @single_flight
     def GraphConstruction(self, request, context):
         adus = request.adus
         entailments = request.entailments
         major_claim_id = request.major_claim_id
         generated_graph = self._construct_graph(adus, entailments, major_claim_id)
-        if generated_graph is None:
-            return graph_construction_pb2.GraphConstructionResponse(
-                graph=arguebuf.dump.protobuf(arguebuf.Graph())
-            )
-        return graph_construction_pb2.GraphConstructionResponse(
-            graph=arguebuf.dump.protobuf(generated_graph)
+        return self._graph_response(generated_graph)
+
+
+class AsyncGraphConstructionServicer(GraphConstructionServicer):
+    """`GraphConstructionServicer` for `grpc.aio` servers."""
+
+    async def _aconstruct_graph(self, adus, entailments, major_claim_id):
+        return await self._abuild_graph(
+            {id: adu.text for id, adu in adus.items()},
+            self._convert_entailments(entailments),
+            major_claim_id,
+        )
+
+    async def _abuild_graph(self, adu_texts, relations, major_claim_id):
+        relations = await self.graph_constructor.abuild_relations(
+            adu_texts, relations, major_claim_id
+        )
+        if relations is None:
+            return None
+        return self.graph_constructor.protobuf_from_relations(adu_texts, relations)
+
+    @propagate_deadline
+    @single_flight
+    async def GraphConstruction(self, request, context):
+        generated_graph = await self._aconstruct_graph(
+            request.adus, request.entailments, request.major_claim_id
         )
+        return self._graph_response(generated_graph)
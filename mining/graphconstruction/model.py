@@ -1,13 +1,43 @@
+import importlib.metadata
+import itertools
 import json
-import os
-from typing import Mapping
+from typing import Any, Iterator, Mapping
+from uuid import UUID, uuid4
 
-import openai
+from arg_services.graph.v1 import graph_pb2
 from arguebuf import AtomNode, Edge, Graph, SchemeNode
 from arguebuf.model.scheme import Attack, Support
+from openai.types.chat import ChatCompletion
+
+from common.gateway import LLMGateway, get_gateway
+from common.metrics import timed_parse
+
+from .repair import RelationGraph
+
+# reported by arguebuf as the version of the library that wrote a graph
+try:
+    _library_version = importlib.metadata.version("arg_services")
+except importlib.metadata.PackageNotFoundError:
+    _library_version = ""
+
+
+def _uuids() -> Iterator[str]:
+    # consecutive ids after a random v4 uuid, a fresh uuid per element
+    # (as used by arguebuf) dominates the time needed to build a graph
+    base = uuid4().int & ~0xFFFFFFFF
+
+    for idx in itertools.count():
+        yield str(UUID(int=base | idx))
 
 
 class GraphConstructor:
+    """Completes the entailments to a graph rooted at the major claim.
+
+    Cycles and relations leaving the major claim are removed locally. The model
+    is only asked to attach the ADUs that have no path to the major claim yet,
+    so no completion is needed if the entailments already connect all of them.
+    """
+
     _system_prompt: str = """
     The user will provide a list of argumentative discourse units (ADUs), the relations between these and the ID of the major claim.
     The user provided relations do not include relations between the major claim and other ADUs. Generating these relations is your task.
@@ -42,17 +72,26 @@ class GraphConstructor:
         "attack": Attack.DEFAULT,
     }
 
-    def __init__(self, model="gpt-4-turbo-preview"):
-        self.model = model
-        self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    _scheme_mapping = {
+        "support": ("support", graph_pb2.Support.SUPPORT_DEFAULT),
+        "attack": ("attack", graph_pb2.Attack.ATTACK_DEFAULT),
+    }
 
-    def build_graph(
+    def __init__(
+        self,
+        model: str = "gpt-4-turbo-preview",
+        gateway: LLMGateway | None = None,
+    ):
+        self.gateway = gateway or get_gateway()
+        self.model = self.gateway.resolve_model(model)
+
+    def _request(
         self,
         adus: Mapping[str, str],
         relations: list[dict[str, str]],
         major_claim_id: str,
-    ) -> Graph | None:
-        completion = self.openai_client.chat.completions.create(
+    ) -> dict[str, Any]:
+        return dict(
             model=self.model,
             messages=[
                 {"role": "system", "content": self._system_prompt},
@@ -87,11 +126,26 @@ class GraphConstructor:
             ],
             function_call={"name": "predict_relations"},
         )
+
+    @timed_parse
+    def _parse(self, completion: ChatCompletion) -> list[dict[str, str]] | None:
         message = completion.choices[0].message.function_call
         if message is None:
             return None
         arguments = message.arguments
         relations = json.loads(arguments).get("relations", [])
+        return [
+            relation
+            for relation in relations
+            if relation.get("type") in self._type_mapping
+            and "source" in relation
+            and "target" in relation
+        ]
+
+    @classmethod
+    def graph_from_relations(
+        cls, adus: Mapping[str, str], relations: list[dict[str, str]]
+    ) -> Graph:
         graph = Graph()
         i_nodes = {}
         for adu_id, adu_text in adus.items():
@@ -103,9 +157,167 @@ class GraphConstructor:
             target_node = i_nodes.get(relation["target"], None)
             if source_node is None or target_node is None:
                 continue
-            relation_type = self._type_mapping[relation["type"]]
+            relation_type = cls._type_mapping[relation["type"]]
             s_node = SchemeNode(relation_type)
             graph.add_node(s_node)
             graph.add_edge(Edge(source_node, s_node))
             graph.add_edge(Edge(s_node, target_node))
         return graph
+
+    @classmethod
+    def protobuf_from_relations(
+        cls, adus: Mapping[str, str], relations: list[dict[str, str]]
+    ) -> graph_pb2.Graph:
+        """Same graph as `graph_from_relations`, written directly as protobuf.
+
+        Skips the arguebuf objects and their conversion, which dominate the
+        response time of large graphs. All elements share one timestamp.
+        """
+
+        ids = _uuids()
+        graph = graph_pb2.Graph(schema_version=1, library_version=_library_version)
+        graph.metadata.created.GetCurrentTime()
+        graph.metadata.updated.CopyFrom(graph.metadata.created)
+        metadata = graph.metadata
+        nodes = graph.nodes
+        edges = graph.edges
+        i_nodes = {}
+        for adu_id, adu_text in adus.items():
+            node_id = next(ids)
+            node = nodes[node_id]
+            node.atom.text = adu_text
+            node.metadata.CopyFrom(metadata)
+            i_nodes[adu_id] = node_id
+        for relation in relations:
+            source_id = i_nodes.get(relation["source"], None)
+            target_id = i_nodes.get(relation["target"], None)
+            if source_id is None or target_id is None:
+                continue
+            s_node_id = next(ids)
+            s_node = nodes[s_node_id]
+            scheme, value = cls._scheme_mapping[relation["type"]]
+            setattr(s_node.scheme, scheme, value)
+            s_node.metadata.CopyFrom(metadata)
+            for edge_source, edge_target in (
+                (source_id, s_node_id),
+                (s_node_id, target_id),
+            ):
+                edge = edges[next(ids)]
+                edge.source = edge_source
+                edge.target = edge_target
+                edge.metadata.CopyFrom(metadata)
+        return graph
+
+    def _plan(
+        self,
+        adus: Mapping[str, str],
+        relations: list[dict[str, str]],
+        major_claim_id: str,
+    ) -> tuple[RelationGraph, dict[str, Any] | None]:
+        """Repair the given relations locally and build the request for the ADUs
+        that are still not connected to the major claim (if any)."""
+
+        graph = RelationGraph(adus, relations, major_claim_id)
+
+        if major_claim_id not in adus:
+            # without a root, only the model can complete the graph
+            return graph, self._request(adus, graph.relations, major_claim_id)
+
+        components = graph.disconnected()
+
+        if not components:
+            return graph, None
+
+        ids = {adu_id for component in components for adu_id in component}
+        ids.add(major_claim_id)
+
+        return graph, self._request(
+            {adu_id: text for adu_id, text in adus.items() if adu_id in ids},
+            [
+                relation
+                for relation in graph.relations
+                if relation["source"] in ids and relation["target"] in ids
+            ],
+            major_claim_id,
+        )
+
+    def _finish(
+        self,
+        adus: Mapping[str, str],
+        graph: RelationGraph,
+        predicted: list[dict[str, str]] | None,
+    ) -> list[dict[str, str]] | None:
+        if graph.root not in adus:
+            if predicted is None:
+                return None
+
+            graph.add(predicted)
+
+            return graph.relations
+
+        # the model may only attach the ADUs that were disconnected
+        disconnected = set(adus) - graph.connected()
+        graph.add(
+            relation
+            for relation in predicted or []
+            if relation["source"] in disconnected
+        )
+
+        # components the model failed to attach are attached via their local roots
+        for component in graph.disconnected():
+            graph.add(
+                {"source": adu_id, "target": graph.root, "type": "support"}
+                for adu_id in graph.sinks(component)
+            )
+
+        return graph.relations
+
+    def build_relations(
+        self,
+        adus: Mapping[str, str],
+        relations: list[dict[str, str]],
+        major_claim_id: str,
+    ) -> list[dict[str, str]] | None:
+        graph, request = self._plan(adus, relations, major_claim_id)
+        predicted = (
+            self.gateway.complete(parse=self._parse, **request)
+            if request is not None
+            else None
+        )
+        return self._finish(adus, graph, predicted)
+
+    async def abuild_relations(
+        self,
+        adus: Mapping[str, str],
+        relations: list[dict[str, str]],
+        major_claim_id: str,
+    ) -> list[dict[str, str]] | None:
+        graph, request = self._plan(adus, relations, major_claim_id)
+        predicted = (
+            await self.gateway.acomplete(parse=self._parse, **request)
+            if request is not None
+            else None
+        )
+        return self._finish(adus, graph, predicted)
+
+    def build_graph(
+        self,
+        adus: Mapping[str, str],
+        relations: list[dict[str, str]],
+        major_claim_id: str,
+    ) -> Graph | None:
+        graph_relations = self.build_relations(adus, relations, major_claim_id)
+        if graph_relations is None:
+            return None
+        return self.graph_from_relations(adus, graph_relations)
+
+    async def abuild_graph(
+        self,
+        adus: Mapping[str, str],
+        relations: list[dict[str, str]],
+        major_claim_id: str,
+    ) -> Graph | None:
+        graph_relations = await self.abuild_relations(adus, relations, major_claim_id)
+        if graph_relations is None:
+            return None
+        return self.graph_from_relations(adus, graph_relations)
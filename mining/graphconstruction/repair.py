@@ -0,0 +1,184 @@
+from collections import defaultdict, deque
+from typing import Iterable, Mapping
+
+
+class RelationGraph:
+    """Directed relations between ADUs (source supports/attacks target) rooted at
+    the major claim, with checks for cycles and disconnected ADUs.
+
+    Relations with unknown ids, self-loops, duplicates, relations leaving the root
+    and relations closing a cycle are dropped on construction, which takes a
+    single DFS (linear time). `connected` and `disconnected` are linear as well,
+    while `add` searches the graph once per added relation (O(V + E) each).
+    """
+
+    def __init__(
+        self,
+        adus: Iterable[str],
+        relations: Iterable[Mapping[str, str]],
+        root: str,
+    ):
+        self.nodes = list(adus)
+        self.root = root
+        self.relations: list[dict[str, str]] = []
+        self._successors: defaultdict[str, set[str]] = defaultdict(set)
+        known = set(self.nodes)
+
+        for relation in relations:
+            source, target = relation["source"], relation["target"]
+
+            if (
+                source in known
+                and target in known
+                and source != target
+                and source != root
+                and target not in self._successors[source]
+            ):
+                self._successors[source].add(target)
+                self.relations.append(dict(relation))
+
+        self._drop_back_edges()
+
+    def _drop_back_edges(self) -> None:
+        # iterative DFS, edges to nodes on the current path close a cycle
+        on_path: set[str] = set()
+        done: set[str] = set()
+        dropped: set[tuple[str, str]] = set()
+
+        for start in self.nodes:
+            if start in done:
+                continue
+
+            stack = [(start, iter(sorted(self._successors[start])))]
+            on_path.add(start)
+
+            while stack:
+                node, successors = stack[-1]
+                successor = next(successors, None)
+
+                if successor is None:
+                    stack.pop()
+                    on_path.discard(node)
+                    done.add(node)
+                elif successor in on_path:
+                    dropped.add((node, successor))
+                elif successor not in done:
+                    on_path.add(successor)
+                    stack.append((successor, iter(sorted(self._successors[successor]))))
+
+        for source, target in dropped:
+            self._successors[source].discard(target)
+
+        self.relations = [
+            relation
+            for relation in self.relations
+            if (relation["source"], relation["target"]) not in dropped
+        ]
+
+    def _reaches(self, source: str, target: str) -> bool:
+        queue = deque([source])
+        visited = {source}
+
+        while queue:
+            node = queue.popleft()
+
+            if node == target:
+                return True
+
+            for successor in self._successors[node] - visited:
+                visited.add(successor)
+                queue.append(successor)
+
+        return False
+
+    def add(self, relations: Iterable[Mapping[str, str]]) -> list[dict[str, str]]:
+        """Add valid relations that keep the graph acyclic and return them.
+
+        Relations to the root need no search, since the root has no outgoing
+        relations and thus cannot be part of a cycle.
+        """
+
+        known = set(self.nodes)
+        added = []
+
+        for relation in relations:
+            source, target = relation["source"], relation["target"]
+
+            if (
+                source not in known
+                or target not in known
+                or source == target
+                or source == self.root
+                or target in self._successors[source]
+                or (target != self.root and self._reaches(target, source))
+            ):
+                continue
+
+            self._successors[source].add(target)
+            self.relations.append(dict(relation))
+            added.append(dict(relation))
+
+        return added
+
+    def connected(self) -> set[str]:
+        """ADUs with a path to the root."""
+
+        predecessors: defaultdict[str, list[str]] = defaultdict(list)
+
+        for source, targets in self._successors.items():
+            for target in targets:
+                predecessors[target].append(source)
+
+        queue = deque([self.root])
+        visited = {self.root}
+
+        while queue:
+            for predecessor in predecessors[queue.popleft()]:
+                if predecessor not in visited:
+                    visited.add(predecessor)
+                    queue.append(predecessor)
+
+        return visited
+
+    def disconnected(self) -> list[list[str]]:
+        """Weakly connected components of the ADUs without a path to the root."""
+
+        connected = self.connected()
+        remaining = [node for node in self.nodes if node not in connected]
+        neighbors: defaultdict[str, set[str]] = defaultdict(set)
+
+        for source, targets in self._successors.items():
+            for target in targets:
+                neighbors[source].add(target)
+                neighbors[target].add(source)
+
+        order = {node: idx for idx, node in enumerate(self.nodes)}
+        components = []
+        seen: set[str] = set()
+
+        for start in remaining:
+            if start in seen:
+                continue
+
+            component = []
+            queue = deque([start])
+            seen.add(start)
+
+            while queue:
+                node = queue.popleft()
+                component.append(node)
+
+                for neighbor in neighbors[node]:
+                    # connected neighbors are not part of the component
+                    if neighbor not in seen and neighbor not in connected:
+                        seen.add(neighbor)
+                        queue.append(neighbor)
+
+            components.append(sorted(component, key=order.__getitem__))
+
+        return components
+
+    def sinks(self, component: Iterable[str]) -> list[str]:
+        """ADUs of `component` without outgoing relations, i.e., its local roots."""
+
+        return [node for node in component if not self._successors[node]]
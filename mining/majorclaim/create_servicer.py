@@ -2,6 +2,9 @@ from typing import Mapping
 
 from arg_services.mining.v1beta import adu_pb2, major_claim_pb2, major_claim_pb2_grpc
 
+from common.deadline import propagate_deadline
+from common.singleflight import single_flight
+
 from .model import MajorClaimGenerator
 
 
@@ -10,6 +13,14 @@ class MajorClaimServicer(major_claim_pb2_grpc.MajorClaimServiceServicer):
         super().__init__()
         self.majorclaim_generator = MajorClaimGenerator(*args, **kwargs)
 
+    def _convert_ranking(
+        self, majorclaim_probs: Mapping[str, float]
+    ) -> list[major_claim_pb2.MajorClaimResult]:
+        return [
+            major_claim_pb2.MajorClaimResult(id=id, probability=prob)
+            for id, prob in majorclaim_probs.items()
+        ]
+
     def _get_ranking(
         self, segments: Mapping[str, adu_pb2.Segment]
     ) -> list[major_claim_pb2.MajorClaimResult]:
@@ -17,14 +28,30 @@ class MajorClaimServicer(major_claim_pb2_grpc.MajorClaimServiceServicer):
         # Achtung: hier kommen Segments an, keine ADUs, welche die OAI Implementierung erwartet
         # text = " ".join(texts)
         majorclaim_probs = self.majorclaim_generator.get_majorclaim_probs(adus)
-        results = [
-            major_claim_pb2.MajorClaimResult(id=id, probability=prob)
-            for id, prob in majorclaim_probs.items()
-        ]
-        return results
+        return self._convert_ranking(majorclaim_probs)
 
+    @propagate_deadline
+    @single_flight
     def MajorClaim(self, request, context):
         segments = (
             request.segments
         )  # maybe should be named more consistently, 02 uses adus
         return major_claim_pb2.MajorClaimResponse(ranking=self._get_ranking(segments))
+
+
+class AsyncMajorClaimServicer(MajorClaimServicer):
+    """`MajorClaimServicer` for `grpc.aio` servers."""
+
+    async def _aget_ranking(
+        self, segments: Mapping[str, adu_pb2.Segment]
+    ) -> list[major_claim_pb2.MajorClaimResult]:
+        adus = {key: segment.text for key, segment in segments.items()}
+        majorclaim_probs = await self.majorclaim_generator.aget_majorclaim_probs(adus)
+        return self._convert_ranking(majorclaim_probs)
+
+    @propagate_deadline
+    @single_flight
+    async def MajorClaim(self, request, context):
+        return major_claim_pb2.MajorClaimResponse(
+            ranking=await self._aget_ranking(request.segments)
+        )
@@ -1,8 +1,10 @@
 import json
-import os
-from typing import Mapping
+from typing import Any, Mapping
 
-import openai
+from openai.types.chat import ChatCompletion
+
+from common.gateway import LLMGateway, get_gateway
+from common.metrics import timed_parse
 
 
 class MajorClaimGenerator:
@@ -27,12 +29,16 @@ class MajorClaimGenerator:
         },
     }
 
-    def __init__(self, model="gpt-4-turbo-preview"):
-        self.model = model
-        self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(
+        self,
+        model: str = "gpt-4-turbo-preview",
+        gateway: LLMGateway | None = None,
+    ):
+        self.gateway = gateway or get_gateway()
+        self.model = self.gateway.resolve_model(model)
 
-    def get_majorclaim_probs(self, adus: Mapping[str, str]) -> Mapping[str, float]:
-        completion = self.openai_client.chat.completions.create(
+    def _request(self, adus: Mapping[str, str]) -> dict[str, Any]:
+        return dict(
             model=self.model,
             messages=[
                 {"role": "system", "content": self._system_prompt},
@@ -58,6 +64,9 @@ class MajorClaimGenerator:
             ],
             function_call={"name": "major_claim_rating"},
         )
+
+    @timed_parse
+    def _parse(self, completion: ChatCompletion) -> Mapping[str, float]:
         message = completion.choices[0].message.function_call
         if message is None:
             return {}
@@ -65,3 +74,11 @@ class MajorClaimGenerator:
 
         major_claim_probs = json.loads(arguments).get("major_claim_probabilities", [])
         return {mc["id"]: mc["probability"] for mc in major_claim_probs}
+
+    def get_majorclaim_probs(self, adus: Mapping[str, str]) -> Mapping[str, float]:
+        return self.gateway.complete(parse=self._parse, **self._request(adus))
+
+    async def aget_majorclaim_probs(
+        self, adus: Mapping[str, str]
+    ) -> Mapping[str, float]:
+        return await self.gateway.acomplete(parse=self._parse, **self._request(adus))
@@ -0,0 +1,23 @@
+import argparse
+import sys
+
+from google.protobuf.json_format import MessageToJson
+
+from .model import Pipeline
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Mine argument graphs from text files (or stdin) in-process."
+    )
+    parser.add_argument("files", nargs="*", type=argparse.FileType("r"))
+    args = parser.parse_args()
+
+    texts = [file.read() for file in args.files or [sys.stdin]]
+
+    for result in Pipeline().run_many(texts):
+        print(MessageToJson(result.graph))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+from arg_services.mining.v1beta import mining_pb2, mining_pb2_grpc
+
+from common.deadline import propagate_deadline
+from common.singleflight import single_flight
+
+from .model import Pipeline
+
+
+def _document_ids(request: mining_pb2.RunPipelineRequest) -> list[str | None] | None:
+    # optional ids of the texts in `extras["document_ids"]` enable incremental mining
+    if "document_ids" not in request.extras:
+        return None
+
+    return [id or None for id in request.extras["document_ids"]]
+
+
+class MiningServicer(mining_pb2_grpc.MiningServiceServicer):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__()
+        self.pipeline = Pipeline(*args, **kwargs)
+
+    @propagate_deadline
+    @single_flight
+    def RunPipeline(self, request, context):
+        results = self.pipeline.run_many(request.texts, _document_ids(request))
+        return mining_pb2.RunPipelineResponse(
+            graphs=[result.graph for result in results]
+        )
+
+
+class AsyncMiningServicer(MiningServicer):
+    """`MiningServicer` for `grpc.aio` servers."""
+
+    @propagate_deadline
+    @single_flight
+    async def RunPipeline(self, request, context):
+        results = await self.pipeline.arun_many(request.texts, _document_ids(request))
+        return mining_pb2.RunPipelineResponse(
+            graphs=[result.graph for result in results]
+        )
@@ -0,0 +1,293 @@
+import asyncio
+import contextvars
+import difflib
+import hashlib
+import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent import futures
+from dataclasses import dataclass, field
+from typing import Sequence
+
+from common.deadline import RequestAborted
+from mining.entailment.model import EntailmentClassifier, Relation
+from mining.extraction.model import ADU, Extractor
+
+logger = logging.getLogger(__name__)
+
+
+def segment_keys(texts: Sequence[str]) -> list[str]:
+    """Stable keys of segments, derived from their (whitespace-normalized) text.
+
+    Repeated segments of a document are numbered to keep their keys unique.
+    """
+
+    seen: Counter[str] = Counter()
+    keys = []
+
+    for text in texts:
+        digest = hashlib.sha256(" ".join(text.split()).encode()).hexdigest()[:16]
+        keys.append(f"{digest}-{seen[digest]}")
+        seen[digest] += 1
+
+    return keys
+
+
+@dataclass
+class DocumentVersion:
+    keys: list[str]
+    adus: dict[str, list[ADU]]
+    relations: list[Relation]
+
+
+class DocumentStore:
+    """Latest mined version of the `max_documents` most recently used documents."""
+
+    def __init__(self, max_documents: int = 1024):
+        self.max_documents = max_documents
+        self._documents: OrderedDict[str, DocumentVersion] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, document_id: str) -> DocumentVersion | None:
+        with self._lock:
+            version = self._documents.get(document_id)
+
+            if version is not None:
+                self._documents.move_to_end(document_id)
+
+            return version
+
+    def set(self, document_id: str, version: DocumentVersion) -> None:
+        with self._lock:
+            self._documents[document_id] = version
+            self._documents.move_to_end(document_id)
+
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+
+
+@dataclass
+class _Plan:
+    keys: list[str]
+    texts: dict[str, str]
+    previous: DocumentVersion | None
+    # segments without stored ADUs
+    classify: list[str]
+    # segments whose entailments have to be predicted again
+    neighbourhood: list[str]
+
+
+@dataclass
+class IncrementalResult:
+    """Outcome of mining one document version, all ids are segment keys."""
+
+    keys: list[str]
+    adus: dict[str, list[ADU]]
+    relations: list[Relation]
+    classified: list[str] = field(default_factory=list)
+    predicted: list[str] = field(default_factory=list)
+    errors: dict[str, str] = field(default_factory=dict)
+
+    def relations_by_index(self) -> list[Relation]:
+        """Relations with the segment indices as ids."""
+
+        indices = {key: str(idx) for idx, key in enumerate(self.keys)}
+
+        return [
+            relation.model_copy(
+                update={
+                    "source": indices[relation.source],
+                    "target": indices[relation.target],
+                }
+            )
+            for relation in self.relations
+        ]
+
+
+class IncrementalMiner:
+    """Re-mines revised documents by diffing their segments against the last version.
+
+    ADUs are only extracted for segments that were not part of the previous version.
+    Entailments are only predicted for changed segments and the `radius` segments
+    around them, relations among the other segments are taken from the previous version.
+    """
+
+    def __init__(
+        self,
+        extractor: Extractor | None = None,
+        classifier: EntailmentClassifier | None = None,
+        store: DocumentStore | None = None,
+        radius: int = 2,
+        max_concurrency: int = 8,
+    ):
+        self.extractor = extractor or Extractor()
+        self.classifier = classifier or EntailmentClassifier()
+        self.store = store or DocumentStore()
+        self.radius = radius
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="incremental"
+        )
+
+    def _plan(self, document_id: str, texts: Sequence[str], classify: bool) -> _Plan:
+        keys = segment_keys(texts)
+        previous = self.store.get(document_id)
+        known = previous.adus if previous is not None else {}
+        affected: set[int] = set()
+
+        if previous is None:
+            affected.update(range(len(keys)))
+        else:
+            matcher = difflib.SequenceMatcher(a=previous.keys, b=keys, autojunk=False)
+
+            for tag, _, _, start, end in matcher.get_opcodes():
+                if tag != "equal":
+                    # deletions (start == end) affect the segments around the gap
+                    affected.update(
+                        range(
+                            max(0, start - self.radius),
+                            min(len(keys), end + self.radius),
+                        )
+                    )
+
+        return _Plan(
+            keys=keys,
+            texts=dict(zip(keys, texts)),
+            previous=previous,
+            classify=[key for key in keys if key not in known] if classify else [],
+            neighbourhood=[keys[idx] for idx in sorted(affected)],
+        )
+
+    def _window(self, plan: _Plan) -> dict[str, str]:
+        # short local ids keep the prompt identical to a regular request
+        return {str(idx): plan.texts[key] for idx, key in enumerate(plan.neighbourhood)}
+
+    def _finish(
+        self,
+        document_id: str,
+        plan: _Plan,
+        predicted: list[Relation],
+        adus: dict[str, list[ADU]],
+        errors: dict[str, str],
+    ) -> IncrementalResult:
+        current = set(plan.keys)
+        neighbourhood = set(plan.neighbourhood)
+        previous_adus = plan.previous.adus if plan.previous is not None else {}
+        previous_relations = plan.previous.relations if plan.previous else []
+
+        kept = [
+            relation
+            for relation in previous_relations
+            if relation.source in current
+            and relation.target in current
+            and not (
+                relation.source in neighbourhood and relation.target in neighbourhood
+            )
+        ]
+        local_keys = dict(enumerate(plan.neighbourhood))
+        updated = [
+            relation.model_copy(
+                update={
+                    "source": local_keys[int(relation.source)],
+                    "target": local_keys[int(relation.target)],
+                }
+            )
+            for relation in predicted
+            if relation.source.isdigit()
+            and relation.target.isdigit()
+            and int(relation.source) in local_keys
+            and int(relation.target) in local_keys
+        ]
+        relations = self.classifier._merge(plan.texts, [kept, updated])
+        merged_adus = {
+            key: adus[key] if key in adus else previous_adus[key]
+            for key in plan.keys
+            if key in adus or key in previous_adus
+        }
+
+        # failed segments have no ADUs and are thus classified again next time
+        self.store.set(document_id, DocumentVersion(plan.keys, merged_adus, relations))
+
+        return IncrementalResult(
+            keys=plan.keys,
+            adus=merged_adus,
+            relations=relations,
+            classified=[key for key in plan.classify if key in adus],
+            predicted=plan.neighbourhood,
+            errors=errors,
+        )
+
+    def mine_segments(
+        self, document_id: str, texts: Sequence[str], classify: bool = True
+    ) -> IncrementalResult:
+        plan = self._plan(document_id, texts, classify)
+        # copy the context so that the workers see the deadline of the RPC
+        pending = {
+            key: self.executor.submit(
+                contextvars.copy_context().run,
+                self.extractor.evaluation,
+                plan.texts[key],
+            )
+            for key in plan.classify
+        }
+        window = self._window(plan)
+        predicted = self.classifier.predict(window) if window else []
+        adus: dict[str, list[ADU]] = {}
+        errors: dict[str, str] = {}
+
+        for key, future in pending.items():
+            try:
+                adus[key] = future.result()
+            except RequestAborted:
+                for other in pending.values():
+                    other.cancel()
+                raise
+            except Exception as e:
+                logger.exception("Classification of segment %s failed", key)
+                errors[key] = str(e)
+
+        return self._finish(document_id, plan, predicted, adus, errors)
+
+    async def amine_segments(
+        self, document_id: str, texts: Sequence[str], classify: bool = True
+    ) -> IncrementalResult:
+        plan = self._plan(document_id, texts, classify)
+        window = self._window(plan)
+
+        async def predict() -> list[Relation]:
+            return await self.classifier.apredict(window) if window else []
+
+        predicted, *results = await asyncio.gather(
+            predict(),
+            *(self.extractor.aevaluation(plan.texts[key]) for key in plan.classify),
+            return_exceptions=True,
+        )
+        adus: dict[str, list[ADU]] = {}
+        errors: dict[str, str] = {}
+
+        if isinstance(predicted, BaseException):
+            raise predicted
+
+        for key, result in zip(plan.classify, results):
+            if isinstance(result, RequestAborted):
+                raise result
+            elif isinstance(result, Exception):
+                logger.error("Classification of segment %s failed: %s", key, result)
+                errors[key] = str(result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                adus[key] = result
+
+        return self._finish(document_id, plan, predicted, adus, errors)
+
+    def mine(self, document_id: str, text: str) -> IncrementalResult:
+        segments = self.extractor.divide_segments(text)
+        return self.mine_segments(document_id, [segment.text for segment in segments])
+
+    async def amine(self, document_id: str, text: str) -> IncrementalResult:
+        segments = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.extractor.divide_segments, text
+        )
+        return await self.amine_segments(
+            document_id, [segment.text for segment in segments]
+        )
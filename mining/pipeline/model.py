@@ -0,0 +1,377 @@
+import asyncio
+import contextvars
+from concurrent import futures
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Mapping, Sequence
+
+from arg_services.graph.v1 import graph_pb2
+from arg_services.mining.v1beta import adu_pb2, entailment_pb2, major_claim_pb2
+
+from mining.entailment.create_servicer import (
+    AsyncEntailmentServicer,
+    EntailmentServicer,
+)
+from mining.extraction.create_servicer import (
+    AsyncExtractionServicer,
+    ExtractionServicer,
+)
+from mining.extraction.model import ADU
+from mining.fused.model import FusedMiner, FusedPrediction
+from mining.graphconstruction.create_servicer import (
+    AsyncGraphConstructionServicer,
+    GraphConstructionServicer,
+)
+from mining.majorclaim.create_servicer import (
+    AsyncMajorClaimServicer,
+    MajorClaimServicer,
+)
+
+from .incremental import DocumentStore, IncrementalMiner, IncrementalResult
+
+
+@dataclass
+class PipelineResult:
+    segments: dict[str, adu_pb2.Segment]
+    entailments: list[entailment_pb2.Entailment]
+    ranking: list[major_claim_pb2.MajorClaimResult]
+    major_claim_id: str
+    graph: graph_pb2.Graph
+    adus: list[adu_pb2.Adu] = field(default_factory=list)
+    classification_errors: dict[str, str] = field(default_factory=dict)
+
+
+class Pipeline:
+    """Runs all mining steps in-process, passing protobuf messages in memory.
+
+    The steps form the following dependency graph, independent steps run concurrently:
+
+        segmentation -> entailments ----+
+                     -> major claim ----+-> graph construction
+                     -> classification (optional, not needed for the graph)
+
+    The steps are executed by the given servicers, so that a server can share its
+    models with the pipeline. `arun` and `arun_many` require the async servicers.
+
+    Documents passed with an id are mined incrementally: classification and
+    entailments are only computed for the segments changed since the last version
+    of the document in `documents` (see `IncrementalMiner`).
+    All other documents can be mined in `fused` mode, which predicts entailments,
+    major claim and graph in a single completion (see `FusedMiner`).
+    """
+
+    def __init__(
+        self,
+        extraction: ExtractionServicer | None = None,
+        entailment: EntailmentServicer | None = None,
+        majorclaim: MajorClaimServicer | None = None,
+        graphconstruction: GraphConstructionServicer | None = None,
+        classify: bool = False,
+        max_concurrency: int = 8,
+        documents: DocumentStore | None = None,
+        fused: bool = False,
+    ):
+        self.extraction = extraction or AsyncExtractionServicer()
+        self.entailment = entailment or AsyncEntailmentServicer()
+        self.majorclaim = majorclaim or AsyncMajorClaimServicer()
+        self.graphconstruction = graphconstruction or AsyncGraphConstructionServicer()
+        self.classify = classify
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="pipeline"
+        )
+        self.miner = IncrementalMiner(
+            self.extraction.extractor,
+            self.entailment.entailment_classifier,
+            documents,
+            max_concurrency=max_concurrency,
+        )
+        self.fused = (
+            FusedMiner(gateway=self.entailment.entailment_classifier.gateway)
+            if fused
+            else None
+        )
+
+    def _segments(self, texts: Iterable[str]) -> list[dict[str, adu_pb2.Segment]]:
+        # all documents are parsed in a single spaCy pass
+        return [
+            {
+                str(idx): adu_pb2.Segment(
+                    text=segment.text, start=segment.start, end=segment.end
+                )
+                for idx, segment in enumerate(segments)
+            }
+            for segments in self.extraction.extractor.divide_segments_batch(texts)
+        ]
+
+    def _submit(self, fn, *args) -> futures.Future:
+        # copy the context so that the workers see the deadline of the RPC
+        return self.executor.submit(contextvars.copy_context().run, fn, *args)
+
+    @staticmethod
+    def _then(future: futures.Future, fn: Callable[[Any], Any]) -> futures.Future:
+        derived: futures.Future = futures.Future()
+
+        def done(future: futures.Future) -> None:
+            try:
+                derived.set_result(fn(future.result()))
+            except BaseException as e:
+                derived.set_exception(e)
+
+        future.add_done_callback(done)
+
+        return derived
+
+    def _incremental_entailments(
+        self, result: IncrementalResult
+    ) -> list[entailment_pb2.Entailment]:
+        return self.entailment._convert_entailments(result.relations_by_index())
+
+    def _incremental_classification(
+        self, result: IncrementalResult
+    ) -> tuple[list[adu_pb2.Adu], dict[str, str]]:
+        indices = {key: str(idx) for idx, key in enumerate(result.keys)}
+        adus = [
+            adu
+            for key, idx in indices.items()
+            if key in result.adus
+            for adu in self.extraction._convert_adus(idx, result.adus[key])
+        ]
+
+        return adus, {indices[key]: error for key, error in result.errors.items()}
+
+    def _classification(
+        self, result: tuple[dict[str, list[ADU]], dict[str, str]]
+    ) -> tuple[list[adu_pb2.Adu], dict[str, str]]:
+        adus, errors = result
+
+        return [
+            adu
+            for key, segment_adus in adus.items()
+            for adu in self.extraction._convert_adus(key, segment_adus)
+        ], errors
+
+    def _fused_entailments(
+        self, prediction: FusedPrediction
+    ) -> list[entailment_pb2.Entailment]:
+        return self.entailment._convert_entailments(prediction.relations)
+
+    def _fused_ranking(
+        self, prediction: FusedPrediction
+    ) -> list[major_claim_pb2.MajorClaimResult]:
+        return self.majorclaim._convert_ranking(prediction.major_claim_probabilities)
+
+    @staticmethod
+    def _major_claim_id(ranking: list[major_claim_pb2.MajorClaimResult]) -> str:
+        if not ranking:
+            return ""
+
+        return max(ranking, key=lambda result: result.probability).id
+
+    def _graph(self, graph: graph_pb2.Graph | None) -> graph_pb2.Graph:
+        if graph is not None:
+            return graph
+
+        # the empty response is shared, results get their own copy
+        empty = graph_pb2.Graph()
+        empty.CopyFrom(self.graphconstruction._graph_response(None).graph)
+        return empty
+
+    def _start(
+        self, segments: Mapping[str, adu_pb2.Segment], document_id: str | None = None
+    ) -> tuple[
+        futures.Future, futures.Future, futures.Future | None, futures.Future | None
+    ]:
+        texts = {key: segment.text for key, segment in segments.items()}
+
+        if document_id is not None:
+            mined = self._submit(
+                self.miner.mine_segments,
+                document_id,
+                list(texts.values()),
+                self.classify,
+            )
+            entailments = self._then(mined, self._incremental_entailments)
+            ranking = self._submit(self.majorclaim._get_ranking, segments)
+            classification = (
+                self._then(mined, self._incremental_classification)
+                if self.classify
+                else None
+            )
+
+            return entailments, ranking, classification, None
+
+        classification = (
+            self._then(
+                self._submit(self.extraction._classify_segments, texts),
+                self._classification,
+            )
+            if self.classify
+            else None
+        )
+
+        if self.fused is not None:
+            prediction = self._submit(self.fused.predict, texts)
+
+            return (
+                self._then(prediction, self._fused_entailments),
+                self._then(prediction, self._fused_ranking),
+                classification,
+                self._then(prediction, FusedPrediction.graph_relations),
+            )
+
+        entailments = self._submit(self.entailment._get_entailments, segments)
+        ranking = self._submit(self.majorclaim._get_ranking, segments)
+
+        return entailments, ranking, classification, None
+
+    def _finish(
+        self,
+        segments: Mapping[str, adu_pb2.Segment],
+        entailments: futures.Future,
+        ranking: futures.Future,
+        classification: futures.Future | None,
+        relations: futures.Future | None,
+    ) -> PipelineResult:
+        major_claim_id = self._major_claim_id(ranking.result())
+        generated_graph = (
+            self.graphconstruction._build_graph(
+                {key: segment.text for key, segment in segments.items()},
+                relations.result(),
+                major_claim_id,
+            )
+            if relations is not None
+            else self.graphconstruction._construct_graph(
+                segments, entailments.result(), major_claim_id
+            )
+        )
+        adus, errors = classification.result() if classification else ([], {})
+
+        return PipelineResult(
+            segments=dict(segments),
+            entailments=entailments.result(),
+            ranking=ranking.result(),
+            major_claim_id=major_claim_id,
+            graph=self._graph(generated_graph),
+            adus=adus,
+            classification_errors=errors,
+        )
+
+    def run(self, text: str, document_id: str | None = None) -> PipelineResult:
+        return self.run_many([text], None if document_id is None else [document_id])[0]
+
+    def run_many(
+        self, texts: Iterable[str], document_ids: Sequence[str | None] | None = None
+    ) -> list[PipelineResult]:
+        documents = self._segments(texts)
+        document_ids = [*(document_ids or []), *[None] * len(documents)]
+        # all independent steps are queued before the graph constructions that
+        # wait for them, so the pool cannot fill up with waiting tasks
+        started = [
+            (segments, *self._start(segments, document_id))
+            for segments, document_id in zip(documents, document_ids)
+        ]
+        pending = [self._submit(self._finish, *stage) for stage in started]
+
+        return [future.result() for future in pending]
+
+    async def _arun_segments(
+        self, segments: Mapping[str, adu_pb2.Segment], document_id: str | None = None
+    ) -> PipelineResult:
+        mined = (
+            asyncio.ensure_future(
+                self.miner.amine_segments(
+                    document_id,
+                    [segment.text for segment in segments.values()],
+                    self.classify,
+                )
+            )
+            if document_id is not None
+            else None
+        )
+
+        async def get_entailments() -> list[entailment_pb2.Entailment]:
+            if mined is not None:
+                return self._incremental_entailments(await mined)
+
+            return await self.entailment._aget_entailments(segments)
+
+        async def classification() -> tuple[list[adu_pb2.Adu], dict[str, str]]:
+            if not self.classify:
+                return [], {}
+
+            if mined is not None:
+                return self._incremental_classification(await mined)
+
+            return self._classification(
+                await self.extraction._aclassify_segments(
+                    {key: segment.text for key, segment in segments.items()}
+                )
+            )
+
+        async def graph_construction() -> tuple[
+            list[entailment_pb2.Entailment],
+            list[major_claim_pb2.MajorClaimResult],
+            str,
+            graph_pb2.Graph | None,
+        ]:
+            if mined is None and self.fused is not None:
+                texts = {key: segment.text for key, segment in segments.items()}
+                prediction = await self.fused.apredict(texts)
+                ranking = self._fused_ranking(prediction)
+                major_claim_id = self._major_claim_id(ranking)
+                # the predicted graph is repaired like separately predicted ones
+                graph = await self.graphconstruction._abuild_graph(
+                    texts, prediction.graph_relations(), major_claim_id
+                )
+
+                return (
+                    self._fused_entailments(prediction),
+                    ranking,
+                    major_claim_id,
+                    graph,
+                )
+
+            entailments, ranking = await asyncio.gather(
+                get_entailments(), self.majorclaim._aget_ranking(segments)
+            )
+            major_claim_id = self._major_claim_id(ranking)
+            graph = await self.graphconstruction._aconstruct_graph(
+                segments, entailments, major_claim_id
+            )
+
+            return entailments, ranking, major_claim_id, graph
+
+        (entailments, ranking, major_claim_id, graph), (adus, errors) = (
+            await asyncio.gather(graph_construction(), classification())
+        )
+
+        return PipelineResult(
+            segments=dict(segments),
+            entailments=entailments,
+            ranking=ranking,
+            major_claim_id=major_claim_id,
+            graph=self._graph(graph),
+            adus=adus,
+            classification_errors=errors,
+        )
+
+    async def arun(self, text: str, document_id: str | None = None) -> PipelineResult:
+        return (
+            await self.arun_many([text], None if document_id is None else [document_id])
+        )[0]
+
+    async def arun_many(
+        self, texts: Iterable[str], document_ids: Sequence[str | None] | None = None
+    ) -> list[PipelineResult]:
+        documents = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._segments, list(texts)
+        )
+        document_ids = [*(document_ids or []), *[None] * len(documents)]
+
+        return list(
+            await asyncio.gather(
+                *(
+                    self._arun_segments(segments, document_id)
+                    for segments, document_id in zip(documents, document_ids)
+                )
+            )
+        )
@@ -1,3 +1,5 @@
+import asyncio
+import os
 from concurrent import futures
 
 import grpc
@@ -6,35 +8,125 @@ from arg_services.mining.v1beta import (
     entailment_pb2_grpc,
     graph_construction_pb2_grpc,
     major_claim_pb2_grpc,
+    mining_pb2_grpc,
 )
 
-from mining.entailment.create_servicer import EntailmentServicer
-from mining.extraction.create_servicer import ExtractionServicer
-from mining.graphconstruction.create_servicer import GraphConstructionServicer
-from mining.majorclaim.create_servicer import MajorClaimServicer
+from common import prefork
+from common.metrics import AsyncMetricsInterceptor, MetricsInterceptor, setup_from_env
+from mining.entailment.create_servicer import (
+    AsyncEntailmentServicer,
+    EntailmentServicer,
+)
+from mining.extraction import nlp
+from mining.extraction.create_servicer import (
+    AsyncExtractionServicer,
+    ExtractionServicer,
+)
+from mining.graphconstruction.create_servicer import (
+    AsyncGraphConstructionServicer,
+    GraphConstructionServicer,
+)
+from mining.majorclaim.create_servicer import (
+    AsyncMajorClaimServicer,
+    MajorClaimServicer,
+)
+from mining.pipeline.create_servicer import AsyncMiningServicer, MiningServicer
 
 
-def serve():
-    global config, entailment_classifier, majorclaim_generator, nlp, graph_constructor
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    adu_pb2_grpc.add_AduServiceServicer_to_server(ExtractionServicer(), server)
-    entailment_pb2_grpc.add_EntailmentServiceServicer_to_server(
-        EntailmentServicer(),
-        server,
-    )
-    major_claim_pb2_grpc.add_MajorClaimServiceServicer_to_server(
-        MajorClaimServicer(),
-        server,
-    )
+def _extraction_options() -> dict:
+    return {
+        "max_concurrency": int(os.getenv("EXTRACTION_MAX_CONCURRENCY", "8")),
+        "spacy_model": os.getenv("SPACY_MODEL", nlp.DEFAULT_PIPELINE),
+        "segmentation_processes": int(os.getenv("SEGMENTATION_PROCESSES", "0")),
+        "segmentation_chunk_chars": int(os.getenv("SEGMENTATION_CHUNK_CHARS", "10000")),
+        "window_tokens": int(os.getenv("EXTRACTION_WINDOW_TOKENS", "0")) or None,
+        "window_overlap": int(os.getenv("EXTRACTION_WINDOW_OVERLAP", "2")),
+    }
+
+
+def _entailment_options() -> dict:
+    return {
+        "window_tokens": int(os.getenv("ENTAILMENT_WINDOW_TOKENS", "0")) or None,
+        "window_overlap": int(os.getenv("ENTAILMENT_WINDOW_OVERLAP", "2")),
+        "candidates": int(os.getenv("ENTAILMENT_CANDIDATES", "0")) or None,
+        "candidate_batch_size": int(os.getenv("ENTAILMENT_CANDIDATE_BATCH_SIZE", "32")),
+    }
+
+
+def _pipeline_options() -> dict:
+    return {"fused": os.getenv("PIPELINE_FUSED", "0") == "1"}
+
+
+def preload() -> None:
+    """Load the spaCy pipeline before the server forks its workers."""
+
+    nlp.load_pipeline(_extraction_options()["spacy_model"])
+
+
+def add_servicers(server, asynchronous: bool = False) -> None:
+    """Register all mining servicers (sync or `grpc.aio` variants) on `server`."""
+
+    if asynchronous:
+        extraction = AsyncExtractionServicer(**_extraction_options())
+        entailment = AsyncEntailmentServicer(**_entailment_options())
+        majorclaim = AsyncMajorClaimServicer()
+        graphconstruction = AsyncGraphConstructionServicer()
+        mining = AsyncMiningServicer(
+            extraction,
+            entailment,
+            majorclaim,
+            graphconstruction,
+            **_pipeline_options(),
+        )
+    else:
+        extraction = ExtractionServicer(**_extraction_options())
+        entailment = EntailmentServicer(**_entailment_options())
+        majorclaim = MajorClaimServicer()
+        graphconstruction = GraphConstructionServicer()
+        mining = MiningServicer(
+            extraction,
+            entailment,
+            majorclaim,
+            graphconstruction,
+            **_pipeline_options(),
+        )
+
+    adu_pb2_grpc.add_AduServiceServicer_to_server(extraction, server)
+    entailment_pb2_grpc.add_EntailmentServiceServicer_to_server(entailment, server)
+    major_claim_pb2_grpc.add_MajorClaimServiceServicer_to_server(majorclaim, server)
     graph_construction_pb2_grpc.add_GraphConstructionServiceServicer_to_server(
-        GraphConstructionServicer(),
-        server,
+        graphconstruction, server
+    )
+    mining_pb2_grpc.add_MiningServiceServicer_to_server(mining, server)
+
+
+def serve():
+    setup_from_env()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        interceptors=[MetricsInterceptor()],
     )
+    add_servicers(server)
     server.add_insecure_port("[::]:50500")
     server.start()
     print("Server started")
     server.wait_for_termination()
 
 
+async def serve_async():
+    setup_from_env()
+    server = grpc.aio.server(interceptors=[AsyncMetricsInterceptor()])
+    add_servicers(server, asynchronous=True)
+    server.add_insecure_port("[::]:50500")
+    await server.start()
+    print("Server started (asyncio)")
+    await server.wait_for_termination()
+
+
 if __name__ == "__main__":
-    serve()
+    if (processes := int(os.getenv("GRPC_PROCESSES", "1"))) > 1:
+        prefork.serve(add_servicers, "[::]:50500", processes, preload=preload)
+    elif os.getenv("GRPC_MODE", "sync") == "async":
+        asyncio.run(serve_async())
+    else:
+        serve()
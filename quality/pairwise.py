@@ -0,0 +1,416 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import math
+import threading
+from collections import OrderedDict
+from concurrent import futures
+from dataclasses import dataclass
+from typing import Any, Sequence
+
+from openai.types.chat import ChatCompletion
+
+from common.gateway import LLMGateway, get_gateway
+from common.metrics import timed_parse
+
+logger = logging.getLogger(__name__)
+
+Pair = tuple[int, int]
+
+
+class ComparisonCache:
+    """Scores of the `max_entries` most recently used premise comparisons.
+
+    Keys do not depend on the order of the premises, so a comparison of
+    (p1, p2) also answers (p2, p1).
+    """
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(claim: str, premise1: str, premise2: str) -> tuple[str, bool]:
+        swapped = premise2 < premise1
+        first, second = (premise2, premise1) if swapped else (premise1, premise2)
+        payload = json.dumps([claim, first, second])
+
+        return hashlib.sha256(payload.encode()).hexdigest(), swapped
+
+    def get(
+        self, claim: str, premise1: str, premise2: str
+    ) -> tuple[float, float] | None:
+        key, swapped = self._key(claim, premise1, premise2)
+
+        with self._lock:
+            scores = self._entries.get(key)
+
+            if scores is None:
+                return None
+
+            self._entries.move_to_end(key)
+
+        return scores[::-1] if swapped else scores
+
+    def set(
+        self, claim: str, premise1: str, premise2: str, scores: tuple[float, float]
+    ) -> None:
+        key, swapped = self._key(claim, premise1, premise2)
+
+        with self._lock:
+            self._entries[key] = scores[::-1] if swapped else scores
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@dataclass
+class RankedPremise:
+    index: int
+    premise: str
+    # share of won comparisons (ties count half, byes do not count), 0.5 without any
+    score: float
+    wins: float
+    comparisons: int
+    # mean score the model assigned to the premise
+    mean_score: float
+
+
+class _Standings:
+    def __init__(self, size: int):
+        self.points = [0.0] * size
+        self.games = [0] * size
+        self.scores: list[list[float]] = [[] for _ in range(size)]
+        self.played: set[Pair] = set()
+        self.byes: set[int] = set()
+
+    def mean(self, idx: int) -> float:
+        scores = self.scores[idx]
+        return sum(scores) / len(scores) if scores else 0.0
+
+    def share(self, idx: int) -> float:
+        """Share of won comparisons, premises without any count as average."""
+
+        games = self.games[idx]
+        return self.points[idx] / games if games else 0.5
+
+    def order(self) -> list[int]:
+        # by share rather than points, premises that had a bye played one game less
+        return sorted(
+            range(len(self.points)),
+            key=lambda idx: (-self.share(idx), -self.mean(idx), idx),
+        )
+
+    def _bye(self, order: list[int]) -> int:
+        """Premise that sits out this round.
+
+        It is taken from the lowest score group with an odd number of premises, so
+        that all other groups can be paired among themselves, and preferably has not
+        had a bye yet.
+        """
+
+        groups: dict[float, list[int]] = {}
+
+        for idx in order:
+            groups.setdefault(self.share(idx), []).append(idx)
+
+        for members in reversed(groups.values()):
+            candidates = [idx for idx in members if idx not in self.byes]
+
+            if len(members) % 2 and candidates:
+                return candidates[-1]
+
+        return next((idx for idx in reversed(order) if idx not in self.byes), order[-1])
+
+    def record(self, pair: Pair, scores: tuple[float, float] | None) -> None:
+        first, second = pair
+        self.played.add((min(pair), max(pair)))
+        self.games[first] += 1
+        self.games[second] += 1
+
+        if scores is None:
+            # identical premises or no answer for the pair, a tie without scores
+            self.points[first] += 0.5
+            self.points[second] += 0.5
+            return
+
+        self.scores[first].append(scores[0])
+        self.scores[second].append(scores[1])
+
+        if scores[0] > scores[1]:
+            self.points[first] += 1
+        elif scores[0] < scores[1]:
+            self.points[second] += 1
+        else:
+            self.points[first] += 0.5
+            self.points[second] += 0.5
+
+    def pairings(self) -> list[Pair]:
+        """Swiss pairing: neighbours in the current order that have not met yet."""
+
+        order = self.order()
+
+        if len(order) % 2:
+            # nothing is compared, so the bye neither adds points nor a game
+            bye = self._bye(order)
+            self.byes.add(bye)
+            order.remove(bye)
+
+        pairs = []
+
+        while order:
+            first = order.pop(0)
+            second = next(
+                (
+                    idx
+                    for idx in order
+                    if (min(first, idx), max(first, idx)) not in self.played
+                ),
+                order[0],
+            )
+            order.remove(second)
+            pairs.append((first, second))
+
+        return pairs
+
+
+class PairwiseRanker:
+    """Ranks many premises of a claim with a Swiss tournament of pairwise comparisons.
+
+    Every round pairs premises with similar standings, so ceil(log2 N) + 1
+    rounds of N/2 comparisons give a total ranking with
+    O(N log N) comparisons instead of the N(N-1)/2 of comparing all pairs.
+    Up to `batch_size` pairs are packed into one completion, the batches of a
+    round run concurrently.
+    """
+
+    _system_prompt: str = """
+    The user will provide a claim and a list of numbered premise pairs.
+    For each pair, evaluate which premise is more convincing with respect to the claim and give both premises a score between 0 and 1.
+    """
+
+    _comparison_schema: dict = {
+        "type": "object",
+        "required": ["pair", "premise1_score", "premise2_score"],
+        "properties": {
+            "pair": {
+                "type": "integer",
+                "description": "The number of the pair",
+            },
+            "premise1_score": {
+                "type": "number",
+                "description": "The score for premise 1",
+            },
+            "premise2_score": {
+                "type": "number",
+                "description": "The score for premise 2",
+            },
+        },
+    }
+
+    def __init__(
+        self,
+        model: str = "gpt-4",
+        gateway: LLMGateway | None = None,
+        batch_size: int = 8,
+        max_concurrency: int = 8,
+        cache: ComparisonCache | None = None,
+    ):
+        self.gateway = gateway or get_gateway()
+        self.model = self.gateway.resolve_model(model)
+        self.batch_size = batch_size
+        self.cache = cache or ComparisonCache()
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="pairwise"
+        )
+
+    def rounds(self, size: int) -> int:
+        return math.ceil(math.log2(size)) + 1 if size > 1 else 0
+
+    def _request(
+        self, claim: str, premises: Sequence[str], pairs: Sequence[Pair]
+    ) -> dict[str, Any]:
+        prompt = {
+            "claim": claim,
+            "pairs": [
+                {"pair": idx, "premise1": premises[first], "premise2": premises[second]}
+                for idx, (first, second) in enumerate(pairs)
+            ],
+        }
+
+        return dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self._system_prompt},
+                {"role": "user", "content": json.dumps(prompt)},
+            ],
+            functions=[
+                {
+                    "name": "compare_premises",
+                    "description": "Evaluate which premise of each pair is more convincing",
+                    "parameters": {
+                        "title": "Premise Comparison",
+                        "description": "Evaluate which premise of each pair is more convincing",
+                        "type": "object",
+                        "required": ["comparisons"],
+                        "properties": {
+                            "comparisons": {
+                                "type": "array",
+                                "items": self._comparison_schema,
+                            },
+                        },
+                    },
+                }
+            ],
+            function_call={"name": "compare_premises"},
+        )
+
+    @timed_parse
+    def _parse(
+        self, completion: ChatCompletion, size: int
+    ) -> dict[int, tuple[float, float]]:
+        message = completion.choices[0].message.function_call
+
+        if message is None:
+            return {}
+
+        scores = {}
+
+        for comparison in json.loads(message.arguments).get("comparisons", []):
+            try:
+                pair = int(comparison["pair"])
+                scores[pair] = (
+                    float(comparison["premise1_score"]),
+                    float(comparison["premise2_score"]),
+                )
+            except (KeyError, TypeError, ValueError):
+                logger.warning("Skipping malformed comparison %s", comparison)
+
+        return {pair: score for pair, score in scores.items() if 0 <= pair < size}
+
+    def _plan(
+        self, claim: str, premises: Sequence[str], pairs: Sequence[Pair]
+    ) -> tuple[dict[Pair, tuple[float, float]], list[list[Pair]]]:
+        known = {}
+        missing = []
+
+        for pair in pairs:
+            first, second = premises[pair[0]], premises[pair[1]]
+
+            if first == second:
+                continue
+
+            if (scores := self.cache.get(claim, first, second)) is not None:
+                known[pair] = scores
+            else:
+                missing.append(pair)
+
+        batches = [
+            missing[start : start + self.batch_size]
+            for start in range(0, len(missing), self.batch_size)
+        ]
+
+        return known, batches
+
+    def _remember(
+        self,
+        claim: str,
+        premises: Sequence[str],
+        batch: Sequence[Pair],
+        scores: dict[int, tuple[float, float]],
+    ) -> dict[Pair, tuple[float, float]]:
+        if len(scores) < len(batch):
+            logger.warning(
+                "Model answered %d of %d comparisons", len(scores), len(batch)
+            )
+
+        for idx, pair_scores in scores.items():
+            first, second = batch[idx]
+            self.cache.set(claim, premises[first], premises[second], pair_scores)
+
+        return {batch[idx]: pair_scores for idx, pair_scores in scores.items()}
+
+    def _compare(
+        self, claim: str, premises: Sequence[str], batch: Sequence[Pair]
+    ) -> dict[Pair, tuple[float, float]]:
+        scores = self.gateway.complete(
+            parse=functools.partial(self._parse, size=len(batch)),
+            **self._request(claim, premises, batch),
+        )
+        return self._remember(claim, premises, batch, scores)
+
+    async def _acompare(
+        self, claim: str, premises: Sequence[str], batch: Sequence[Pair]
+    ) -> dict[Pair, tuple[float, float]]:
+        scores = await self.gateway.acomplete(
+            parse=functools.partial(self._parse, size=len(batch)),
+            **self._request(claim, premises, batch),
+        )
+        return self._remember(claim, premises, batch, scores)
+
+    def _ranking(
+        self, premises: Sequence[str], standings: _Standings
+    ) -> list[RankedPremise]:
+        ranking = []
+
+        for idx in standings.order():
+            ranking.append(
+                RankedPremise(
+                    index=idx,
+                    premise=premises[idx],
+                    score=standings.share(idx),
+                    wins=standings.points[idx],
+                    comparisons=standings.games[idx],
+                    mean_score=standings.mean(idx),
+                )
+            )
+
+        return ranking
+
+    def rank(self, claim: str, premises: Sequence[str]) -> list[RankedPremise]:
+        standings = _Standings(len(premises))
+
+        for _ in range(self.rounds(len(premises))):
+            pairs = standings.pairings()
+            scores, batches = self._plan(claim, premises, pairs)
+            # copy the context so that the workers see the deadline of the RPC
+            pending = [
+                self.executor.submit(
+                    contextvars.copy_context().run,
+                    self._compare,
+                    claim,
+                    premises,
+                    batch,
+                )
+                for batch in batches
+            ]
+
+            for future in pending:
+                scores.update(future.result())
+
+            for pair in pairs:
+                standings.record(pair, scores.get(pair))
+
+        return self._ranking(premises, standings)
+
+    async def arank(self, claim: str, premises: Sequence[str]) -> list[RankedPremise]:
+        standings = _Standings(len(premises))
+
+        for _ in range(self.rounds(len(premises))):
+            pairs = standings.pairings()
+            scores, batches = self._plan(claim, premises, pairs)
+
+            for batch_scores in await asyncio.gather(
+                *(self._acompare(claim, premises, batch) for batch in batches)
+            ):
+                scores.update(batch_scores)
+
+            for pair in pairs:
+                standings.record(pair, scores.get(pair))
+
+        return self._ranking(premises, standings)
@@ -1,5 +1,10 @@
+import asyncio
+import dataclasses
 import json
+import logging
+import os
 from concurrent import futures
+from typing import Any
 
 import grpc
 import openai
@@ -7,6 +12,21 @@ from arg_services.quality.v1beta import explanation_pb2, explanation_pb2_grpc
 from arg_services.quality.v1beta.explanation_pb2_grpc import (
     QualityExplanationServiceServicer,
 )
+from google.protobuf import struct_pb2
+
+from common import prefork
+from common.deadline import RequestAborted, propagate_deadline
+from common.gateway import LLMGateway, get_gateway
+from common.metrics import (
+    AsyncMetricsInterceptor,
+    MetricsInterceptor,
+    setup_from_env,
+    timed_parse,
+)
+from common.singleflight import single_flight
+from quality.pairwise import PairwiseRanker
+
+logger = logging.getLogger(__name__)
 
 # Define your custom functions according to specific analysis needs
 evaluation_functions = [
@@ -43,71 +63,167 @@ evaluation_functions = [
 ]
 
 
+def _premises(request) -> list[str] | None:
+    # `extras["premises"]` ranks many premises instead of comparing two
+    if "premises" not in request.extras:
+        return None
+
+    return list(request.extras["premises"])
+
+
 class QualityExplanationService(QualityExplanationServiceServicer):
-    def Explain(self, request, context):
-        openai.api_key = "key"
+    def __init__(self, model: str = "gpt-4", gateway: LLMGateway | None = None):
+        super().__init__()
+        self.gateway = gateway or get_gateway()
+        self.model = self.gateway.resolve_model(model)
+        self.ranker = PairwiseRanker(
+            model,
+            self.gateway,
+            batch_size=int(os.getenv("QUALITY_RANKING_BATCH_SIZE", "8")),
+        )
 
+    def _completion_request(self, request) -> dict[str, Any]:
         prompt = {
             "claim": request.claim,
             "premise1": request.premise1,
             "premise2": request.premise2,
         }
 
+        # Enhanced OpenAI API call with function calling
+        return dict(
+            model=self.model,
+            messages=[{"role": "system", "content": json.dumps(prompt)}],
+            functions=evaluation_functions,
+        )
+
+    @timed_parse
+    def _explain_response(self, response) -> explanation_pb2.ExplainResponse:
+        # Handling the extracted JSON response
+        logger.debug("Completion: %s", response.choices[0].message.content)
+        evaluations = json.loads(response.choices[0].message.content)
+        dimension_name = "Standard Evaluation"
+
+        # Example logic to pick the global convincingness
+        if float(evaluations["premise1_score"]) > float(evaluations["premise2_score"]):
+            global_convincingness = explanation_pb2.PREMISE_CONVINCINGNESS_PREMISE_1
+        elif float(evaluations["premise1_score"]) == float(
+            evaluations["premise2_score"]
+        ):
+            global_convincingness = explanation_pb2.PREMISE_CONVINCINGNESS_UNSPECIFIED
+        else:
+            global_convincingness = explanation_pb2.PREMISE_CONVINCINGNESS_PREMISE_2
+        logger.debug("Global convincingness: %s", global_convincingness)
+        # Create the QualityDimension
+        quality_dimension = explanation_pb2.QualityDimension(
+            convincingness=global_convincingness,
+            premise1=float(evaluations["premise1_score"]),
+            premise2=float(evaluations["premise2_score"]),
+            explanation=evaluations["explanation"],
+            methods=["GPT-4 Evaluation"],
+        )
+        return explanation_pb2.ExplainResponse(
+            global_convincingness=global_convincingness,
+            dimensions={dimension_name: quality_dimension},
+        )
+
+    def _ranking_response(self, ranking) -> explanation_pb2.ExplainResponse:
+        extras = struct_pb2.Struct()
+        extras.update({"ranking": [dataclasses.asdict(premise) for premise in ranking]})
+        return explanation_pb2.ExplainResponse(extras=extras)
+
+    @single_flight
+    def _explain(self, request):
+        if (premises := _premises(request)) is not None:
+            return self._ranking_response(self.ranker.rank(request.claim, premises))
+
+        return self.gateway.complete(
+            parse=self._explain_response, **self._completion_request(request)
+        )
+
+    @propagate_deadline
+    def Explain(self, request, context):
         try:
-            # Enhanced OpenAI API call with function calling
-            response = openai.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "system", "content": json.dumps(prompt)}],
-                functions=evaluation_functions,
-            )
+            return self._explain(request)
+        except RequestAborted:
+            raise
+        except openai.RateLimitError as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(f"Upstream rate limit exceeded: {str(e)}")
+            return explanation_pb2.ExplainResponse()
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"An error occurred: {str(e)}")
+            return explanation_pb2.ExplainResponse()
 
-            # Handling the extracted JSON response
-            print(response.choices[0].message.content)
-            evaluations = json.loads(response.choices[0].message.content)
-            dimension_name = "Standard Evaluation"
-
-            # Example logic to pick the global convincingness
-            if float(evaluations["premise1_score"]) > float(
-                evaluations["premise2_score"]
-            ):
-                global_convincingness = explanation_pb2.PREMISE_CONVINCINGNESS_PREMISE_1
-            elif float(evaluations["premise1_score"]) == float(
-                evaluations["premise2_score"]
-            ):
-                global_convincingness = (
-                    explanation_pb2.PREMISE_CONVINCINGNESS_UNSPECIFIED
-                )
-            else:
-                global_convincingness = explanation_pb2.PREMISE_CONVINCINGNESS_PREMISE_2
-            print(global_convincingness)
-            # Create the QualityDimension
-            quality_dimension = explanation_pb2.QualityDimension(
-                convincingness=global_convincingness,
-                premise1=float(evaluations["premise1_score"]),
-                premise2=float(evaluations["premise2_score"]),
-                explanation=evaluations["explanation"],
-                methods=["GPT-4 Evaluation"],
-            )
-            return explanation_pb2.ExplainResponse(
-                global_convincingness=global_convincingness,
-                dimensions={dimension_name: quality_dimension},
+
+class AsyncQualityExplanationService(QualityExplanationService):
+    """`QualityExplanationService` for `grpc.aio` servers."""
+
+    @single_flight
+    async def _aexplain(self, request):
+        if (premises := _premises(request)) is not None:
+            return self._ranking_response(
+                await self.ranker.arank(request.claim, premises)
             )
+
+        return await self.gateway.acomplete(
+            parse=self._explain_response, **self._completion_request(request)
+        )
+
+    @propagate_deadline
+    async def Explain(self, request, context):
+        try:
+            return await self._aexplain(request)
+        except RequestAborted:
+            raise
+        except openai.RateLimitError as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(f"Upstream rate limit exceeded: {str(e)}")
+            return explanation_pb2.ExplainResponse()
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"An error occurred: {str(e)}")
             return explanation_pb2.ExplainResponse()
 
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+def add_servicers(server, asynchronous: bool = False) -> None:
+    servicer = (
+        AsyncQualityExplanationService()
+        if asynchronous
+        else QualityExplanationService()
+    )
     explanation_pb2_grpc.add_QualityExplanationServiceServicer_to_server(
-        QualityExplanationService(), server
+        servicer, server
     )
+
+
+def serve():
+    setup_from_env()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        interceptors=[MetricsInterceptor()],
+    )
+    add_servicers(server)
     server.add_insecure_port("[::]:50901")
     server.start()
     print("Server started, listening on port 50901")
     server.wait_for_termination()
 
 
+async def serve_async():
+    setup_from_env()
+    server = grpc.aio.server(interceptors=[AsyncMetricsInterceptor()])
+    add_servicers(server, asynchronous=True)
+    server.add_insecure_port("[::]:50901")
+    await server.start()
+    print("Server started (asyncio), listening on port 50901")
+    await server.wait_for_termination()
+
+
 if __name__ == "__main__":
-    serve()
+    if (processes := int(os.getenv("GRPC_PROCESSES", "1"))) > 1:
+        prefork.serve(add_servicers, "[::]:50901", processes)
+    elif os.getenv("GRPC_MODE", "sync") == "async":
+        asyncio.run(serve_async())
+    else:
+        serve()
@@ -0,0 +1,51 @@
+"""Local grouping of near-duplicate ADUs, so that only one ADU per group has to be
+sent to the model.
+
+ADUs are compared by the cosine similarity of their hashed TF-IDF vectors
+(see `common.similarity`), everything runs offline with NumPy.
+"""
+
+from collections import defaultdict
+from typing import Sequence
+
+import numpy as np
+
+from common.similarity import hashed_tfidf
+
+
+def group_near_duplicates(
+    texts: Sequence[str], threshold: float = 0.9
+) -> tuple[list[int], list[int]]:
+    """Group texts whose cosine similarity to the first text of a group reaches
+    `threshold`.
+
+    Returns the indices of the representatives (the first text of each group) and,
+    for every text, the position of its group in the representatives.
+    Texts that are equal apart from case and whitespace always share a group.
+    """
+
+    if not texts:
+        return [], []
+
+    same_text: defaultdict[str, list[int]] = defaultdict(list)
+
+    for idx, text in enumerate(texts):
+        same_text[" ".join(text.lower().split())].append(idx)
+
+    vectors = hashed_tfidf(texts)
+    similarities = vectors @ vectors.T
+    groups = np.full(len(texts), -1)
+    representatives: list[int] = []
+
+    for idx in range(len(texts)):
+        if groups[idx] >= 0:
+            continue
+
+        # all ungrouped texts close to this one join its group
+        members = similarities[idx] >= threshold
+        members[same_text[" ".join(texts[idx].lower().split())]] = True
+        members &= groups < 0
+        groups[members] = len(representatives)
+        representatives.append(idx)
+
+    return representatives, groups.tolist()
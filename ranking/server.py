@@ -1,10 +1,34 @@
+import asyncio
+import contextvars
+import functools
+import heapq
 import json
+import logging
+import os
+import statistics
+from collections import defaultdict, deque
 from concurrent import futures
+from typing import Any, Sequence, cast
 
 import grpc
 import openai
 from arg_services.ranking.v1beta import granularity_pb2, granularity_pb2_grpc
 
+from common import prefork
+from common.deadline import RequestAborted, propagate_deadline
+from common.gateway import LLMGateway, get_gateway
+from common.metrics import (
+    AsyncMetricsInterceptor,
+    MetricsInterceptor,
+    setup_from_env,
+    timed_parse,
+)
+from common.singleflight import single_flight
+from common.tokens import estimate_text_tokens, token_windows
+from ranking.dedup import group_near_duplicates
+
+logger = logging.getLogger(__name__)
+
 clustering_functions = [
     {
         "name": "cluster_adus",
@@ -51,54 +75,318 @@ clustering_functions = [
 ]
 
 
+_dimensions = ("stance", "frame", "meaning", "hierarchic")
+
+Scores = dict[str, float]
+
+
 class GranularityService(granularity_pb2_grpc.GranularityServiceServicer):
-    def FineGranularClustering(self, request, context):
-        openai.api_key = "key"
+    # shards are scored on threads, the async servicer gathers them instead
+    _threaded = True
 
-        clustering_input = {"query": request.query, "adus": list(request.adus)}
+    def __init__(
+        self,
+        model: str = "gpt-4",
+        gateway: LLMGateway | None = None,
+        shard_tokens: int | None = None,
+        max_concurrency: int = 8,
+        dedup_threshold: float | None = None,
+    ):
+        """If `shard_tokens` is set, ADU sets exceeding it are split into shards
+        of about that many tokens that are scored concurrently (see `_shards`).
+        If `dedup_threshold` is set, only one ADU of each group of near-duplicates
+        (see `ranking.dedup`) is scored and its scores are used for the whole group.
+        """
 
-        try:
-            response = openai.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "system", "content": json.dumps(clustering_input)}],
-                functions=clustering_functions,
+        super().__init__()
+        self.gateway = gateway or get_gateway()
+        self.model = self.gateway.resolve_model(model)
+        self.shard_tokens = shard_tokens
+        self.dedup_threshold = dedup_threshold
+        self.executor = (
+            futures.ThreadPoolExecutor(
+                max_workers=max_concurrency, thread_name_prefix="granularity"
+            )
+            if self._threaded
+            else None
+        )
+
+    def _completion_request(self, query: str, adus: Sequence[str]) -> dict[str, Any]:
+        clustering_input = {"query": query, "adus": list(adus)}
+
+        return dict(
+            model=self.model,
+            messages=[{"role": "system", "content": json.dumps(clustering_input)}],
+            functions=clustering_functions,
+        )
+
+    def _representatives(self, adus: Sequence[str]) -> tuple[list[str], list[int]]:
+        """ADUs to score and, for every ADU, the position of its representative."""
+
+        if self.dedup_threshold is None:
+            return list(adus), list(range(len(adus)))
+
+        representatives, groups = group_near_duplicates(adus, self.dedup_threshold)
+
+        return [adus[idx] for idx in representatives], groups
+
+    def _shards(self, adus: Sequence[str]) -> list[list[int]]:
+        """Indices of the ADUs per shard, each within the token budget.
+
+        Starting with as many shards as the budget requires, every ADU is added to
+        the shard with the fewest tokens so far, so that consecutive ADUs are
+        spread and every shard sees a similar mix, which the normalization of the
+        scores across shards relies on. If the ADU does not fit into that shard,
+        it fits into none and opens a new one. Only an ADU exceeding the budget on
+        its own makes a shard exceed it.
+        """
+
+        if self.shard_tokens is None:
+            return [list(range(len(adus)))]
+
+        count = len(token_windows(adus, estimate_text_tokens, self.shard_tokens))
+        shards: list[list[int]] = [[] for _ in range(count)]
+        loads = [(0, shard) for shard in range(count)]
+
+        for idx, adu in enumerate(adus):
+            tokens = estimate_text_tokens(adu)
+            load, shard = heapq.heappop(loads)
+
+            if shards[shard] and load + tokens > self.shard_tokens:
+                heapq.heappush(loads, (load, shard))
+                load, shard = 0, len(shards)
+                shards.append([])
+
+            shards[shard].append(idx)
+            heapq.heappush(loads, (load + tokens, shard))
+
+        return shards or [[]]
+
+    @timed_parse
+    def _clustering_scores(self, response, adus: Sequence[str]) -> list[Scores]:
+        """Scores of `adus` in their order, matched to the returned ADUs by text."""
+
+        logger.debug("Completion: %s", response.choices[0])
+        clustering_result = json.loads(response.choices[0].message.content)
+        returned: defaultdict[str, deque[Scores]] = defaultdict(deque)
+        unmatched: list[int] = []
+        scores: list[Scores | None] = []
+
+        for adu in clustering_result["adus"]:
+            returned[adu.get("text", "")].append(
+                {dimension: float(adu[dimension]) for dimension in _dimensions}
+            )
+
+        for idx, adu in enumerate(adus):
+            if returned[adu]:
+                scores.append(returned[adu].popleft())
+            else:
+                scores.append(None)
+                unmatched.append(idx)
+
+        # ADUs whose text the model did not repeat verbatim take the remaining
+        # scores in order
+        remaining = deque(entry for entries in returned.values() for entry in entries)
+
+        if len(remaining) < len(unmatched):
+            logger.warning(
+                "Model returned no scores for %d of %d ADUs",
+                len(unmatched) - len(remaining),
+                len(adus),
             )
 
-            print(response.choices[0])
-            clustering_result = json.loads(response.choices[0].message.content)
-            predictions = []
-
-            for adu in clustering_result["adus"]:
-                # Assuming each ADU now contains nested structures for 'stance', 'frame', etc.
-                # And assuming that 'stance', 'frame', 'meaning', and 'hierarchic' are now directly accessible
-                # as attributes of the ADU and no longer need complex processing or scoring extraction
-                prediction = granularity_pb2.GranularityPrediction(
-                    stance=float(adu["stance"]),
-                    frame=float(adu["frame"]),
-                    meaning=float(adu["meaning"]),
-                    hierarchic=float(adu["hierarchic"]),
+        for idx in unmatched:
+            scores[idx] = (
+                remaining.popleft()
+                if remaining
+                else {dimension: 0.0 for dimension in _dimensions}
+            )
+
+        return cast(list[Scores], scores)
+
+    @staticmethod
+    def _normalize(shard_scores: list[list[Scores]]) -> list[list[Scores]]:
+        """Map the scores of every shard onto the distribution of all shards.
+
+        Each shard is scored in isolation, so the model may use a different offset
+        and spread per shard. Per dimension, the scores of a shard are standardized
+        and rescaled to the mean and standard deviation of all scores. Scores of a
+        shard without spread (e.g., a single ADU) cannot be standardized and are
+        kept as they are instead of collapsing to the overall mean.
+        """
+
+        if len(shard_scores) < 2:
+            return shard_scores
+
+        normalized: list[list[Scores]] = [[{} for _ in shard] for shard in shard_scores]
+
+        for dimension in _dimensions:
+            values = [scores[dimension] for shard in shard_scores for scores in shard]
+            mean = statistics.fmean(values)
+            stdev = statistics.pstdev(values)
+
+            for shard, target in zip(shard_scores, normalized):
+                shard_values = [scores[dimension] for scores in shard]
+
+                if not shard_values:
+                    continue
+
+                shard_mean = statistics.fmean(shard_values)
+                shard_stdev = statistics.pstdev(shard_values)
+
+                for value, scores in zip(shard_values, target):
+                    scores[dimension] = (
+                        mean + (value - shard_mean) * stdev / shard_stdev
+                        if shard_stdev
+                        else value
+                    )
+
+        return normalized
+
+    def _clustering_response(
+        self,
+        shards: list[list[int]],
+        shard_scores: list[list[Scores]],
+        groups: list[int],
+    ) -> granularity_pb2.FineGranularClusteringResponse:
+        ordered: dict[int, Scores] = {}
+
+        for indices, scores in zip(shards, self._normalize(shard_scores)):
+            ordered.update(zip(indices, scores))
+
+        return granularity_pb2.FineGranularClusteringResponse(
+            predictions=[
+                granularity_pb2.GranularityPrediction(**ordered[group])
+                for group in groups
+            ]
+        )
+
+    def _score_shard(self, query: str, adus: Sequence[str]) -> list[Scores]:
+        return self.gateway.complete(
+            parse=functools.partial(self._clustering_scores, adus=adus),
+            **self._completion_request(query, adus),
+        )
+
+    async def _ascore_shard(self, query: str, adus: Sequence[str]) -> list[Scores]:
+        return await self.gateway.acomplete(
+            parse=functools.partial(self._clustering_scores, adus=adus),
+            **self._completion_request(query, adus),
+        )
+
+    @single_flight
+    def _cluster(self, request):
+        adus, groups = self._representatives(request.adus)
+        shards = self._shards(adus)
+
+        if len(shards) == 1:
+            shard_scores = [self._score_shard(request.query, adus)]
+        else:
+            # copy the context so that the workers see the deadline of the RPC
+            pending = [
+                self.executor.submit(
+                    contextvars.copy_context().run,
+                    self._score_shard,
+                    request.query,
+                    [adus[idx] for idx in shard],
                 )
-                predictions.append(prediction)
+                for shard in shards
+            ]
+            shard_scores = [future.result() for future in pending]
+
+        return self._clustering_response(shards, shard_scores, groups)
+
+    @propagate_deadline
+    def FineGranularClustering(self, request, context):
+        try:
+            return self._cluster(request)
+        except RequestAborted:
+            raise
+        except openai.RateLimitError as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(f"Upstream rate limit exceeded: {str(e)}")
+            return granularity_pb2.FineGranularClusteringResponse()
+        except Exception as e:
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(f"An error occurred: {str(e)}")
+            return granularity_pb2.FineGranularClusteringResponse()
+
+
+class AsyncGranularityService(GranularityService):
+    """`GranularityService` for `grpc.aio` servers."""
 
-            return granularity_pb2.FineGranularClusteringResponse(
-                predictions=predictions
+    _threaded = False
+
+    @single_flight
+    async def _acluster(self, request):
+        adus, groups = self._representatives(request.adus)
+        shards = self._shards(adus)
+        shard_scores = await asyncio.gather(
+            *(
+                self._ascore_shard(request.query, [adus[idx] for idx in shard])
+                for shard in shards
             )
+        )
+        return self._clustering_response(shards, list(shard_scores), groups)
+
+    @propagate_deadline
+    async def FineGranularClustering(self, request, context):
+        try:
+            return await self._acluster(request)
+        except RequestAborted:
+            raise
+        except openai.RateLimitError as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(f"Upstream rate limit exceeded: {str(e)}")
+            return granularity_pb2.FineGranularClusteringResponse()
         except Exception as e:
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"An error occurred: {str(e)}")
             return granularity_pb2.FineGranularClusteringResponse()
 
 
+def _options() -> dict[str, Any]:
+    return {
+        "shard_tokens": int(os.getenv("RANKING_SHARD_TOKENS", "0")) or None,
+        "dedup_threshold": float(os.getenv("RANKING_DEDUP_THRESHOLD", "0")) or None,
+    }
+
+
+def add_servicers(server, asynchronous: bool = False) -> None:
+    servicer = (
+        AsyncGranularityService(**_options())
+        if asynchronous
+        else GranularityService(**_options())
+    )
+    granularity_pb2_grpc.add_GranularityServiceServicer_to_server(servicer, server)
+
+
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    granularity_pb2_grpc.add_GranularityServiceServicer_to_server(
-        GranularityService(), server
+    setup_from_env()
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        interceptors=[MetricsInterceptor()],
     )
+    add_servicers(server)
     server.add_insecure_port("[::]:50902")
     server.start()
     print("Server started, listening on port 50902")
     server.wait_for_termination()
 
 
+async def serve_async():
+    setup_from_env()
+    server = grpc.aio.server(interceptors=[AsyncMetricsInterceptor()])
+    add_servicers(server, asynchronous=True)
+    server.add_insecure_port("[::]:50902")
+    await server.start()
+    print("Server started (asyncio), listening on port 50902")
+    await server.wait_for_termination()
+
+
 if __name__ == "__main__":
-    serve()
+    if (processes := int(os.getenv("GRPC_PROCESSES", "1"))) > 1:
+        prefork.serve(add_servicers, "[::]:50902", processes)
+    elif os.getenv("GRPC_MODE", "sync") == "async":
+        asyncio.run(serve_async())
+    else:
+        serve()
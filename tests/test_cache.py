@@ -0,0 +1,79 @@
+import os
+import time
+
+from common.cache import CompletionCache
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = CompletionCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_entries_expire_after_ttl():
+    cache = CompletionCache(ttl=0.05)
+    cache.set("a", "1")
+    assert cache.get("a") == "1"
+
+    time.sleep(0.1)
+
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_disk_tier_survives_restarts(tmp_path):
+    path = str(tmp_path / "cache.db")
+    CompletionCache(path=path).set("a", "1")
+    cache = CompletionCache(path=path)
+
+    assert cache.get("a") == "1"
+    assert cache.disk_hits == 1
+
+
+def test_disk_tier_evicts_least_recently_accessed(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = CompletionCache(path=path, max_disk_entries=2)
+
+    for key in "abc":
+        cache.set(key, key)
+
+    restarted = CompletionCache(path=path)
+
+    assert restarted.get("a") is None
+    assert restarted.get("c") == "c"
+
+
+def test_delete_removes_both_tiers(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = CompletionCache(path=path)
+    cache.set("a", "1")
+    cache.delete("a")
+
+    assert cache.get("a") is None
+    assert CompletionCache(path=path).get("a") is None
+
+
+def test_forked_process_opens_its_own_connection(tmp_path):
+    cache = CompletionCache(path=str(tmp_path / "cache.db"))
+    cache.set("a", "1")
+    pid = os.fork()
+
+    if pid == 0:
+        cache._memory.clear()
+        inherited = cache._db
+        ok = cache.get("a") == "1" and cache._db is not inherited
+        cache.set("b", "2")
+        os._exit(0 if ok else 1)
+
+    _, status = os.waitpid(pid, 0)
+    cache._memory.clear()
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert cache.get("b") == "2"
@@ -0,0 +1,78 @@
+import pytest
+
+from common.deadline import Deadline, DeadlineExceeded, RequestCancelled
+
+
+class SyncContext:
+    def __init__(self, remaining):
+        self.remaining = remaining
+        self.callbacks = []
+
+    def time_remaining(self):
+        return self.remaining
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+        return True
+
+
+class AsyncContext:
+    def __init__(self, remaining):
+        self.remaining = remaining
+
+    def time_remaining(self):
+        return self.remaining
+
+
+def test_sync_context_without_deadline():
+    # sync servers report about 2**63 ns instead of `None`
+    deadline = Deadline.from_context(SyncContext(9.2e18))
+
+    assert deadline.remaining() is None
+    assert deadline.cancellable
+
+
+def test_async_context_without_deadline():
+    deadline = Deadline.from_context(AsyncContext(None))
+
+    assert deadline.remaining() is None
+    assert not deadline.cancellable
+
+
+def test_context_with_deadline():
+    deadline = Deadline.from_context(SyncContext(5.0))
+
+    assert deadline.remaining() == pytest.approx(5.0, abs=0.1)
+
+
+def test_sync_context_cancels_deadline():
+    context = SyncContext(5.0)
+    deadline = Deadline.from_context(context)
+    cancelled = []
+    deadline.add_callback(lambda: cancelled.append(True))
+
+    for callback in context.callbacks:
+        callback()
+
+    assert cancelled == [True]
+
+    with pytest.raises(RequestCancelled):
+        deadline.check()
+
+
+def test_check_minimum_budget():
+    deadline = Deadline(0.5)
+    deadline.check(0.1)
+
+    with pytest.raises(DeadlineExceeded):
+        deadline.check(1.0)
+
+
+def test_removed_callback_is_not_called():
+    deadline = Deadline(cancellable=True)
+    called = []
+    remove = deadline.add_callback(lambda: called.append(True))
+    remove()
+    deadline.cancel()
+
+    assert not called
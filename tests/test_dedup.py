@@ -0,0 +1,32 @@
+from ranking.dedup import group_near_duplicates
+
+
+def test_equal_texts_share_a_group():
+    representatives, groups = group_near_duplicates(
+        ["Taxes should rise.", "taxes  SHOULD rise.", "Cats are great pets."]
+    )
+
+    assert representatives == [0, 2]
+    assert groups == [0, 0, 1]
+
+
+def test_near_duplicates_join_the_first_text():
+    texts = [
+        "Nuclear power plants produce very little carbon dioxide",
+        "Nuclear power plants produce very little carbon dioxide at all",
+        "Public transport should be free for students",
+    ]
+    representatives, groups = group_near_duplicates(texts, threshold=0.8)
+
+    assert representatives == [0, 2]
+    assert groups == [0, 0, 1]
+
+
+def test_distinct_texts_stay_apart():
+    texts = ["Taxes should rise.", "Cats are great pets.", "The sky is blue."]
+
+    assert group_near_duplicates(texts, threshold=0.9) == ([0, 1, 2], [0, 1, 2])
+
+
+def test_no_texts():
+    assert group_near_duplicates([]) == ([], [])
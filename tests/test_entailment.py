@@ -0,0 +1,40 @@
+import pytest
+
+from common.gateway import LLMGateway
+from mining.entailment.model import EntailmentClassifier, Relation
+
+ADUS = {"a": "A", "b": "B", "c": "C"}
+
+
+@pytest.fixture
+def classifier():
+    return EntailmentClassifier(gateway=LLMGateway(api_key="test", cache=None))
+
+
+def relation(source: str, target: str) -> Relation:
+    return Relation(source=source, target=target, type="support")
+
+
+def test_merge_drops_cycles(classifier):
+    merged = classifier._merge(
+        ADUS,
+        [[relation("a", "b"), relation("b", "c")], [relation("c", "a")]],
+    )
+
+    assert merged == [relation("a", "b"), relation("b", "c")]
+
+
+def test_merge_keeps_relations_of_overlapping_windows_once(classifier):
+    merged = classifier._merge(
+        ADUS, [[relation("a", "b")], [relation("a", "b"), relation("c", "b")]]
+    )
+
+    assert merged == [relation("a", "b"), relation("c", "b")]
+
+
+def test_merge_drops_unknown_and_self_relations(classifier):
+    merged = classifier._merge(
+        ADUS, [[relation("a", "a"), relation("a", "x"), relation("b", "a")]]
+    )
+
+    assert merged == [relation("b", "a")]
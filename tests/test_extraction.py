@@ -0,0 +1,60 @@
+from mining.extraction.model import ADU, Extractor
+
+TEXT = "First claim. Second claim. Third claim. Fourth claim."
+WINDOWS = [(0, 26), (13, len(TEXT))]
+
+
+def adus(*texts: str) -> list[ADU]:
+    return [ADU(text=text) for text in texts]
+
+
+def test_merge_keeps_adus_of_overlapping_windows_once():
+    merged, spans = Extractor._merge(
+        WINDOWS,
+        [
+            adus("First claim.", "Second claim."),
+            adus("Second claim.", "Third claim.", "Fourth claim."),
+        ],
+        TEXT,
+    )
+
+    assert [adu.text for adu in merged] == [
+        "First claim.",
+        "Second claim.",
+        "Third claim.",
+        "Fourth claim.",
+    ]
+    assert spans == [(0, 12), (13, 26), (27, 39), (40, 53)]
+
+
+def test_merge_drops_adus_mostly_overlapping_their_predecessor():
+    merged, spans = Extractor._merge(
+        WINDOWS,
+        [adus("Second claim."), adus("Second claim. Third", "Fourth claim.")],
+        TEXT,
+    )
+
+    assert spans == [(13, 26), (40, 53)]
+
+
+def test_merge_orders_by_offset():
+    merged, _ = Extractor._merge(
+        WINDOWS, [adus("Second claim.", "First claim."), adus("Fourth claim.")], TEXT
+    )
+
+    assert [adu.text for adu in merged] == [
+        "First claim.",
+        "Second claim.",
+        "Fourth claim.",
+    ]
+
+
+def test_merge_appends_unlocated_adus_once():
+    merged, spans = Extractor._merge(
+        WINDOWS,
+        [adus("First claim.", "Not in the text"), adus("not in  the TEXT")],
+        TEXT,
+    )
+
+    assert [adu.text for adu in merged] == ["First claim.", "Not in the text"]
+    assert spans == [(0, 12), None]
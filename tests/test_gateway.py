@@ -0,0 +1,83 @@
+import pytest
+
+from benchmarks.mock_server import MockOpenAI
+from common.cache import CompletionCache
+from common.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    RequestCancelled,
+    current_deadline,
+)
+from common.gateway import LLMGateway
+
+REQUEST = dict(model="mock", messages=[{"role": "user", "content": "{}"}])
+
+
+class SyncContext:
+    """Sync servicer context of an RPC without deadline."""
+
+    def time_remaining(self):
+        return 9.2e18
+
+    def add_callback(self, callback):
+        return True
+
+
+@pytest.fixture
+def mock():
+    with MockOpenAI(latency=0.0, jitter=0.0) as mock:
+        yield mock
+
+
+@pytest.fixture
+def gateway(mock):
+    return LLMGateway(api_key="test", base_url=mock.url, cache=None, timeout=30.0)
+
+
+def test_sync_rpc_without_deadline(mock, gateway):
+    token = current_deadline.set(Deadline.from_context(SyncContext()))
+
+    try:
+        completion = gateway.complete(**REQUEST)
+    finally:
+        current_deadline.reset(token)
+
+    assert completion.choices[0].message.content is not None
+    assert mock.requests == 1
+
+
+def test_timeout_is_clamped_to_gateway_timeout(gateway):
+    assert gateway._options(Deadline(1000.0)) == {"timeout": 30.0}
+    assert gateway._options(Deadline(10.0))["timeout"] == pytest.approx(10, abs=0.1)
+    assert gateway._options(Deadline()) == {}
+
+
+def test_expired_deadline_makes_no_upstream_call(mock, gateway):
+    with pytest.raises(DeadlineExceeded):
+        gateway.complete(deadline=Deadline(0.5), **REQUEST)
+
+    assert mock.requests == 0
+
+
+def test_cancelled_rpc_makes_no_upstream_call(mock, gateway):
+    deadline = Deadline(cancellable=True)
+    deadline.cancel()
+
+    with pytest.raises(RequestCancelled):
+        gateway.complete(deadline=deadline, **REQUEST)
+
+    assert mock.requests == 0
+
+
+def test_failed_parse_is_not_cached(mock, gateway):
+    gateway.cache = CompletionCache()
+
+    def fail(completion):
+        raise ValueError("malformed")
+
+    with pytest.raises(ValueError):
+        gateway.complete(parse=fail, **REQUEST)
+
+    gateway.complete(**REQUEST)
+
+    assert mock.requests == 2
@@ -0,0 +1,82 @@
+from common.gateway import LLMGateway
+from quality.pairwise import PairwiseRanker, _Standings
+
+
+def _play(standings: _Standings, rounds: int) -> list[list[tuple[int, int]]]:
+    """Play `rounds` rounds in which the premise with the lower index always wins."""
+
+    played = []
+
+    for _ in range(rounds):
+        pairs = standings.pairings()
+        played.append(pairs)
+
+        for first, second in pairs:
+            standings.record(
+                (first, second), (1.0, 0.0) if first < second else (0.0, 1.0)
+            )
+
+    return played
+
+
+def test_every_premise_is_paired_once_per_round():
+    for pairs in _play(_Standings(8), 4):
+        premises = [idx for pair in pairs for idx in pair]
+
+        assert sorted(premises) == list(range(8))
+
+
+def test_pairs_are_not_repeated():
+    # the greedy pairing may have to repeat a pair once opponents run out, which
+    # does not happen within the first three rounds of eight premises
+    played = [
+        tuple(sorted(pair)) for pairs in _play(_Standings(8), 3) for pair in pairs
+    ]
+
+    assert len(played) == len(set(played))
+
+
+def test_winners_meet_winners():
+    standings = _Standings(8)
+    _play(standings, 1)
+    pairs = standings.pairings()
+
+    # after the first round, the four winners play among themselves
+    assert all(
+        standings.points[first] == standings.points[second] for first, second in pairs
+    )
+
+
+def test_byes_rotate_and_count_neutrally():
+    standings = _Standings(5)
+    byes = []
+
+    for pairs in _play(standings, 4):
+        (bye,) = set(range(5)) - {idx for pair in pairs for idx in pair}
+        byes.append(bye)
+
+    assert len(set(byes)) == 4
+    assert sum(standings.games) == 2 * 2 * 4
+    assert sum(standings.points) == 2 * 4
+
+
+def test_bye_is_taken_from_odd_score_group():
+    standings = _Standings(5)
+    # 0 and 1 won, 2 and 3 lost, 4 had the bye
+    standings.record((0, 2), (1.0, 0.0))
+    standings.record((1, 3), (1.0, 0.0))
+    standings.byes.add(4)
+    pairs = standings.pairings()
+    paired = {idx for pair in pairs for idx in pair}
+
+    # 4 stays on 0.5 as the only premise of its group, but already had a bye
+    assert len(paired) == 4
+    assert 4 in paired
+
+
+def test_premise_without_comparisons_scores_average():
+    ranker = PairwiseRanker(gateway=LLMGateway(api_key="test", cache=None))
+    (ranked,) = ranker.rank("claim", ["only premise"])
+
+    assert ranked.score == 0.5
+    assert ranked.comparisons == 0
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+
+import pytest
+
+from common.ratelimit import AdaptiveConcurrency, TokenBucket
+
+
+def test_token_bucket_waits_for_debt():
+    bucket = TokenBucket(per_minute=60)
+
+    assert bucket.reserve(60) == 0.0
+    # one unit per second refills the overdrawn 30 units
+    assert bucket.reserve(30) == pytest.approx(30, abs=0.1)
+
+
+def test_token_bucket_refund():
+    bucket = TokenBucket(per_minute=60)
+    bucket.reserve(60)
+    bucket.refund(60)
+
+    assert bucket.reserve(60) == 0.0
+
+
+def test_concurrency_acquire_times_out_without_waiting_forever():
+    limiter = AdaptiveConcurrency(initial=1)
+
+    assert limiter.acquire()
+    assert not limiter.acquire(timeout=0.05)
+    assert not limiter._waiters
+    assert limiter.in_flight == 1
+
+
+def test_concurrency_hands_slot_over_to_waiter():
+    limiter = AdaptiveConcurrency(initial=1)
+    limiter.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(limiter.acquire(5)))
+    waiter.start()
+
+    limiter.release(0.1)
+    waiter.join()
+
+    assert acquired == [True]
+    assert limiter.in_flight == 1
+
+
+def test_concurrency_additive_increase():
+    limiter = AdaptiveConcurrency(initial=2)
+    limiter.acquire()
+    limiter.release(0.1)
+
+    assert limiter.limit == 2.5
+
+
+def test_concurrency_multiplicative_decrease():
+    limiter = AdaptiveConcurrency(initial=8, minimum=3)
+
+    limiter.acquire()
+    limiter.release(0.1, throttled=True)
+    assert limiter.limit == 4
+
+    # calls started before the last decrease do not decrease again
+    limiter.acquire()
+    limiter.release(10.0, throttled=True)
+    assert limiter.limit == 4
+
+
+def test_concurrency_decrease_respects_minimum():
+    limiter = AdaptiveConcurrency(initial=4, minimum=3)
+    limiter.acquire()
+    limiter.release(0.1, throttled=True)
+
+    assert limiter.limit == 3
+
+
+def test_concurrency_slow_calls_decrease():
+    limiter = AdaptiveConcurrency(initial=8, target_latency=1.0)
+    limiter.acquire()
+    limiter.release(2.0)
+
+    assert limiter.limit == 4
+
+
+def test_concurrency_failed_calls_keep_limit():
+    limiter = AdaptiveConcurrency(initial=2)
+    limiter.acquire()
+    limiter.release(0.1, failed=True)
+
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
+
+
+def test_concurrency_async_waiter():
+    async def main():
+        limiter = AdaptiveConcurrency(initial=1)
+        await limiter.aacquire()
+        waiter = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        limiter.release(0.1)
+        await asyncio.wait_for(waiter, 1)
+
+        return limiter.in_flight
+
+    assert asyncio.run(main()) == 1
+
+
+def test_concurrency_cancelled_async_waiter_leaves_no_slot():
+    async def main():
+        limiter = AdaptiveConcurrency(initial=1)
+        await limiter.aacquire()
+        waiter = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+        limiter.release(0.1)
+
+        return limiter.in_flight, len(limiter._waiters)
+
+    assert asyncio.run(main()) == (0, 0)
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from common.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    RequestCancelled,
+    current_deadline,
+)
+from common.singleflight import SingleFlight
+
+
+def _lead(flights: SingleFlight, fn) -> threading.Thread:
+    """Start a leader computing `fn` and wait until it is registered."""
+
+    def run() -> None:
+        try:
+            flights.do("test", "key", fn)
+        except DeadlineExceeded:
+            pass
+
+    leader = threading.Thread(target=run)
+    leader.start()
+
+    while "key" not in flights._pending:
+        time.sleep(0.01)
+
+    return leader
+
+
+def _follow(flights: SingleFlight, deadline: Deadline | None, fn):
+    token = current_deadline.set(deadline)
+
+    try:
+        return flights.do("test", "key", fn)
+    finally:
+        current_deadline.reset(token)
+
+
+def test_followers_share_the_result():
+    flights = SingleFlight()
+    calls = []
+
+    def compute():
+        calls.append(True)
+        time.sleep(0.2)
+        return 42
+
+    leader = _lead(flights, compute)
+    result = _follow(flights, None, compute)
+    leader.join()
+
+    assert result == 42
+    assert len(calls) == 1
+    assert flights.stats() == {"test": {"calls": 2, "saved": 1}}
+
+
+def test_follower_computes_itself_if_leader_is_aborted():
+    flights = SingleFlight()
+
+    def aborted():
+        time.sleep(0.1)
+        raise DeadlineExceeded("leader expired")
+
+    leader = _lead(flights, aborted)
+    result = _follow(flights, None, lambda: 42)
+    leader.join()
+
+    assert result == 42
+
+
+def test_follower_honours_its_deadline():
+    flights = SingleFlight()
+    leader = _lead(flights, lambda: time.sleep(1))
+    start = time.monotonic()
+
+    with pytest.raises(DeadlineExceeded):
+        _follow(flights, Deadline(0.1), lambda: None)
+
+    assert time.monotonic() - start < 0.5
+    leader.join()
+
+
+def test_follower_honours_cancellation():
+    flights = SingleFlight()
+    leader = _lead(flights, lambda: time.sleep(1))
+    deadline = Deadline(cancellable=True)
+    threading.Timer(0.1, deadline.cancel).start()
+
+    with pytest.raises(RequestCancelled):
+        _follow(flights, deadline, lambda: None)
+
+    leader.join()
+
+
+def test_async_followers_share_the_result():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(True)
+        await asyncio.sleep(0.1)
+        return 42
+
+    async def main():
+        return await asyncio.gather(
+            *(flights.ado("test", "key", compute) for _ in range(3))
+        )
+
+    assert asyncio.run(main()) == [42, 42, 42]
+    assert len(calls) == 1
+
+
+def test_async_follower_honours_its_deadline():
+    flights = SingleFlight()
+
+    async def follow():
+        current_deadline.set(Deadline(0.1))
+        return await flights.ado("test", "key", lambda: asyncio.sleep(1, 42))
+
+    async def main():
+        leader = asyncio.ensure_future(
+            flights.ado("test", "key", lambda: asyncio.sleep(1, 42))
+        )
+        await asyncio.sleep(0)
+
+        with pytest.raises(DeadlineExceeded):
+            await follow()
+
+        # the leader is not affected by the follower giving up
+        return await leader
+
+    assert asyncio.run(main()) == 42
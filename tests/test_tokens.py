@@ -0,0 +1,32 @@
+from common.tokens import token_windows
+
+
+def test_windows_respect_budget():
+    windows = token_windows(list(range(10)), lambda item: 3, budget=10)
+
+    assert windows == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+
+
+def test_windows_repeat_overlap():
+    windows = token_windows(list(range(6)), lambda item: 1, budget=3, overlap=1)
+
+    assert windows == [[0, 1, 2], [2, 3, 4], [4, 5]]
+    assert all(len(window) <= 3 for window in windows)
+
+
+def test_overlap_shrinks_to_make_room():
+    costs = {"a": 2, "b": 2, "c": 4}
+    windows = token_windows(list(costs), costs.__getitem__, budget=4, overlap=1)
+
+    assert windows == [["a", "b"], ["c"]]
+
+
+def test_oversized_item_gets_own_window():
+    costs = {"a": 1, "b": 10, "c": 1}
+    windows = token_windows(list(costs), costs.__getitem__, budget=5)
+
+    assert windows == [["a"], ["b"], ["c"]]
+
+
+def test_no_items():
+    assert token_windows([], lambda item: 1, budget=5) == []